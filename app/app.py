@@ -1,16 +1,32 @@
-from flask import Flask, render_template, jsonify, Response, abort, send_from_directory
+from flask import Flask, render_template, jsonify, Response, abort, send_from_directory, request, stream_with_context, g, url_for
 import os
+import json
 import yaml
-from datetime import datetime
-from icalendar import Calendar, Event
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from itertools import repeat
+from multiprocessing import get_all_start_methods, get_context
+from datetime import datetime, timezone
 from geopy.geocoders import Nominatim
-import json
 import time
+import collections
+import contextlib
 
 import threading
 
+from calendar_feed import IcsFeed
+from http_cache import Representation, ResponseCache
+from payloads import FORMATS, VIEWS, normalize, summarize, project
+from indexes import EventIndex, SearchIndex, SpatialIndex, FACETS, FLAGS, event_date, decode_cursor, parse_bbox
+from snapshot import read_snapshot
+from geocoding import GeocodeCache, GeocodeWorker, Gazetteer, GeocoderChain, RateLimitedGeocoder, TokenBucket, FileRateLimiter
+from coordination import SharedVersion, fcntl, signatures_digest
+from metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
 app = Flask(__name__)
 
+# Timings of the processing steps and cache counters of this process, served at /metrics
+metrics = Metrics()
+
 # Determine base data directory
 # Docker environment usually has /app/data mounted
 if os.path.exists('/app/data/events'):
@@ -30,71 +46,241 @@ CACHE_DIR = os.path.join(DATA_ROOT, '.cache')
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
+# Compiled catalog (see snapshot.py), loaded at startup when it matches the data directory
+SNAPSHOT_FILE = os.environ.get('CATALOG_SNAPSHOT', os.path.join(CACHE_DIR, 'catalog.snapshot'))
+
+# Number of catalog revisions /api/events/changes can go back
+CHANGES_HISTORY = int(os.environ.get('CATALOG_CHANGES_HISTORY', '100'))
+
 geolocator = Nominatim(user_agent="opentrack-web")
 
-# Lock for cache file operations
-cache_lock = threading.Lock()
+# Offline city/country centroids: the bundled table plus the countries of the data directory
+gazetteer = Gazetteer()
+gazetteer.load_csv(os.environ.get('GAZETTEER_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')))
 
-def get_coordinates(address, city, country, async_fetch=False):
-    cache_file = os.path.join(CACHE_DIR, 'geocoding_cache.json')
-    query = f"{address}, {city}, {country}"
-    
-    with cache_lock:
-        cache = {}
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'r') as f:
-                    cache = json.load(f)
-            except Exception:
-                pass
-        
-        if query in cache:
-            return cache[query]
-    
-    if async_fetch:
-        # Start a background thread to fetch and cache the coordinates
-        thread = threading.Thread(target=fetch_and_cache_coordinates, args=(address, city, country, query, cache_file))
-        thread.start()
-        return None
 
-    return fetch_and_cache_coordinates(address, city, country, query, cache_file)
+def build_geocoder(names):
+    """
+    Builds the geocoder chain from a comma-separated list of backend names ('gazetteer', 'nominatim').
+    Offline backends answer inline; online backends run on the background worker, in the given order.
+    """
+    backends = []
+    for name in filter(None, (n.strip() for n in names.split(','))):
+        if name == 'gazetteer':
+            backends.append(gazetteer)
+        elif name == 'nominatim':
+            # Nominatim allows at most one request per second, shared by all worker processes
+            rate = float(os.environ.get('GEOCODE_RATE_LIMIT', '1'))
+            if fcntl is not None:
+                limiter = FileRateLimiter(os.path.join(CACHE_DIR, 'nominatim.ratelimit'), rate)
+            else:
+                limiter = TokenBucket(rate=rate)
+            backends.append(RateLimitedGeocoder(geolocator, limiter))
+        else:
+            raise ValueError(f"Unknown geocoder backend: {name}")
+    return GeocoderChain(backends)
+
+
+geocoder = build_geocoder(os.environ.get('GEOCODER_BACKENDS', 'gazetteer,nominatim'))
+
+# Geocoding results (including failed lookups) are kept in memory and persisted to SQLite
+geocode_cache = GeocodeCache(
+    os.path.join(CACHE_DIR, 'geocoding.sqlite3'),
+    negative_ttl=float(os.environ.get('GEOCODE_NEGATIVE_TTL', '86400')),
+    legacy_json_path=os.path.join(CACHE_DIR, 'geocoding_cache.json'),
+)
 
-def fetch_and_cache_coordinates(address, city, country, query, cache_file):
-    # Try multiple queries from most specific to least specific
-    queries = [
+# A single background worker resolves missing coordinates, shared by all requests
+geocode_worker = GeocodeWorker(geocoder, geocode_cache, error_ttl=float(os.environ.get('GEOCODE_ERROR_TTL', '300')))
+
+def geocode_candidates(address, city, country):
+    """
+    Returns the search strings for an address, from most specific to least specific.
+    The first one doubles as the cache key for the address.
+    """
+    return [
         f"{address}, {city}, {country}",
         f"{city}, {country}"
     ]
-    
-    for q in queries:
+
+def known_coordinates(address, city, country):
+    """
+    Looks up an address in the geocoding cache and the offline backends, without any network access.
+    Returns (coords, final): `final` is False if an online backend should still be asked, in which case
+    `coords` may hold a coarse country-level guess in the meantime.
+    """
+    query = geocode_candidates(address, city, country)[0]
+    found, coords = geocode_cache.lookup(query)
+    metrics.count('geocode', hits=int(found), misses=int(not found))
+    if coords:
+        return coords, True
+
+    location = geocoder.geocode_offline(query)
+    if location:
+        coords = {'latitude': location.latitude, 'longitude': location.longitude}
+    # City matches are good enough for the map; country centroids are refined online if possible
+    final = found or not geocoder.online or (location is not None and location.precision == 'city')
+    return coords, final
+
+# Whether linking an event queues its missing coordinates for background geocoding. The gunicorn master
+# turns it off while it preloads the catalog, so it never starts a geocoding thread before forking, and
+# so do the export and snapshot commands, which only geocode online when asked to.
+# The workers still geocode those addresses when the coordinates are requested.
+GEOCODE_ON_LINK = True
+
+
+@contextlib.contextmanager
+def link_geocoding_disabled():
+    """Turns GEOCODE_ON_LINK off for a block, e.g. to build a catalog without starting the geocoding thread."""
+    global GEOCODE_ON_LINK
+    enabled, GEOCODE_ON_LINK = GEOCODE_ON_LINK, False
+    try:
+        yield
+    finally:
+        GEOCODE_ON_LINK = enabled
+
+
+def get_coordinates(address, city, country, async_fetch=False):
+    coords, final = known_coordinates(address, city, country)
+    if final:
+        return coords
+
+    candidates = geocode_candidates(address, city, country)
+    if async_fetch:
+        # Let the background worker fetch and cache the coordinates
+        geocode_worker.submit(candidates[0], candidates)
+        return coords
+
+    return geocode_worker.resolve(candidates[0], candidates) or coords
+
+
+def event_address(loc, countries):
+    """Returns the (address, city, country name) used to geocode an event location."""
+    country_code = str(loc.get('country', '')).lower()
+    country_name = country_code
+    if 'country_details' in loc:
+        country_name = loc['country_details'].get('name', country_name)
+
+    # Use the country details we already loaded if possible
+    country_data = countries.get(country_code, {"name": country_name})
+    return loc.get('address', ''), loc.get('city', ''), country_data.get("name", country_name)
+
+
+# Parsed item directories, keyed by collection and then by directory path.
+# Each entry is (signature, data) where the signature holds the (name, mtime, size) of every file
+# in the directory, so an item is only reparsed when one of its files was added, removed or modified.
+_item_records = {}
+
+# Linked events from the previous load_events() call, keyed by directory path.
+# Each entry is (references, event) where references are the parsed records the event was linked against.
+_linked_events = {}
+
+
+def _item_signature(item_path):
+    signature = []
+    try:
+        with os.scandir(item_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    signature.append((entry.name, st.st_mtime_ns, st.st_size))
+    except OSError:
+        return None
+    return tuple(sorted(signature))
+
+
+# libyaml's C parser is several times faster than the pure-Python one; both build the same safe types
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Batches of at least this many changed directories are parsed in PARSE_WORKERS processes
+PARSE_POOL_MIN = int(os.environ.get('PARSE_POOL_MIN', '256'))
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(os.cpu_count() or 1)))
+# Forking a process that runs server and geocoding threads can copy a lock another thread holds,
+# so the parse processes are started by a single-threaded fork server where the platform has one
+PARSE_START_METHOD = 'forkserver' if 'forkserver' in get_all_start_methods() else None
+
+
+def parse_yaml(stream):
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def _read_item(item_path, yaml_name, with_description=False):
+    """
+    Parses the YAML file (and optionally description.md) of a single item directory.
+    Returns a (data, error) tuple; data is None if the directory has no valid YAML file.
+    Only takes and returns plain values, so it can run in a worker process.
+    """
+    yaml_path = os.path.join(item_path, yaml_name)
+    if not os.path.exists(yaml_path):
+        return None, None
+
+    with open(yaml_path, 'r') as f:
         try:
-            print(f"Attempting geocoding for: {q}")
-            location = geolocator.geocode(q)
-            if location:
-                coords = {'latitude': location.latitude, 'longitude': location.longitude}
-                
-                with cache_lock:
-                    cache = {}
-                    if os.path.exists(cache_file):
-                        try:
-                            with open(cache_file, 'r') as f:
-                                cache = json.load(f)
-                        except Exception:
-                            pass
-                    
-                    cache[query] = coords # Cache the original full query
-                    with open(cache_file, 'w') as f:
-                        json.dump(cache, f)
-                
-                print(f"Successfully geocoded: {q} -> {coords}")
-                time.sleep(1) # Respect Nominatim's usage policy
-                return coords
-        except Exception as e:
-            print(f"Geocoding error for {q}: {e}")
-            time.sleep(1)
-    
-    print(f"Failed to geocode any query for: {query}")
-    return None
+            data = parse_yaml(f)
+            data['id'] = os.path.basename(item_path)
+
+            # Load detailed description from Markdown file
+            description_path = os.path.join(item_path, 'description.md')
+            if with_description and os.path.exists(description_path):
+                with open(description_path, 'r') as df:
+                    data['description'] = df.read()
+        except yaml.YAMLError as exc:
+            return None, f"Error parsing {yaml_path}: {exc}"
+    return data, None
+
+
+def _read_items(item_paths, yaml_name, with_description=False):
+    """Parses item directories, in a process pool for large batches. Results are in the order of `item_paths`."""
+    if len(item_paths) < PARSE_POOL_MIN or PARSE_WORKERS < 2:
+        return [_read_item(item_path, yaml_name, with_description) for item_path in item_paths]
+
+    chunksize = max(1, len(item_paths) // (PARSE_WORKERS * 4))
+    with ProcessPoolExecutor(PARSE_WORKERS, mp_context=get_context(PARSE_START_METHOD)) as pool:
+        return list(pool.map(_read_item, item_paths, repeat(yaml_name), repeat(with_description), chunksize=chunksize))
+
+
+def _load_items(item_paths, yaml_name, previous, with_description=False):
+    """
+    Loads item directories, reusing the parsed data in `previous` for directories whose files did not change.
+    Returns the new cache records: a dictionary of directory -> (signature, data) in the order of `item_paths`,
+    where data is None for directories without a valid YAML file.
+    """
+    records = {}
+    stale = []
+    for item_path in item_paths:
+        signature = _item_signature(item_path)
+        cached = previous.get(item_path)
+        if cached is not None and cached[0] == signature:
+            records[item_path] = cached
+        else:
+            records[item_path] = (signature, None)
+            stale.append(item_path)
+
+    metrics.count('items', hits=len(item_paths) - len(stale), misses=len(stale))
+    if not stale:
+        return records
+    with metrics.phase('parse'):
+        results = _read_items(stale, yaml_name, with_description)
+    for item_path, (data, error) in zip(stale, results):
+        if error:
+            print(error)
+        records[item_path] = (records[item_path][0], data)
+    return records
+
+
+def _load_collection(base_dir, yaml_name, with_description=False):
+    """
+    Loads every item directory below `base_dir`, reparsing only the directories that changed since the last call.
+    Returns a dictionary of parsed items with their lowercased directory name as the key.
+    """
+    item_paths = []
+    if os.path.exists(base_dir):
+        item_paths = [os.path.join(base_dir, item) for item in os.listdir(base_dir)]
+        item_paths = [item_path for item_path in item_paths if os.path.isdir(item_path)]
+    records = _load_items(item_paths, yaml_name, _item_records.get(base_dir, {}), with_description)
+    # Replacing the records drops directories that were deleted in the meantime
+    _item_records[base_dir] = records
+    return {os.path.basename(item_path).lower(): data for item_path, (_, data) in records.items() if data is not None}
 
 
 def load_organizers():
@@ -102,35 +288,13 @@ def load_organizers():
     Loads all organizers from the data/organizers directory.
     Each organizer is stored in its own subdirectory with an organizer.yaml and description.md file.
     Returns a dictionary of organizers with their directory name as the key.
+    Unchanged directories are served from the previous load, so callers must not modify the returned data.
     """
-    organizers = {}
-    if not os.path.exists(ORGANIZERS_DIR):
-        return organizers
-
-    for item in os.listdir(ORGANIZERS_DIR):
-        item_path = os.path.join(ORGANIZERS_DIR, item)
-        if os.path.isdir(item_path):
-            yaml_path = os.path.join(item_path, 'organizer.yaml')
-            if os.path.exists(yaml_path):
-                with open(yaml_path, 'r') as f:
-                    try:
-                        org_data = yaml.safe_load(f)
-                        org_data['id'] = item
-
-                        # Load detailed description from Markdown file
-                        description_path = os.path.join(item_path, 'description.md')
-                        if os.path.exists(description_path):
-                            with open(description_path, 'r') as df:
-                                org_data['description'] = df.read()
-
-                        # Check if image exists
-                        image_path = os.path.join(item_path, 'image.png')
-                        if os.path.exists(image_path):
-                            org_data['image_url'] = f'/organizer/{item}/image.png'
-
-                        organizers[item.lower()] = org_data
-                    except yaml.YAMLError as exc:
-                        print(f"Error parsing {yaml_path}: {exc}")
+    organizers = _load_collection(ORGANIZERS_DIR, 'organizer.yaml', with_description=True)
+    for org_data in organizers.values():
+        # Check if image exists (part of the directory signature, so this stays in sync with the cache)
+        if 'image_url' not in org_data and os.path.exists(os.path.join(ORGANIZERS_DIR, org_data['id'], 'image.png')):
+            org_data['image_url'] = f"/organizer/{org_data['id']}/image.png"
     return organizers
 
 
@@ -139,23 +303,7 @@ def load_languages():
     Loads all languages from the data/languages directory.
     Returns a dictionary of languages with their directory name as the key.
     """
-    languages = {}
-    if not os.path.exists(LANGUAGES_DIR):
-        return languages
-
-    for item in os.listdir(LANGUAGES_DIR):
-        item_path = os.path.join(LANGUAGES_DIR, item)
-        if os.path.isdir(item_path):
-            yaml_path = os.path.join(item_path, 'language.yaml')
-            if os.path.exists(yaml_path):
-                with open(yaml_path, 'r') as f:
-                    try:
-                        lang_data = yaml.safe_load(f)
-                        lang_data['id'] = item
-                        languages[item.lower()] = lang_data
-                    except yaml.YAMLError as exc:
-                        print(f"Error parsing {yaml_path}: {exc}")
-    return languages
+    return _load_collection(LANGUAGES_DIR, 'language.yaml')
 
 
 def load_currencies():
@@ -163,23 +311,7 @@ def load_currencies():
     Loads all currencies from the data/currencies directory.
     Returns a dictionary of currencies with their directory name as the key.
     """
-    currencies = {}
-    if not os.path.exists(CURRENCIES_DIR):
-        return currencies
-
-    for item in os.listdir(CURRENCIES_DIR):
-        item_path = os.path.join(CURRENCIES_DIR, item)
-        if os.path.isdir(item_path):
-            yaml_path = os.path.join(item_path, 'currency.yaml')
-            if os.path.exists(yaml_path):
-                with open(yaml_path, 'r') as f:
-                    try:
-                        currency_data = yaml.safe_load(f)
-                        currency_data['id'] = item
-                        currencies[item.lower()] = currency_data
-                    except yaml.YAMLError as exc:
-                        print(f"Error parsing {yaml_path}: {exc}")
-    return currencies
+    return _load_collection(CURRENCIES_DIR, 'currency.yaml')
 
 
 def load_countries():
@@ -187,23 +319,50 @@ def load_countries():
     Loads all countries from the data/countries directory.
     Returns a dictionary of countries with their directory name as the key.
     """
-    countries = {}
-    if not os.path.exists(COUNTRIES_DIR):
-        return countries
-
-    for item in os.listdir(COUNTRIES_DIR):
-        item_path = os.path.join(COUNTRIES_DIR, item)
-        if os.path.isdir(item_path):
-            yaml_path = os.path.join(item_path, 'country.yaml')
-            if os.path.exists(yaml_path):
-                with open(yaml_path, 'r') as f:
-                    try:
-                        country_data = yaml.safe_load(f)
-                        country_data['id'] = item
-                        countries[item.lower()] = country_data
-                    except yaml.YAMLError as exc:
-                        print(f"Error parsing {yaml_path}: {exc}")
-    return countries
+    return _load_collection(COUNTRIES_DIR, 'country.yaml')
+
+
+def _event_references(event_raw, organizers, languages, currencies, countries):
+    """Returns the parsed records an event links against, in a fixed order."""
+    loc = event_raw.get('location') or {}
+    price = event_raw.get('price')
+    curr_id = str(price['currency']).lower() if isinstance(price, dict) and 'currency' in price else None
+    return (
+        event_raw,
+        organizers.get(event_raw.get('organizer', '').lower()),
+        languages.get(str(event_raw.get('language', '')).lower()),
+        countries.get(str(loc.get('country', '')).lower()),
+        currencies.get(curr_id) if curr_id is not None else None,
+    )
+
+
+def _link_event(event_raw, references, countries):
+    """Builds the linked copy of a parsed event. The parsed record itself is left untouched."""
+    event_data = dict(event_raw)
+    _, organizer, language, country, currency = references
+
+    # Link organizer data
+    if organizer is not None:
+        event_data['organizer_details'] = organizer
+
+    # Link language data
+    if language is not None:
+        event_data['language_details'] = language
+
+    # Link country data
+    if country is not None:
+        event_data['location'] = dict(event_data['location'], country_details=country)
+
+    # Link currency data
+    if currency is not None:
+        event_data['price'] = dict(event_data['price'], currency_details=currency)
+
+    # Auto-calculate coordinates if missing (but don't wait for them)
+    loc = event_data.get('location', {})
+    if GEOCODE_ON_LINK and loc and ('latitude' not in loc or 'longitude' not in loc):
+        get_coordinates(*event_address(loc, countries), async_fetch=True)
+
+    return event_data
 
 
 def load_events():
@@ -211,7 +370,10 @@ def load_events():
     Loads all events from the data/events directory and the data root directory.
     Each event is stored in its own subdirectory with an event.yaml and description.md file.
     Events are returned as a list of dictionaries, sorted by date.
+    Only new or modified directories are reparsed, and only events whose own files or referenced
+    organizer, language, country or currency changed are relinked.
     """
+    global _linked_events
     events = []
     organizers = load_organizers()
     languages = load_languages()
@@ -227,6 +389,7 @@ def load_events():
         if os.path.isdir(item_path) and os.path.exists(os.path.join(item_path, 'event.yaml')):
             dirs_to_scan.append(item_path)
 
+    item_paths = []
     for scan_path in dirs_to_scan:
         if scan_path == EVENTS_DIR:
             if not os.path.exists(EVENTS_DIR):
@@ -234,67 +397,406 @@ def load_events():
             items = [os.path.join(EVENTS_DIR, i) for i in os.listdir(EVENTS_DIR)]
         else:
             items = [scan_path]
+        item_paths.extend(item_path for item_path in items if os.path.isdir(item_path))
 
-        for item_path in items:
-            if os.path.isdir(item_path):
-                yaml_path = os.path.join(item_path, 'event.yaml')
-                if os.path.exists(yaml_path):
-                    item = os.path.basename(item_path)
-                    with open(yaml_path, 'r') as f:
-                        try:
-                            event_data = yaml.safe_load(f)
-                            event_data['id'] = item
-
-                            # Load detailed description from Markdown file
-                            description_path = os.path.join(item_path, 'description.md')
-                            if os.path.exists(description_path):
-                                with open(description_path, 'r') as df:
-                                    event_data['description'] = df.read()
-
-                            # Link organizer data
-                            org_name = event_data.get('organizer', '').lower()
-                            if org_name in organizers:
-                                event_data['organizer_details'] = organizers[org_name]
-
-                            # Link language data
-                            lang_id = str(event_data.get('language', '')).lower()
-                            if lang_id in languages:
-                                event_data['language_details'] = languages[lang_id]
-
-                            # Link country data
-                            loc = event_data.get('location', {})
-                            country_id = str(loc.get('country', '')).lower()
-                            if country_id in countries:
-                                event_data['location']['country_details'] = countries[country_id]
-
-                            # Link currency data
-                            price = event_data.get('price')
-                            if isinstance(price, dict) and 'currency' in price:
-                                curr_id = str(price['currency']).lower()
-                                if curr_id in currencies:
-                                    event_data['price']['currency_details'] = currencies[curr_id]
-
-                            # Auto-calculate coordinates if missing (but don't wait for them)
-                            if loc and ('latitude' not in loc or 'longitude' not in loc):
-                                country_name = loc.get('country', '')
-                                if 'country_details' in loc:
-                                    country_name = loc['country_details'].get('name', country_name)
-                                get_coordinates(loc.get('address', ''), loc.get('city', ''), countries.get(country_name.lower(), {"name": country_name})["name"], async_fetch=True)
-
-                            events.append(event_data)
-                        except yaml.YAMLError as exc:
-                            print(f"Error parsing {yaml_path}: {exc}")
+    records = _load_items(item_paths, 'event.yaml', _item_records.get(EVENTS_DIR, {}), with_description=True)
+    previous_links = _linked_events
+    links = {}
+    relinked = 0
+
+    with metrics.phase('link'):
+        for item_path, (_, event_raw) in records.items():
+            if event_raw is None:
+                continue
+
+            references = _event_references(event_raw, organizers, languages, currencies, countries)
+            cached = previous_links.get(item_path)
+            if cached is not None and all(a is b for a, b in zip(cached[0], references)):
+                event_data = cached[1]
+            else:
+                event_data = _link_event(event_raw, references, countries)
+                relinked += 1
+            links[item_path] = (references, event_data)
+            events.append(event_data)
+    metrics.count('links', hits=len(events) - relinked, misses=relinked)
+
+    _item_records[EVENTS_DIR] = records
+    _linked_events = links
 
     # Sort events chronologically by their start date
     events.sort(key=lambda x: str(x.get('date', '')))
     return events
 
 
+@metrics.phase('scan')
+def scan_data_files():
+    """
+    Collects a (mtime, size) signature for every file inside the data directories.
+    Returns a dictionary keyed by file path, so two scans compare equal only if nothing on disk changed.
+    """
+    signatures = {}
+
+    def stat_files(dir_path):
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        signatures[entry.path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
+
+    for base_dir in [EVENTS_DIR, ORGANIZERS_DIR, LANGUAGES_DIR, CURRENCIES_DIR, COUNTRIES_DIR]:
+        if not os.path.isdir(base_dir):
+            continue
+        for item in os.listdir(base_dir):
+            item_path = os.path.join(base_dir, item)
+            if os.path.isdir(item_path):
+                stat_files(item_path)
+
+    # Event directories placed directly in DATA_ROOT (mirrors the scan in load_events)
+    for item in os.listdir(DATA_ROOT):
+        if item in ['events', 'organizers', 'static', 'templates', '.cache']:
+            continue
+        item_path = os.path.join(DATA_ROOT, item)
+        if os.path.isdir(item_path) and os.path.exists(os.path.join(item_path, 'event.yaml')):
+            stat_files(item_path)
+
+    return signatures
+
+
+class Catalog:
+    """
+    Process-wide, in-memory copy of the event catalog.
+    The data directory is polled at most once every `poll_interval` seconds and the catalog
+    is only rebuilt when a file was added, removed or modified. Every rebuild increments
+    `generation`, which request handlers can use to tell catalog versions apart.
+    Responses built from the catalog are memoized in `responses` until the next rebuild.
+    The first refresh loads the snapshot in SNAPSHOT_FILE instead of parsing the data directory
+    if it was compiled from exactly the files that are on disk.
+    With a `shared_version`, worker processes serving the same data directory take turns scanning
+    it and publish what they found, so a change seen by one worker reaches all of them.
+    `revision` counts the versions of the data directory (shared by the workers, and kept across
+    restarts, with a `shared_version`); the changes of the last CHANGES_HISTORY revisions are kept
+    for `changes()`, in the change log of the `shared_version` if there is one.
+    """
+
+    def __init__(self, poll_interval=None, shared_version=None):
+        if poll_interval is None:
+            poll_interval = float(os.environ.get('CATALOG_POLL_INTERVAL', '2'))
+        self.poll_interval = poll_interval
+        self.shared_version = shared_version
+        self.generation = 0
+        self.events = []
+        self.by_id = {}
+        self.countries = {}
+        self.search_index = SearchIndex()
+        self.index = EventIndex([], self.search_index)
+        self.ics = IcsFeed()
+        self.responses = ResponseCache()
+        self.last_modified = None
+        self._summaries = {}
+        self._spatial = None
+        self._signatures = None
+        self._digest = None
+        self.revision = 0
+        self._history = collections.deque(maxlen=CHANGES_HISTORY)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Rebuilds the catalog if the data directory changed since the last check. Returns the catalog."""
+        if not force and self._signatures is not None and time.monotonic() - self._checked_at < self.poll_interval:
+            return self
+
+        with self._lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            if not force and self._signatures is not None and time.monotonic() - self._checked_at < self.poll_interval:
+                return self
+
+            # Coordinates geocoded by other processes show up through the shared cache
+            geocode_cache.sync()
+            signatures, revision, published = self._scan(force)
+            previous = self.by_id
+            if signatures is None:
+                # Another worker checked the data directory recently and found nothing new
+                pass
+            elif self._signatures is None and not force and self._restore(signatures):
+                self._set_signatures(signatures)
+            elif force or signatures != self._signatures:
+                self._rebuild()
+                self._set_signatures(signatures)
+            if signatures is not None:
+                self._advance(previous, revision, published)
+            self._checked_at = time.monotonic()
+        return self
+
+    def _scan(self, force):
+        """
+        Returns the current signatures of the data files, their shared revision (None without a
+        shared version) and whether this scan published that revision, or (None, None, False) if
+        they are known to be unchanged.
+        """
+        shared = self.shared_version
+        if shared is None:
+            return scan_data_files(), None, False
+        if not force and self._signatures is not None:
+            published = shared.read(max_age=self.poll_interval)
+            if published == self._digest:
+                return None, None, False
+            if published is None:
+                # Nobody scanned recently: one worker scans for all of them
+                with shared.scan_lock(blocking=False) as fd:
+                    if fd is None:
+                        return None, None, False
+                    signatures = scan_data_files()
+                    return (signatures, *shared.publish(signatures_digest(signatures)))
+        # Another worker saw a change (or this is the first scan): scans and publications take turns,
+        # so revisions are numbered in the order the changes appeared on disk
+        with shared.scan_lock():
+            signatures = scan_data_files()
+            return (signatures, *shared.publish(signatures_digest(signatures)))
+
+    def _set_signatures(self, signatures):
+        self._signatures = signatures
+        self._digest = signatures_digest(signatures)
+        self.last_modified = self._last_modified(signatures)
+
+    def _advance(self, previous, revision, published=False):
+        """
+        Moves to the given revision (or the next local one if there is none) after a scan and records
+        which events were added, updated and removed since `previous`, the events of the last revision.
+        Unchanged events keep their identity across rebuilds, so comparing them is cheap.
+        If this process `published` the revision, the changes also go to the shared change log, as
+        those of the revision before it: this process may have skipped some revisions, so they can
+        include events that changed earlier, which clients just receive again.
+        """
+        if revision is None:
+            if self.by_id is previous:
+                return
+            revision = self.revision + 1
+        if revision == self.revision:
+            return
+        # The first revision of a process has nothing to compare with
+        if self.revision:
+            by_id = self.by_id
+            added = [event_id for event_id in by_id if event_id not in previous]
+            updated = [event_id for event_id, event in by_id.items() if event_id in previous and previous[event_id] is not event]
+            removed = [event_id for event_id in previous if event_id not in by_id]
+            self._history.append((self.revision, revision, added, updated, removed))
+            if published:
+                self.shared_version.record_changes(revision - 1, revision, added, updated, removed)
+        self.revision = revision
+
+    def catch_up(self, since):
+        """
+        Refreshes right away, ignoring the poll interval, if a client already saw revision `since` from
+        another worker and it is newer than this catalog's. Returns the catalog.
+        """
+        if since > self.revision and self.shared_version is not None and self.shared_version.published_revision() > self.revision:
+            self._checked_at = 0.0
+            self.refresh()
+        return self
+
+    def changes(self, since):
+        """
+        Returns (revision, added events, updated events, removed ids) with the changes since revision
+        `since`, or None if the history does not go back to that revision and the client has to load
+        the whole catalog again. A client ahead of this catalog, on a revision another worker already
+        published, gets no changes and the (older) current revision, so it simply asks again later.
+        """
+        # Read in the reverse order of refresh(), so a concurrent refresh can only add changes
+        revision = self.revision
+        history = list(self._history)
+        if self.shared_version is not None:
+            # A worker only saw some revisions itself; the shared log has each revision once
+            history = self.shared_version.read_changes() + history
+        by_id = self.by_id
+        if since == revision:
+            return revision, [], [], []
+        if since > revision:
+            if self.shared_version is not None and since <= self.shared_version.published_revision():
+                return revision, [], [], []
+            return None
+
+        steps = {}
+        for change in history:
+            steps.setdefault(change[0], change)
+        # Follow the changes from `since` to the current revision
+        path, current = [], since
+        while current != revision:
+            change = steps.get(current)
+            if change is None or change[1] > revision:
+                return None
+            path.append(change)
+            current = change[1]
+
+        first_change = {}
+        for _, _, *kinds in path:
+            for kind, event_ids in zip(('added', 'updated', 'removed'), kinds):
+                for event_id in event_ids:
+                    first_change.setdefault(event_id, kind)
+        added, updated, removed = [], [], []
+        for event_id, kind in first_change.items():
+            # The client already has the event unless it was added after `since`
+            known = kind != 'added'
+            if event_id in by_id:
+                (updated if known else added).append(by_id[event_id])
+            elif known:
+                removed.append(event_id)
+        return revision, added, updated, removed
+
+    def _rebuild(self, search_weights=None, excerpts=None):
+        """
+        Loads the data directory and rebuilds the indexes. `search_weights` and `excerpts` (from a
+        snapshot of the same files) spare tokenizing the events and rendering their descriptions.
+        """
+        countries = load_countries()
+        events = load_events()
+        excerpts = excerpts or {}
+        with metrics.phase('index'):
+            # Only events that were added or relinked since the last build are re-tokenized
+            self.search_index.update(events, search_weights)
+            # Summaries (and their excerpts) are only recomputed for events that were relinked
+            previous = self._summaries
+            summaries = {
+                e['id']: previous[e['id']] if e['id'] in previous and previous[e['id']][0] is e else (e, summarize(e, excerpts.get(e['id'])))
+                for e in events
+            }
+            index = EventIndex(events, self.search_index)
+        self._publish(events, countries, index, summaries)
+
+    def _publish(self, events, countries, index, summaries):
+        gazetteer.load_countries(countries)
+        self.events = events
+        self.by_id = {e['id']: e for e in events}
+        self.countries = countries
+        self.index = index
+        self.ics.update(events)
+        self._summaries = summaries
+        self.responses.clear()
+        self.generation += 1
+
+    def snapshot_state(self):
+        """Returns everything _restore() needs to bring up this catalog without parsing, for snapshot.py."""
+        queries = [
+            geocode_candidates(*event_address(e['location'], self.countries))[0]
+            for e in self.events
+            if e.get('location') and ('latitude' not in e['location'] or 'longitude' not in e['location'])
+        ]
+        return {
+            'signatures': self._signatures,
+            # The parsed data files; linking them again is much faster than parsing
+            'item_records': _item_records,
+            # The costly parts of indexing: the search terms and the description excerpts of the events
+            'search_weights': self.search_index.export(),
+            'excerpts': {event_id: summary['excerpt'] for event_id, (_, summary) in self._summaries.items()},
+            'geocodes': geocode_cache.export(queries),
+        }
+
+    def _restore(self, signatures):
+        """Loads the catalog from the snapshot file if it was compiled from the current data files. Returns whether it was."""
+        global _item_records
+        state = read_snapshot(SNAPSHOT_FILE)
+        if state is None or state.get('signatures') != signatures:
+            return False
+
+        # Known coordinates first, so linking the events does not queue them for geocoding
+        geocode_cache.seed(state['geocodes'])
+        # load_events() finds every directory unchanged and only links the events
+        _item_records = state['item_records']
+        self._rebuild(state['search_weights'], state['excerpts'])
+        return True
+
+    def spatial_index(self):
+        """
+        Returns the SpatialIndex over the event coordinates known so far.
+        It is rebuilt with the catalog, and at most once per poll interval while geocoding adds coordinates.
+        """
+        spatial = self._spatial
+        if spatial is not None:
+            generation, revision, built_at, index = spatial
+            if generation == self.generation and (revision == geocode_cache.revision or time.monotonic() - built_at < self.poll_interval):
+                return index
+
+        generation, revision = self.generation, geocode_cache.revision
+        coordinates, _ = collect_coordinates(self.index.events, self.countries, wait=False)
+        with metrics.phase('spatial'):
+            index = SpatialIndex([(event_id, coords['latitude'], coords['longitude']) for event_id, coords in coordinates.items()])
+        self._spatial = (generation, revision, time.monotonic(), index)
+        return index
+
+    def summary(self, event):
+        """Returns the listing fields and description excerpt of an event of the current build."""
+        cached = self._summaries.get(event['id'])
+        if cached is not None and cached[0] is event:
+            return cached[1]
+        return summarize(event)
+
+    def _last_modified(self, signatures):
+        """Returns the modification time of the newest data file, or now if files were only removed."""
+        newest = max((mtime_ns for mtime_ns, _ in signatures.values()), default=0) / 1e9
+        if self.last_modified is not None and newest <= self.last_modified.timestamp():
+            newest = time.time()
+        return datetime.fromtimestamp(newest, timezone.utc)
+
+
+catalog = Catalog(shared_version=SharedVersion(os.path.join(CACHE_DIR, 'catalog.version'), history=CHANGES_HISTORY))
+
+
 @app.route('/')
 def index():
-    """Renders the main page with the list of events."""
-    events = load_events()
-    return render_template('index.html', events=events)
+    """
+    Renders the main page with the summary of every event and the filter options embedded, so the
+    page shows the list without another request. The page is rendered once per catalog generation.
+    """
+    catalog.refresh()
+    return cached_response(('index',), render_index, mimetype='text/html')
+
+
+def render_index(static=False):
+    """
+    Renders the main page for the current catalog. A `static` page (see export.py) reads coordinates,
+    search results and map markers from the exported files instead of the API, and links to the
+    exported files relative to itself, so the site works wherever it is hosted.
+    """
+    summaries = [catalog.summary(event) for event in catalog.events]
+    filters = catalog.index.filter_options()
+    if static:
+        summaries = [relative_image_url(summary) for summary in summaries]
+        filters = {
+            facet: [dict(option, icon=relative_url(option['icon'])) if 'icon' in option else option for option in options]
+            for facet, options in filters.items()
+        }
+    bootstrap = {
+        'events': summaries,
+        'filters': filters,
+        'static': static,
+    }
+    links = {
+        'ics': 'events.ics' if static else url_for('all_events_ics'),
+        'json': 'api/events.json' if static else url_for('api_events'),
+    }
+
+    def asset(filename):
+        return f'static/{filename}' if static else url_for('static', filename=filename)
+
+    return render_template('index.html', bootstrap=bootstrap, links=links, asset=asset).encode()
+
+
+def relative_url(url):
+    """Turns a link to an organizer image into one relative to the exported page; other values are returned as they are."""
+    if isinstance(url, str) and url.startswith('/organizer/'):
+        return url[1:]
+    return url
+
+
+def relative_image_url(summary):
+    """Returns the summary with its organizer image linked relative to the exported page; the cached summary is left untouched."""
+    organizer = summary.get('organizer_details')
+    if not isinstance(organizer, dict) or relative_url(organizer.get('image_url')) == organizer.get('image_url'):
+        return summary
+    return dict(summary, organizer_details=dict(organizer, image_url=relative_url(organizer['image_url'])))
 
 
 @app.route('/organizer/<org_id>/image.png')
@@ -306,134 +808,401 @@ def organizer_image(org_id):
     abort(404)
 
 
-@app.route('/api/events')
-def api_events():
-    """Returns all events as a JSON object for the frontend."""
-    events = load_events()
-    return jsonify(events)
+# Parameters read by parse_event_query
+QUERY_ARGS = {*FACETS, *FLAGS, 'time', 'from', 'to', 'search', 'sort', 'limit', 'cursor', 'facets'}
 
 
-@app.route('/api/coordinates')
-def api_coordinates():
-    """Returns coordinates for all events as a JSON object."""
-    events = load_events()
-    countries = load_countries()
+def parse_event_query(args):
+    """
+    Turns /api/events query parameters into keyword arguments for EventIndex.query.
+    Facet filters accept comma-separated or repeated values. Raises ValueError for invalid input.
+    """
+    def values(name):
+        return [v for arg in args.getlist(name) for v in arg.split(',') if v]
+
+    def iso_date(name):
+        value = args.get(name)
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+        return value
+
+    sort = args.get('sort', 'date')
+    if sort not in ('date', '-date'):
+        raise ValueError(f"Unsupported sort order: {sort}")
+    time_filter = args.get('time')
+    if time_filter not in (None, 'all', 'future', 'past'):
+        raise ValueError(f"Unsupported time filter: {time_filter}")
+    cursor = args.get('cursor')
+    if cursor:
+        decode_cursor(cursor)
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 0:
+            raise ValueError("limit must not be negative")
+
+    facets = values('facets')
+    if facets == ['all']:
+        facets = list(FACETS)
+    unknown = set(facets) - set(FACETS)
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(sorted(unknown))}")
+
+    return {
+        'filters': {facet: values(facet) for facet in FACETS if values(facet)},
+        'flags': [flag for flag in FLAGS if args.get(flag, '').lower() in ('1', 'true', 'yes')],
+        'time': time_filter,
+        'date_from': iso_date('from'),
+        'date_to': iso_date('to'),
+        'search': args.get('search'),
+        'sort': sort,
+        'cursor': cursor,
+        'limit': limit,
+        'facets': facets,
+    }
+
+
+def serve_representation(representation):
+    """
+    Sends a cached representation in the best content coding the client accepts, compressing it on first use.
+    Requests whose If-None-Match / If-Modified-Since still match are answered with 304 and no body.
+    """
+    if representation.needs_compression(request.accept_encodings):
+        with metrics.phase('compress'):
+            encoding = representation.negotiate(request.accept_encodings)
+    else:
+        encoding = representation.negotiate(request.accept_encodings)
+    etag = representation.etag(encoding)
+    if representation.is_fresh(etag, request.if_none_match, request.if_modified_since):
+        response = Response(status=304)
+    else:
+        response = Response(representation.body(encoding), mimetype=representation.mimetype, headers=representation.headers)
+        if encoding != 'identity':
+            response.content_encoding = encoding
+    response.set_etag(etag)
+    if representation.last_modified is not None:
+        response.last_modified = representation.last_modified
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cached_response(key, build, mimetype='application/json', headers=None, phase='serialize'):
+    """
+    Serves the representation memoized under `key` for the current catalog generation.
+    On a miss `build()` is called for the response body (bytes) and the result is cached;
+    the time spent in `build()` is recorded under the metrics `phase`.
+    """
+    key = (catalog.generation, *key)
+    representation = catalog.responses.get(key)
+    metrics.count('responses', hits=int(representation is not None), misses=int(representation is None))
+    if representation is None:
+        with metrics.phase(phase):
+            body = build()
+        representation = Representation(body, mimetype, catalog.last_modified, headers)
+        catalog.responses.put(key, representation)
+    return serve_representation(representation)
+
+
+def query_key(args, names):
+    """
+    Returns a hashable, order-independent key for the query parameters in `names`.
+    Other parameters (cache-busters, tracking parameters) do not change the response, so they do not get their own cache entry.
+    """
+    return tuple(sorted((name, value) for name, value in args.items(multi=True) if name in names))
+
+
+def parse_projection(args):
+    """
+    Reads the `view` (full or summary) and `fields` (comma-separated top-level fields) parameters.
+    Returns a function that turns an event into its requested representation. Raises ValueError for invalid input.
+    """
+    view = args.get('view', 'full')
+    if view not in VIEWS:
+        raise ValueError(f"Unsupported view: {view}")
+    fields = [f for arg in args.getlist('fields') for f in arg.split(',') if f]
+
+    if fields:
+        if view == 'summary':
+            return lambda event: project(catalog.summary(event), fields)
+        return lambda event: project(event, fields, catalog.summary(event))
+    if view == 'summary':
+        return catalog.summary
+    return None
+
+
+# Parameters that only shape the events in the response and never select them
+PROJECTION_ARGS = {'view', 'fields', 'format'}
+
+
+@app.route('/api/events')
+def api_events():
+    """
+    Returns all events as a JSON object for the frontend.
+    With query parameters (country, city, type, organizer, language, tags, free, online, time,
+    from, to, search, sort, limit, cursor, facets) only the matching events are returned, wrapped
+    in an object with the total count, the cursor of the next page and the requested facet counts.
+    `view=summary` or `fields=...` reduce each event to its listing fields or the named fields.
+    `format=normalized` returns linked organizers, languages, countries and currencies once, in a
+    `records` object, and only their ids in the events.
+    """
+    catalog.refresh()
+    response_format = request.args.get('format', 'flat')
+    try:
+        if response_format not in FORMATS:
+            raise ValueError(f"Unsupported format: {response_format}")
+        projection = parse_projection(request.args)
+        # Unknown parameters (cache-busters, tracking parameters) keep the plain list existing clients expect
+        query = parse_event_query(request.args) if QUERY_ARGS.intersection(request.args) else None
+    except ValueError as exc:
+        abort(400, description=str(exc))
+
+    def build():
+        result = catalog.index.query(**query) if query is not None else {'events': catalog.events}
+        if projection:
+            result['events'] = [projection(e) for e in result['events']]
+        if response_format == 'normalized':
+            result['events'], result['records'] = normalize(result['events'])
+        elif query is None:
+            return jsonify(result['events']).get_data()
+        return jsonify(result).get_data()
+
+    # Clients start following /api/events/changes from the revision of the events they loaded
+    return cached_response(('events', query_key(request.args, QUERY_ARGS | PROJECTION_ARGS)), build, headers={'X-Catalog-Revision': str(catalog.revision)})
+
+
+@app.route('/api/events/changes')
+def api_event_changes():
+    """
+    Returns the events added, updated and removed since the catalog revision `since`: the new
+    versions of the added and updated events (shaped by `view` and `fields` like /api/events) and
+    the ids of the removed ones. A client whose revision is no longer in the history gets a
+    410 response and has to load /api/events again.
+    """
+    catalog.refresh()
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        abort(400, description="since must be a catalog revision")
+    try:
+        projection = parse_projection(request.args)
+    except ValueError as exc:
+        abort(400, description=str(exc))
+
+    # The client may have seen a newer revision from another worker
+    changes = catalog.catch_up(since).changes(since)
+    if changes is None:
+        return jsonify({'error': "full resync required", 'revision': catalog.revision}), 410
+    revision, added, updated, removed = changes
+
+    def build():
+        payload = projection or (lambda event: event)
+        return jsonify({
+            'since': since,
+            'revision': revision,
+            'added': [payload(event) for event in added],
+            'updated': [payload(event) for event in updated],
+            'removed': removed,
+        }).get_data()
+
+    return cached_response(('changes', revision, query_key(request.args, {'since', 'view', 'fields'})), build)
+
+
+@metrics.phase('geocode')
+def collect_coordinates(events, countries, wait=True, offline=False):
+    """
+    Collects the coordinates of the given events from the event files, the geocoding cache and the offline backends.
+    With `wait`, missing coordinates are geocoded before returning. Otherwise they are queued
+    on the background worker and returned as `pending`, a dictionary of Future -> event ids
+    (a coarse country-level guess for a pending event is still included in the coordinates).
+    With `offline` (and without `wait`) nothing is queued and `pending` stays empty.
+    Returns a (coordinates, pending) tuple.
+    """
     coordinates = {}
-    
+    pending = {}
+    futures = {}
+
     for event in events:
         loc = event.get('location', {})
-        if loc:
-            # Check if coordinates are already in the event file
-            if 'latitude' in loc and 'longitude' in loc:
-                coordinates[event['id']] = {
-                    'latitude': loc['latitude'],
-                    'longitude': loc['longitude']
-                }
-            else:
-                # Try to fetch from cache or Nominatim
-                country_code = str(loc.get('country', '')).lower()
-                country_name = country_code
-                if 'country_details' in loc:
-                    country_name = loc['country_details'].get('name', country_name)
-                
-                # Use the country details we already loaded if possible
-                country_data = countries.get(country_code, {"name": country_name})
-                
-                coords = get_coordinates(
-                    loc.get('address', ''), 
-                    loc.get('city', ''), 
-                    country_data.get("name", country_name), 
-                    async_fetch=False  # We want them now for this API call
-                )
-                if coords:
-                    coordinates[event['id']] = coords
-                    
-    return jsonify(coordinates)
-
+        if not loc:
+            continue
 
-@app.route('/event/<event_id>.ics')
-def event_ics(event_id):
-    """Generates and returns an iCalendar file for a specific event."""
-    events = load_events()
-    event_data = next((e for e in events if e.get('id') == event_id), None)
+        # Check if coordinates are already in the event file
+        if 'latitude' in loc and 'longitude' in loc:
+            coordinates[event['id']] = {
+                'latitude': loc['latitude'],
+                'longitude': loc['longitude']
+            }
+            continue
 
+        address = event_address(loc, countries)
+        if wait:
+            # Try to fetch from cache, the gazetteer or Nominatim
+            coords = get_coordinates(*address, async_fetch=False)
+        else:
+            coords, final = known_coordinates(*address)
+            if not final and not offline:
+                candidates = geocode_candidates(*address)
+                future = futures.get(candidates[0]) or geocode_worker.submit(candidates[0], candidates)
+                if future is not None:
+                    futures[candidates[0]] = future
+                    pending.setdefault(future, []).append(event['id'])
+        if coords:
+            coordinates[event['id']] = coords
+
+    return coordinates, pending
+
+
+@app.route('/api/events/<event_id>')
+def api_event(event_id):
+    """Returns a single event as a JSON object."""
+    event_data = catalog.refresh().by_id.get(event_id)
     if not event_data:
         abort(404)
+    return jsonify(event_data)
+
+
+@app.route('/api/search')
+def api_search():
+    """
+    Full-text search over event titles, tags, organizers, cities, countries and descriptions.
+    Returns the best matches for `q` first; the last word also matches as a prefix for type-ahead.
+    `limit` caps the number of results (default 20, `all` for every match).
+    """
+    catalog.refresh()
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', '20')
+    try:
+        limit = None if limit == 'all' else int(limit)
+        if limit is not None and limit < 0:
+            raise ValueError
+    except ValueError:
+        abort(400, description=f"Invalid limit: {limit}")
+
+    index = catalog.index
+    results = []
+    # The search index may already know events of a newer catalog build; those are skipped
+    matches = [(event_id, score) for event_id, score in catalog.search_index.search(query) if event_id in index.positions]
+    for event_id, score in matches[:limit]:
+        event = index.events[index.positions[event_id]]
+        loc = event.get('location') or {}
+        results.append({
+            'id': event_id,
+            'title': event.get('name') or event.get('title'),
+            'date': event_date(event),
+            'city': loc.get('city'),
+            'country': loc.get('country'),
+            'score': round(score, 3),
+        })
+    return jsonify({'query': query, 'total': len(matches), 'results': results})
 
-    cal = Calendar()
-    cal.add('prodid', '-//OpenTrack//opentrack.dev//')
-    cal.add('version', '2.0')
-
-    event = Event()
-    event.add('summary', event_data.get('name') or event_data.get('title'))
-
-    # Handle start date
-    dt_start = event_data.get('date')
-    if isinstance(dt_start, str):
-        dt_start = datetime.strptime(dt_start, '%Y-%m-%d').date()
-    event.add('dtstart', dt_start)
-
-    # Handle end date if available
-    dt_end = event_data.get('end_date')
-    if dt_end:
-        if isinstance(dt_end, str):
-            dt_end = datetime.strptime(dt_end, '%Y-%m-%d').date()
-        event.add('dtend', dt_end)
-
-    # Set location string
-    location_parts = [
-        event_data.get('location', {}).get('address', ''),
-        event_data.get('location', {}).get('city'),
-        event_data.get('location', {}).get('country')
-    ]
-    event.add('location', ", ".join(filter(None, location_parts)))
-
-    # Construct detailed description including all available event data
-    description_parts = []
-
-    if event_data.get('description'):
-        description_parts.append(event_data.get('description'))
-        description_parts.append("")  # Empty line for spacing
-
-    fields_to_include = {
-        'Organizer': event_data.get('organizer'),
-        'Type': event_data.get('type'),
-        'Online': 'Yes' if event_data.get('online') else 'No',
-        'Language': event_data.get('language'),
-        'Speakers': event_data.get('speakers'),
-        'URL': event_data.get('url'),
-        'Tags': ", ".join(event_data.get('tags', [])) if event_data.get('tags') else None
-    }
 
-    price_data = event_data.get('price')
-    if price_data:
-        if isinstance(price_data, dict):
-            currency = price_data.get('currency', '')
-            if 'min_amount' in price_data and 'max_amount' in price_data:
-                formatted_min = f"{price_data['min_amount']:,}".replace(',', ' ')
-                formatted_max = f"{price_data['max_amount']:,}".replace(',', ' ')
-                fields_to_include['Price'] = f"{formatted_min} - {formatted_max} {currency}"
-            elif 'amount' in price_data:
-                formatted_amount = f"{price_data['amount']:,}".replace(',', ' ')
-                fields_to_include['Price'] = f"{formatted_amount} {currency}"
+@app.route('/api/coordinates')
+def api_coordinates():
+    """
+    Returns coordinates for all events as a JSON object.
+    With `?wait=false` the response is sent immediately: it contains the coordinates known so far
+    and the ids of the events that are still being geocoded in the background.
+    """
+    catalog.refresh()
+    wait = request.args.get('wait', 'true').lower() not in ('0', 'false', 'no')
+
+    # The coordinates also depend on the geocoding cache, which changes independently of the catalog
+    def key():
+        return (catalog.generation, 'coordinates', geocode_cache.revision, wait)
+
+    representation = catalog.responses.get(key())
+    metrics.count('responses', hits=int(representation is not None), misses=int(representation is None))
+    if representation is None:
+        coordinates, pending = collect_coordinates(catalog.events, catalog.countries, wait=wait)
+        if wait:
+            data = coordinates
         else:
-            fields_to_include['Price'] = str(price_data)
+            data = {
+                'coordinates': coordinates,
+                'pending': sorted(event_id for event_ids in pending.values() for event_id in event_ids),
+            }
+        # Stored under the state the coordinates were collected in, which includes their geocoding.
+        # Geocoding changes the body without touching the data files, so only the ETag can validate it.
+        representation = catalog.responses.put(key(), Representation(jsonify(data).get_data(), 'application/json'))
+    return serve_representation(representation)
+
+
+@app.route('/api/coordinates/stream')
+def api_coordinates_stream():
+    """
+    Streams event coordinates as newline-delimited JSON.
+    All known coordinates are sent right away; the remaining events follow one line at a time as
+    the background worker geocodes them. The last line lists the events that could not be resolved.
+    """
+    catalog.refresh()
+    events = catalog.events
+    coordinates, pending = collect_coordinates(events, catalog.countries, wait=False)
+    timeout = float(os.environ.get('GEOCODE_STREAM_TIMEOUT', '20'))
 
-    for label, value in fields_to_include.items():
-        if value:
-            description_parts.append(f"{label}: {value}")
+    def line(data):
+        return json.dumps(data) + "\n"
+
+    def generate():
+        yield "".join(line(dict(coords, id=event_id)) for event_id, coords in coordinates.items())
+
+        resolved = set(coordinates)
+        try:
+            for future in as_completed(pending, timeout=timeout):
+                coords = future.result() if future.exception() is None else None
+                if coords:
+                    for event_id in pending[future]:
+                        resolved.add(event_id)
+                        yield line(dict(coords, id=event_id))
+        except FuturesTimeoutError:
+            pass
+
+        unresolved = sorted(e['id'] for e in events if e.get('location') and e['id'] not in resolved)
+        yield line({'done': True, 'unresolved': unresolved})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    event.add('description', "\n".join(description_parts))
-    event.add('url', event_data.get('url'))
-    event['uid'] = f"{event_id}@opentrack.dev"
 
-    if event_data.get('organizer'):
-        event.add('organizer', event_data.get('organizer'))
+@app.route('/api/map')
+def api_map():
+    """
+    Returns the map markers inside a viewport: `bbox=west,south,east,north` and the map `zoom`.
+    Nearby events are merged into clusters (count, centroid and a few event ids); from zoom 14 on
+    every event is returned as a point. Accepts the filters of /api/events.
+    """
+    catalog.refresh()
+    try:
+        bbox = parse_bbox(request.args.get('bbox', '-180,-90,180,90'))
+        zoom = int(request.args.get('zoom', '0'))
+        filter_args = request.args.copy()
+        for name in ('bbox', 'zoom'):
+            filter_args.pop(name, None)
+        query = parse_event_query(filter_args) if filter_args else None
+    except ValueError as exc:
+        abort(400, description=str(exc))
+
+    spatial = catalog.spatial_index()
+    match = catalog.index.matcher(**query) if query is not None else None
+    return jsonify(spatial.query(bbox, zoom, match))
+
 
-    cal.add_component(event)
+@app.route('/api/geocoding/status')
+def api_geocoding_status():
+    """Returns the geocoding queue depth and the queries currently being resolved."""
+    return jsonify(geocode_worker.stats())
 
+
+@app.route('/event/<event_id>.ics')
+def event_ics(event_id):
+    """Generates and returns an iCalendar file for a specific event."""
+    event_data = catalog.refresh().by_id.get(event_id)
+
+    if not event_data:
+        abort(404)
+
+    with metrics.phase('ics'):
+        ical = catalog.ics.event_calendar(event_data)
     return Response(
-        cal.to_ical(),
+        ical,
         mimetype="text/calendar",
         headers={"Content-disposition": f"attachment; filename={event_id}.ics"}
     )
@@ -441,86 +1210,49 @@ def event_ics(event_id):
 
 @app.route('/events.ics')
 def all_events_ics():
-    """Generates and returns a single iCalendar file containing all events."""
-    events_data = load_events()
-    cal = Calendar()
-    cal.add('prodid', '-//OpenTrack//opentrack.dev//')
-    cal.add('version', '2.0')
-    cal.add('x-wr-calname', 'OpenTrack.dev Events')
-
-    for event_data in events_data:
-        event = Event()
-        event.add('summary', event_data.get('name') or event_data.get('title'))
-
-        # Start date
-        dt_start = event_data.get('date')
-        if isinstance(dt_start, str):
-            dt_start = datetime.strptime(dt_start, '%Y-%m-%d').date()
-        event.add('dtstart', dt_start)
-
-        # End date
-        dt_end = event_data.get('end_date')
-        if dt_end:
-            if isinstance(dt_end, str):
-                dt_end = datetime.strptime(dt_end, '%Y-%m-%d').date()
-            event.add('dtend', dt_end)
-
-        # Location
-        location_parts = [
-            event_data.get('location', {}).get('address', ''),
-            event_data.get('location', {}).get('city'),
-            event_data.get('location', {}).get('country')
-        ]
-        event.add('location', ", ".join(filter(None, location_parts)))
-
-        # Description
-        description_parts = []
-        if event_data.get('description'):
-            description_parts.append(event_data.get('description'))
-            description_parts.append("")
-
-        fields_to_include = {
-            'Organizer': event_data.get('organizer'),
-            'Type': event_data.get('type'),
-            'Online': 'Yes' if event_data.get('online') else 'No',
-            'Language': event_data.get('language'),
-            'Speakers': event_data.get('speakers'),
-            'URL': event_data.get('url'),
-            'Tags': ", ".join(event_data.get('tags', [])) if event_data.get('tags') else None
-        }
+    """
+    Generates and returns a single iCalendar file containing all events.
+    Accepts the filters of /api/events (e.g. `?country=de&tags=python`) to subscribe to a subset.
+    """
+    catalog.refresh()
+    index = catalog.index
+    query = None
+    if QUERY_ARGS.intersection(request.args):
+        try:
+            query = parse_event_query(request.args)
+        except ValueError as exc:
+            abort(400, description=str(exc))
 
-        price_data = event_data.get('price')
-        if price_data:
-            if isinstance(price_data, dict):
-                currency = price_data.get('currency', '')
-                if 'min_amount' in price_data and 'max_amount' in price_data:
-                    formatted_min = f"{price_data['min_amount']:,}".replace(',', ' ')
-                    formatted_max = f"{price_data['max_amount']:,}".replace(',', ' ')
-                    fields_to_include['Price'] = f"{formatted_min} - {formatted_max} {currency}"
-                elif 'amount' in price_data:
-                    formatted_amount = f"{price_data['amount']:,}".replace(',', ' ')
-                    fields_to_include['Price'] = f"{formatted_amount} {currency}"
-            else:
-                fields_to_include['Price'] = str(price_data)
+    def build():
+        events_data = index.query(**query)['events'] if query else catalog.events
+        return catalog.ics.calendar(events_data, name='OpenTrack.dev Events')
+
+    return cached_response(
+        ('events.ics', query_key(request.args, QUERY_ARGS)),
+        build,
+        mimetype="text/calendar",
+        headers={"Content-disposition": "attachment; filename=events.ics"},
+        phase='ics'
+    )
 
-        for label, value in fields_to_include.items():
-            if value:
-                description_parts.append(f"{label}: {value}")
 
-        event.add('description', "\n".join(description_parts))
-        event.add('url', event_data.get('url'))
-        event['uid'] = f"{event_data.get('id')}@opentrack.dev"
+@app.route('/metrics')
+def prometheus_metrics():
+    """Returns the timings and cache counters of this process in the Prometheus text format."""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
-        if event_data.get('organizer'):
-            event.add('organizer', event_data.get('organizer'))
 
-        cal.add_component(event)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-    return Response(
-        cal.to_ical(),
-        mimetype="text/calendar",
-        headers={"Content-disposition": "attachment; filename=events.ics"}
-    )
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe_request(request.endpoint, time.perf_counter() - started)
+    return response
 
 
 if __name__ == '__main__':
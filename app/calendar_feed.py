@@ -0,0 +1,141 @@
+import threading
+from datetime import datetime
+
+from icalendar import Calendar, Event
+
+
+PRODID = '-//OpenTrack//opentrack.dev//'
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+
+def build_vevent(event_data):
+    """Builds the VEVENT for an event, including all available event data in its description."""
+    event = Event()
+    event.add('summary', event_data.get('name') or event_data.get('title'))
+
+    # Handle start date
+    dt_start = event_data.get('date')
+    if isinstance(dt_start, str):
+        dt_start = datetime.strptime(dt_start, '%Y-%m-%d').date()
+    event.add('dtstart', dt_start)
+
+    # Handle end date if available
+    dt_end = event_data.get('end_date')
+    if dt_end:
+        if isinstance(dt_end, str):
+            dt_end = datetime.strptime(dt_end, '%Y-%m-%d').date()
+        event.add('dtend', dt_end)
+
+    # Set location string
+    location_parts = [
+        event_data.get('location', {}).get('address', ''),
+        event_data.get('location', {}).get('city'),
+        event_data.get('location', {}).get('country')
+    ]
+    event.add('location', ", ".join(filter(None, location_parts)))
+
+    # Construct detailed description including all available event data
+    description_parts = []
+
+    if event_data.get('description'):
+        description_parts.append(event_data.get('description'))
+        description_parts.append("")  # Empty line for spacing
+
+    fields_to_include = {
+        'Organizer': event_data.get('organizer'),
+        'Type': event_data.get('type'),
+        'Online': 'Yes' if event_data.get('online') else 'No',
+        'Language': event_data.get('language'),
+        'Speakers': event_data.get('speakers'),
+        'URL': event_data.get('url'),
+        'Tags': ", ".join(event_data.get('tags', [])) if event_data.get('tags') else None
+    }
+
+    price_data = event_data.get('price')
+    if price_data:
+        if isinstance(price_data, dict):
+            currency = price_data.get('currency', '')
+            if 'min_amount' in price_data and 'max_amount' in price_data:
+                formatted_min = f"{price_data['min_amount']:,}".replace(',', ' ')
+                formatted_max = f"{price_data['max_amount']:,}".replace(',', ' ')
+                fields_to_include['Price'] = f"{formatted_min} - {formatted_max} {currency}"
+            elif 'amount' in price_data:
+                formatted_amount = f"{price_data['amount']:,}".replace(',', ' ')
+                fields_to_include['Price'] = f"{formatted_amount} {currency}"
+        else:
+            fields_to_include['Price'] = str(price_data)
+
+    for label, value in fields_to_include.items():
+        if value:
+            description_parts.append(f"{label}: {value}")
+
+    event.add('description', "\n".join(description_parts))
+    event.add('url', event_data.get('url'))
+    event['uid'] = f"{event_data.get('id')}@opentrack.dev"
+
+    if event_data.get('organizer'):
+        event.add('organizer', event_data.get('organizer'))
+
+    return event
+
+
+def calendar_header(name=None):
+    """Returns the serialized VCALENDAR properties, i.e. a calendar without its closing line."""
+    cal = Calendar()
+    cal.add('prodid', PRODID)
+    cal.add('version', '2.0')
+    if name:
+        cal.add('x-wr-calname', name)
+    return cal.to_ical()[:-len(CALENDAR_FOOTER)]
+
+
+class IcsFeed:
+    """
+    Caches the serialized VEVENT of every event and assembles calendars by concatenation.
+
+    A fragment is reused as long as the catalog hands out the same event object, which it does
+    until one of the event's files (or a record it links to) changes. Assembled feeds are not kept
+    here: the app's response cache memoizes them together with their compressed bodies.
+    """
+
+    def __init__(self):
+        self._fragments = {}
+        self._singles = {}
+        self._headers = {}
+        self._lock = threading.Lock()
+
+    def update(self, events):
+        """Forgets the fragments of events that changed or no longer exist."""
+        current = {e.get('id'): e for e in events}
+        with self._lock:
+            for cache in (self._fragments, self._singles):
+                for event_id, (event_data, _) in list(cache.items()):
+                    if current.get(event_id) is not event_data:
+                        del cache[event_id]
+
+    def fragment(self, event_data):
+        """Returns the VEVENT bytes for an event, rendering them only if the event changed."""
+        event_id = event_data.get('id')
+        cached = self._fragments.get(event_id)
+        if cached is not None and cached[0] is event_data:
+            return cached[1]
+        ical = build_vevent(event_data).to_ical()
+        self._fragments[event_id] = (event_data, ical)
+        return ical
+
+    def calendar(self, events, name=None):
+        """Returns a complete iCalendar file containing the given events."""
+        header = self._headers.get(name)
+        if header is None:
+            header = self._headers[name] = calendar_header(name)
+        return b''.join([header, *(self.fragment(e) for e in events), CALENDAR_FOOTER])
+
+    def event_calendar(self, event_data):
+        """Returns the iCalendar file of a single event, cached until the event changes."""
+        event_id = event_data.get('id')
+        cached = self._singles.get(event_id)
+        if cached is not None and cached[0] is event_data:
+            return cached[1]
+        ical = self.calendar([event_data])
+        self._singles[event_id] = (event_data, ical)
+        return ical
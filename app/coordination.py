@@ -0,0 +1,144 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    Holds an exclusive flock on `path` (created if needed) and yields the open file descriptor.
+    Without `blocking`, yields None instead of waiting if another process holds the lock.
+    On platforms without flock the lock is always granted.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+        yield fd
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def after_fork_in_child(obj, method):
+    """
+    Calls method(obj) in every child process forked later on, for as long as obj is alive.
+    Unlike registering a bound method, this does not keep obj alive forever.
+    """
+    ref = weakref.ref(obj)
+
+    def callback():
+        target = ref()
+        if target is not None:
+            method(target)
+    os.register_at_fork(after_in_child=callback)
+
+
+def signatures_digest(signatures):
+    """Returns a short, stable digest of a scan_data_files() result."""
+    return hashlib.sha256(repr(sorted(signatures.items())).encode()).hexdigest()[:32]
+
+
+class SharedVersion:
+    """
+    Lets processes serving the same data directory share one polling schedule and one revision count.
+
+    Whichever process scans the data directory publishes the digest of what it found in `path`,
+    together with a revision number that goes up whenever the digest changes. The others only
+    stat and read that small file: while it was written less than `max_age` seconds ago they
+    trust it, and only scan themselves when it changed or went stale. Scans happen under a lock,
+    so revisions are numbered in the order the changes were seen.
+
+    The process that publishes a revision also appends which events it added, updated and removed
+    to a change log next to `path`, so every process can tell clients what changed, including
+    across revisions it skipped. The log keeps the last `history` revisions.
+    """
+
+    def __init__(self, path, history=100):
+        self.path = path
+        self.changes_path = path + '.changes'
+        self.history = history
+        self._changes = (None, [])
+
+    def _read(self):
+        """Returns the published (revision, digest), or (0, None) if nothing was published yet."""
+        try:
+            with open(self.path, 'r') as f:
+                fields = f.read().split()
+        except OSError:
+            return 0, None
+        if len(fields) != 2 or not fields[0].isdigit():
+            return 0, None
+        return int(fields[0]), fields[1]
+
+    def read(self, max_age):
+        """Returns the published digest, or None if there is none from the last `max_age` seconds."""
+        try:
+            if time.time() - os.stat(self.path).st_mtime > max_age:
+                return None
+        except OSError:
+            return None
+        return self._read()[1]
+
+    def published_revision(self):
+        """Returns the last published revision (0 if there is none), however old it is."""
+        return self._read()[0]
+
+    def publish(self, digest):
+        """
+        Publishes the digest of a scan and returns its revision, and whether this call started that
+        revision (the digest changed). Call it while holding scan_lock().
+        """
+        revision, published = self._read()
+        changed = digest != published
+        if changed:
+            revision += 1
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{revision} {digest}")
+        os.replace(tmp_path, self.path)
+        return revision, changed
+
+    def read_changes(self):
+        """Returns the change log as (from revision, revision, added ids, updated ids, removed ids) tuples, oldest first."""
+        try:
+            st = os.stat(self.changes_path)
+        except OSError:
+            return []
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached_key, entries = self._changes
+        if key != cached_key:
+            try:
+                with open(self.changes_path, 'r') as f:
+                    entries = [tuple(entry) for entry in json.load(f)]
+            except (OSError, ValueError) as exc:
+                print(f"Ignoring catalog change log: {exc}")
+                entries = []
+            self._changes = (key, entries)
+        return entries
+
+    def record_changes(self, from_revision, revision, added, updated, removed):
+        """Appends the changes of a revision to the log, dropping the entries beyond `history`."""
+        with file_lock(self.changes_path + '.lock'):
+            entries = [list(entry) for entry in self.read_changes()]
+            entries.append([from_revision, revision, added, updated, removed])
+            tmp_path = f"{self.changes_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries[-self.history:], f)
+            os.replace(tmp_path, self.changes_path)
+
+    def scan_lock(self, blocking=True):
+        """Context manager around a scan; without `blocking` it yields None if another process is scanning right now."""
+        return file_lock(self.path + '.lock', blocking=blocking)
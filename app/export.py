@@ -0,0 +1,167 @@
+"""
+Exports the site as static files, so it can be served by nginx or a CDN without running the app:
+
+    python export.py OUTPUT_DIR [--geocode] [--full]
+
+The output holds index.html, the static/ assets, api/events.json (full events),
+api/events.summary.json, api/coordinates.json, events.ics, event/<id>.ics and
+organizer/<id>/image.png. Exporting into the same directory again only rewrites the files whose
+inputs changed and removes the ones that are gone; the state of the last run is kept in MANIFEST.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+
+MANIFEST = '.export-manifest.json'
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def event_fingerprint(event):
+    """Identifies the content of a linked event, so its calendar file is only regenerated when it changes."""
+    return digest(json.dumps(event, sort_keys=True, default=str).encode())
+
+
+class Exporter:
+    """
+    Writes files into an output directory and records what each one was made from.
+
+    Every file has a fingerprint: the hash of its content, or of its inputs when producing the
+    content is the expensive part. A file whose fingerprint matches the previous run is left
+    untouched, so its modification time only changes when its content does and syncing the
+    directory to a CDN uploads just the changes.
+    """
+
+    def __init__(self, root, full=False):
+        self.root = root
+        self.previous = {} if full else self._read_manifest()
+        self.files = {}
+        self.written = 0
+        self.removed = 0
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            print(f"Ignoring export manifest: {exc}")
+            return {}
+
+    def unchanged(self, path, fingerprint):
+        """Tells whether `path` was exported from the same inputs last time (and still exists); if so it is kept."""
+        if self.previous.get(path) == fingerprint and os.path.exists(os.path.join(self.root, path)):
+            self.files[path] = fingerprint
+            return True
+        return False
+
+    def _replace(self, path, fingerprint, write):
+        target = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, target)
+        self.files[path] = fingerprint
+        self.written += 1
+
+    def write(self, path, data, fingerprint=None):
+        """Writes `data` (bytes) to `path`, unless the file is unchanged."""
+        fingerprint = fingerprint or digest(data)
+        if self.unchanged(path, fingerprint):
+            return
+
+        def write_data(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._replace(path, fingerprint, write_data)
+
+    def copy(self, path, source):
+        """Copies the file `source` to `path`, unless it has not changed since the last export."""
+        stat = os.stat(source)
+        fingerprint = f'{stat.st_size}-{stat.st_mtime_ns}'
+        if not self.unchanged(path, fingerprint):
+            self._replace(path, fingerprint, lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    def finish(self):
+        """Removes the files of the previous export that were not exported again and saves the manifest."""
+        for path in sorted(set(self.previous) - set(self.files)):
+            target = os.path.join(self.root, path)
+            try:
+                os.remove(target)
+                self.removed += 1
+            except FileNotFoundError:
+                continue
+            # Drop directories left empty, e.g. organizer/<id>/
+            directory = os.path.dirname(target)
+            while os.path.abspath(directory) != os.path.abspath(self.root) and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+
+        tmp_path = os.path.join(self.root, f"{MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.files, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST))
+
+
+def export(output, geocode=False, full=False):
+    """Exports the current data directory into `output`. Returns the Exporter, e.g. for its counts."""
+    import app as app_module
+
+    os.makedirs(output, exist_ok=True)
+    # Addresses are only looked up online with --geocode, below
+    with app_module.link_geocoding_disabled():
+        catalog = app_module.catalog.refresh(force=True)
+    exporter = Exporter(output, full=full)
+    client = app_module.app.test_client()
+
+    with app_module.app.test_request_context():
+        exporter.write('index.html', app_module.render_index(static=True))
+        coordinates, _ = app_module.collect_coordinates(catalog.events, catalog.countries, wait=geocode, offline=not geocode)
+        exporter.write('api/coordinates.json', app_module.jsonify(coordinates).get_data())
+    exporter.write('api/events.json', client.get('/api/events').get_data())
+    exporter.write('api/events.summary.json', client.get('/api/events?view=summary').get_data())
+    exporter.write('events.ics', client.get('/events.ics').get_data())
+
+    for event in catalog.events:
+        path = f"event/{event['id']}.ics"
+        fingerprint = event_fingerprint(event)
+        if not exporter.unchanged(path, fingerprint):
+            exporter.write(path, catalog.ics.event_calendar(event), fingerprint)
+
+    if os.path.isdir(app_module.ORGANIZERS_DIR):
+        for org_id in sorted(os.listdir(app_module.ORGANIZERS_DIR)):
+            image_path = os.path.join(app_module.ORGANIZERS_DIR, org_id, 'image.png')
+            if os.path.isfile(image_path):
+                exporter.copy(f'organizer/{org_id}/image.png', image_path)
+
+    static_folder = app_module.app.static_folder
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            source = os.path.join(directory, filename)
+            exporter.copy(os.path.join('static', os.path.relpath(source, static_folder)), source)
+
+    exporter.finish()
+    return exporter
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the site as static files.")
+    parser.add_argument('output', help="directory to write the site to")
+    parser.add_argument('--geocode', action='store_true', help="resolve missing coordinates online before exporting them")
+    parser.add_argument('--full', action='store_true', help="rewrite every file, e.g. after changing the templates of the calendar files")
+    args = parser.parse_args(argv)
+
+    exporter = export(args.output, geocode=args.geocode, full=args.full)
+    print(f"Exported {len(exporter.files)} files to {args.output}: {exporter.written} written, {exporter.removed} removed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
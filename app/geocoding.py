@@ -0,0 +1,565 @@
+import atexit
+import collections
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future
+
+from coordination import after_fork_in_child, file_lock
+
+
+class GeocodeCache:
+    """
+    In-memory geocoding cache backed by an append-only SQLite table.
+
+    Lookups only read a dictionary and never take a lock. New results are queued and written
+    to disk in batches, each batch in a single transaction, so a crash can never leave a
+    half-written cache behind. Failed lookups are stored as well (without coordinates) and
+    are served from the cache until `negative_ttl` seconds have passed.
+    """
+
+    def __init__(self, path, negative_ttl=86400, batch_size=20, flush_interval=1.0, legacy_json_path=None):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.legacy_json_path = legacy_json_path
+        self._entries = {}
+        self._pending = []
+        # Incremented on every put, so callers can tell whether cached results changed
+        self.revision = 0
+        self._last_flush = time.monotonic()
+        self._conn = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._last_rowid = 0
+        self._inherited = []
+        atexit.register(self.flush)
+        after_fork_in_child(self, GeocodeCache._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # A forked worker gets its own connection; the parent's one must neither be used nor closed here.
+        # Results the parent has not written yet are the parent's to flush.
+        self._lock = threading.Lock()
+        self._pending = []
+        if self._conn is not None:
+            self._inherited.append(self._conn)
+            self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocodes ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'query TEXT NOT NULL, '
+            'latitude REAL, '
+            'longitude REAL, '
+            'stored_at REAL NOT NULL)'
+        )
+        conn.commit()
+        return conn
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._conn = self._connect()
+            self._migrate_legacy_json()
+            # Rows are append-only, so later rows for the same query replace earlier ones
+            for rowid, query, latitude, longitude, stored_at in self._conn.execute(
+                    'SELECT id, query, latitude, longitude, stored_at FROM geocodes ORDER BY id'):
+                self._entries[query] = (self._coords(latitude, longitude), stored_at)
+                self._last_rowid = rowid
+            self._loaded = True
+
+    def sync(self):
+        """
+        Picks up the rows other processes appended since the last load or sync (the table is append-only,
+        so reading the rows after the last seen id is enough). Returns the number of entries that changed.
+        Also writes this process's queued results once they waited `flush_interval`, so the end of a
+        burst of results does not stay in memory until the next put().
+        """
+        if not self._loaded:
+            self._load()
+            return 0
+        with self._lock:
+            due = self._pending and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+        with self._lock:
+            try:
+                rows = self._connection().execute(
+                    'SELECT id, query, latitude, longitude, stored_at FROM geocodes WHERE id > ? ORDER BY id',
+                    (self._last_rowid,)
+                ).fetchall()
+            except sqlite3.Error as exc:
+                print(f"Could not read geocoding cache {self.path}: {exc}")
+                return 0
+        changed = 0
+        for rowid, query, latitude, longitude, stored_at in rows:
+            entry = (self._coords(latitude, longitude), stored_at)
+            # Our own rows come back as well and change nothing
+            if self._entries.get(query) != entry:
+                self._entries[query] = entry
+                changed += 1
+            self._last_rowid = rowid
+        if changed:
+            self.revision += 1
+        return changed
+
+    def _migrate_legacy_json(self):
+        """Imports the old geocoding_cache.json once and renames it so it is not imported again."""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        try:
+            with open(self.legacy_json_path, 'r') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as exc:
+            print(f"Could not migrate {self.legacy_json_path}: {exc}")
+            return
+
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO geocodes (query, latitude, longitude, stored_at) VALUES (?, ?, ?, ?)',
+                [(query, coords['latitude'], coords['longitude'], now)
+                 for query, coords in legacy.items() if coords]
+            )
+        os.replace(self.legacy_json_path, self.legacy_json_path + '.migrated')
+        print(f"Migrated {len(legacy)} geocoding cache entries from {self.legacy_json_path}")
+
+    @staticmethod
+    def _coords(latitude, longitude):
+        if latitude is None or longitude is None:
+            return None
+        return {'latitude': latitude, 'longitude': longitude}
+
+    def lookup(self, query):
+        """
+        Returns a (found, coords) tuple. `found` is False if the query was never geocoded or
+        its negative result expired; otherwise `coords` is the cached result (None for a known failure).
+        """
+        if not self._loaded:
+            self._load()
+        entry = self._entries.get(query)
+        if entry is None:
+            return False, None
+        coords, stored_at = entry
+        if coords is None and time.time() - stored_at > self.negative_ttl:
+            return False, None
+        return True, coords
+
+    def get(self, query):
+        """Returns the cached coordinates for a query, or None."""
+        return self.lookup(query)[1]
+
+    def put(self, query, coords, ttl=None):
+        """
+        Caches the coordinates for a query. Pass None to remember that the query could not be geocoded,
+        for `negative_ttl` seconds or a shorter `ttl`.
+        """
+        if not self._loaded:
+            self._load()
+        stored_at = time.time()
+        if coords is None and ttl is not None and ttl < self.negative_ttl:
+            # Entries only record when they were stored; backdating one makes it expire after `ttl`
+            stored_at -= self.negative_ttl - ttl
+        self._entries[query] = (coords, stored_at)
+        self.revision += 1
+        with self._lock:
+            self._pending.append((query, coords, stored_at))
+            due = len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def export(self, queries):
+        """Returns the cached entries of the given queries as {query: (coords, stored_at)}."""
+        if not self._loaded:
+            self._load()
+        return {query: self._entries[query] for query in queries if query in self._entries}
+
+    def seed(self, entries):
+        """
+        Adds entries from `export()` (e.g. of a catalog snapshot) for queries that are not cached yet.
+        They keep their original timestamp and are persisted with the next flush.
+        """
+        if not self._loaded:
+            self._load()
+        added = [(query, coords, stored_at) for query, (coords, stored_at) in entries.items() if query not in self._entries]
+        for query, coords, stored_at in added:
+            self._entries[query] = (coords, stored_at)
+        if added:
+            self.revision += 1
+            with self._lock:
+                self._pending.extend(added)
+        return len(added)
+
+    def flush(self):
+        """Writes all queued results to disk in a single transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not pending or not self._loaded:
+                return
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO geocodes (query, latitude, longitude, stored_at) VALUES (?, ?, ?, ?)',
+                        [(query, coords['latitude'] if coords else None, coords['longitude'] if coords else None, stored_at)
+                         for query, coords, stored_at in pending]
+                    )
+            except sqlite3.Error as exc:
+                # Keep the batch queued; the transaction was rolled back as a whole
+                print(f"Could not write geocoding cache {self.path}: {exc}")
+                self._pending = pending + self._pending
+
+    def __len__(self):
+        if not self._loaded:
+            self._load()
+        return len(self._entries)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. `acquire()` blocks until a token is available,
+    so all callers sharing one bucket together never exceed `rate` calls per second.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class FileRateLimiter:
+    """
+    Rate limiter shared by every process (and thread) using the same file, e.g. preforked web workers.
+    The file holds the earliest time the next call may start and is only read and updated under an
+    exclusive flock, so all callers together never exceed `rate` calls per second.
+    """
+
+    def __init__(self, path, rate, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+
+    def acquire(self):
+        with file_lock(self.path) as fd:
+            data = os.pread(fd, 64, 0).strip()
+            try:
+                next_at = float(data) if data else 0.0
+            except ValueError:
+                next_at = 0.0
+            now = self._clock()
+            # Waiting while holding the lock queues the other callers behind us
+            if next_at > now:
+                self._sleep(next_at - now)
+                now = next_at
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, repr(now + 1 / self.rate).encode(), 0)
+
+
+class GeocodeWorker:
+    """
+    Resolves geocoding queries on a small, fixed pool of background threads.
+
+    Queries are deduplicated while they are queued or in flight, so any number of callers
+    asking for the same address result in a single lookup. If a rate limiter is given, every
+    call to the geocoder goes through it. `geocoder` only needs a geopy-style `geocode(query)`
+    method returning an object with `latitude`/`longitude` (or None), so tests can pass a fake.
+    Queries that failed with an error (e.g. the geocoder is unreachable) are not retried for
+    `error_ttl` seconds, so they do not keep the queue busy on every page view.
+    """
+
+    def __init__(self, geocoder, cache, rate_limiter=None, max_queue=10000, threads=1, error_ttl=300):
+        self.geocoder = geocoder
+        self.error_ttl = error_ttl
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_queue = max_queue
+        self.threads = threads
+        self.processed = 0
+        self.failed = 0
+        self._queue = collections.deque()
+        self._futures = {}
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._workers = []
+        after_fork_in_child(self, GeocodeWorker._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Threads do not survive a fork and the parent keeps resolving what it queued,
+        # so a forked worker process starts with an empty queue
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._futures = {}
+        self._in_flight = set()
+        self._workers = []
+
+    def submit(self, query, candidates):
+        """
+        Queues a query for background geocoding. `candidates` are the search strings to try,
+        from most to least specific. Returns a Future for the coordinates, or None if the queue is full.
+        """
+        with self._cond:
+            future = self._futures.get(query)
+            if future is not None:
+                return future
+            if len(self._queue) >= self.max_queue:
+                return None
+            future = Future()
+            self._futures[query] = future
+            self._queue.append((query, candidates, future))
+            self._ensure_started()
+            self._cond.notify()
+        return future
+
+    def resolve(self, query, candidates):
+        """
+        Geocodes a query in the calling thread and returns the coordinates (or None).
+        A query that is already being resolved is waited for instead of being looked up twice.
+        """
+        with self._cond:
+            future = self._futures.get(query)
+            if future is not None and query in self._in_flight:
+                owner = False
+            else:
+                owner = True
+                if future is not None:
+                    # Take the query out of the background queue and resolve it right away
+                    for entry in self._queue:
+                        if entry[0] == query:
+                            self._queue.remove(entry)
+                            break
+                else:
+                    future = Future()
+                    self._futures[query] = future
+                self._in_flight.add(query)
+
+        if owner:
+            self._run(query, candidates, future)
+        return future.result()
+
+    def stats(self):
+        """Returns the current queue depth, the queries in flight and lifetime counters."""
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'in_flight': sorted(self._in_flight),
+                'processed': self.processed,
+                'failed': self.failed,
+            }
+
+    def _ensure_started(self):
+        # Dead workers are replaced on demand
+        self._workers = [t for t in self._workers if t.is_alive()]
+        while len(self._workers) < self.threads:
+            worker = threading.Thread(target=self._work, name='geocode-worker', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                query, candidates, future = self._queue.popleft()
+                self._in_flight.add(query)
+            self._run(query, candidates, future)
+            with self._cond:
+                idle = not self._queue
+            if idle:
+                # The last results of a burst would otherwise wait for the next put()
+                self.cache.flush()
+
+    def _run(self, query, candidates, future):
+        try:
+            future.set_result(self._geocode(query, candidates))
+        except Exception as exc:
+            future.set_exception(exc)
+        finally:
+            with self._cond:
+                self._in_flight.discard(query)
+                self._futures.pop(query, None)
+
+    def _geocode(self, query, candidates):
+        # Another caller (or process sharing the cache) may have resolved the query since it was queued
+        self.cache.sync()
+        found, coords = self.cache.lookup(query)
+        if found:
+            return coords
+
+        errored = False
+        for q in candidates:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                print(f"Attempting geocoding for: {q}")
+                location = self.geocoder.geocode(q)
+            except Exception as e:
+                print(f"Geocoding error for {q}: {e}")
+                errored = True
+                continue
+            if location:
+                coords = {'latitude': location.latitude, 'longitude': location.longitude}
+                self.cache.put(query, coords)  # Cache the original full query
+                print(f"Successfully geocoded: {q} -> {coords}")
+                with self._cond:
+                    self.processed += 1
+                return coords
+
+        print(f"Failed to geocode any query for: {query}")
+        # Definite misses are remembered for long; errors only until the geocoder may be back
+        self.cache.put(query, None, ttl=self.error_ttl if errored else None)
+        with self._cond:
+            self.processed += 1
+            self.failed += 1
+        return None
+
+
+# Result type of the bundled backends. `precision` is 'city' or 'country' for gazetteer matches.
+Location = collections.namedtuple('Location', ['latitude', 'longitude', 'precision'])
+
+
+class Gazetteer:
+    """
+    Offline geocoder backed by an in-memory table of city and country centroids.
+
+    Queries are matched on their last two comma-separated parts ("..., city, country"). A known
+    city returns its centroid; otherwise a known country returns the country centroid. Countries
+    can be referred to by code or by any of their names; matching ignores case and accents.
+    """
+
+    offline = True
+
+    def __init__(self):
+        self._aliases = {}
+        self._countries = {}
+        self._cities = {}
+
+    @staticmethod
+    def normalize(name):
+        decomposed = unicodedata.normalize('NFKD', str(name))
+        return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+    def add_country(self, code, names=(), latitude=None, longitude=None):
+        code = self.normalize(code)
+        for name in (code, *names):
+            if name:
+                self._aliases[self.normalize(name)] = code
+        if latitude is not None and longitude is not None:
+            self._countries[code] = Location(float(latitude), float(longitude), 'country')
+
+    def add_city(self, name, country, latitude, longitude):
+        country_code = self._aliases.get(self.normalize(country), self.normalize(country))
+        self._cities[(self.normalize(name), country_code)] = Location(float(latitude), float(longitude), 'city')
+
+    def load_csv(self, path):
+        """Loads a country_code,country_name,city,latitude,longitude table; rows without a city are country centroids."""
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                if row['city']:
+                    self.add_country(row['country_code'], [row['country_name']])
+                    self.add_city(row['city'], row['country_code'], row['latitude'], row['longitude'])
+                else:
+                    self.add_country(row['country_code'], [row['country_name']], row['latitude'], row['longitude'])
+
+    def load_countries(self, countries):
+        """Registers the countries of the data directory, including their centroid if country.yaml defines one."""
+        for country_id, country in countries.items():
+            self.add_country(country_id, [country.get('name')], country.get('latitude'), country.get('longitude'))
+
+    def geocode(self, query):
+        parts = [part.strip() for part in query.split(',')]
+        country_code = self._aliases.get(self.normalize(parts[-1]))
+        if country_code is None:
+            return None
+        if len(parts) >= 2:
+            city = self._cities.get((self.normalize(parts[-2]), country_code))
+            if city is not None:
+                return city
+        return self._countries.get(country_code)
+
+
+class RateLimitedGeocoder:
+    """Wraps a network geocoder so every call waits for a token from the shared rate limiter."""
+
+    offline = False
+
+    def __init__(self, geocoder, rate_limiter):
+        self.geocoder = geocoder
+        self.rate_limiter = rate_limiter
+
+    def geocode(self, query):
+        self.rate_limiter.acquire()
+        return self.geocoder.geocode(query)
+
+
+class GeocoderChain:
+    """
+    Tries a list of geocoder backends in order and returns the first match.
+
+    Backends marking themselves `offline = True` never touch the network; they are consulted
+    inline through `geocode_offline()`. `geocode()` only asks the remaining (online) backends
+    and is meant to run on the background worker. If every online backend failed and at least
+    one raised, the last error is re-raised so the miss is not cached as definite.
+    """
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+
+    @property
+    def online(self):
+        return any(not getattr(backend, 'offline', False) for backend in self.backends)
+
+    def geocode_offline(self, query):
+        for backend in self.backends:
+            if getattr(backend, 'offline', False):
+                location = backend.geocode(query)
+                if location:
+                    return location
+        return None
+
+    def geocode(self, query):
+        error = None
+        for backend in self.backends:
+            if getattr(backend, 'offline', False):
+                continue
+            try:
+                location = backend.geocode(query)
+            except Exception as exc:
+                error = exc
+                continue
+            if location:
+                return location
+        if error is not None:
+            raise error
+        return None
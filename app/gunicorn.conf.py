@@ -0,0 +1,31 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py
+
+The app is imported and the catalog built once in the master process. Workers are forked from
+it and share the parsed catalog copy-on-write; afterwards each one keeps its own copy current,
+coordinated through the files in the data directory's .cache (see Catalog and GeocodeCache).
+"""
+import gc
+import multiprocessing
+import os
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threads keep a worker responsive while it streams coordinates to a slow client
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '180'))
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    from app import catalog, link_geocoding_disabled
+
+    # A geocoding thread started here would keep running in the master only, next to the forked workers
+    with link_geocoding_disabled():
+        catalog.refresh()
+    # Keep the garbage collector from touching (and thereby copying) the preloaded objects in every worker
+    gc.freeze()
+    server.log.info(f"Catalog loaded with {len(catalog.events)} events")
@@ -0,0 +1,123 @@
+import collections
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from coordination import after_fork_in_child
+
+
+# Content codings, in order of preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Moderate levels: nearly the size of the maximum ones at a fraction of the time
+COMPRESSORS = {
+    'gzip': lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+    'br': lambda body: brotli.compress(body, quality=5),
+}
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class Representation:
+    """
+    A response body together with its compressed variants and validators.
+
+    Each variant is compressed the first time a client asks for it and kept for the later
+    requests, so a catalog change only costs the codings that are actually requested. Each
+    variant has its own strong ETag derived from the content, so two processes serving the
+    same catalog hand out the same validators.
+    """
+
+    def __init__(self, body, mimetype, last_modified=None, headers=None):
+        self.mimetype = mimetype
+        self.last_modified = last_modified.replace(microsecond=0) if last_modified else None
+        self.headers = headers or {}
+        # Compressed variants that would not save bytes are stored as None
+        self.bodies = {'identity': body}
+        self.encodings = ENCODINGS if len(body) >= MIN_COMPRESS_SIZE else ()
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self._lock = threading.Lock()
+
+    def etag(self, encoding):
+        return self.digest if encoding == 'identity' else f'{self.digest}-{encoding}'
+
+    def body(self, encoding):
+        """Returns the body in `encoding`, compressing it on first use; None if compressing it does not pay off."""
+        if encoding not in self.bodies:
+            with self._lock:
+                if encoding not in self.bodies:
+                    identity = self.bodies['identity']
+                    data = COMPRESSORS[encoding](identity)
+                    self.bodies[encoding] = data if len(data) < len(identity) else None
+        return self.bodies[encoding]
+
+    def needs_compression(self, accept_encodings):
+        """Tells whether negotiating for a werkzeug Accept-Encoding header may compress a variant first."""
+        return any(accept_encodings[encoding] > 0 and encoding not in self.bodies for encoding in self.encodings)
+
+    def negotiate(self, accept_encodings):
+        """Returns the best content coding for a werkzeug Accept-Encoding header that saves bytes, falling back to identity."""
+        accepted = [encoding for encoding in self.encodings if accept_encodings[encoding] > 0]
+        # sorted() is stable, so equally accepted codings keep the order of ENCODINGS
+        for encoding in sorted(accepted, key=lambda encoding: -accept_encodings[encoding]):
+            if self.body(encoding) is not None:
+                return encoding
+        return 'identity'
+
+    def is_fresh(self, etag, if_none_match, if_modified_since):
+        """
+        Tells whether the client's cached copy is still current (i.e. whether to answer 304).
+        If-Modified-Since is only considered when the request has no If-None-Match, as required by RFC 9110.
+        """
+        if if_none_match:
+            return if_none_match.contains_weak(etag)
+        if if_modified_since and self.last_modified:
+            return self.last_modified <= if_modified_since
+        return False
+
+
+class ResponseCache:
+    """
+    Memoizes response representations per key until `clear()`, keeping the `max_entries` most recently used.
+    Keys should include the catalog generation, so a response built from an older catalog is never served for a newer one.
+    """
+
+    max_entries = 256
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # A worker forked while another thread held the lock must not inherit it locked
+        after_fork_in_child(self, ResponseCache._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            representation = self._entries.get(key)
+            if representation is not None:
+                self._entries.move_to_end(key)
+            return representation
+
+    def put(self, key, representation):
+        """Stores a representation and returns it, evicting the least recently used one once the cache is full."""
+        with self._lock:
+            self._entries[key] = representation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return representation
+
+    def clear(self):
+        with self._lock:
+            self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
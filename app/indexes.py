@@ -0,0 +1,534 @@
+import base64
+import binascii
+import bisect
+import json
+import math
+import re
+import threading
+import unicodedata
+from datetime import date
+
+
+# Facets that can be filtered on and counted; a filter on several values of one facet matches any of them
+FACETS = ('country', 'city', 'type', 'organizer', 'language', 'tags')
+
+# Boolean filters
+FLAGS = ('free', 'online')
+
+
+def event_date(event):
+    """Returns the start date of an event as an ISO string, so dates of any YAML type compare correctly."""
+    return str(event.get('date', ''))[:10]
+
+
+def is_free(event):
+    price = event.get('price')
+    if price in ('free', 'Free'):
+        return True
+    return isinstance(price, dict) and (price.get('amount') == 0 or price.get('min_amount') == 0)
+
+
+def facet_values(event):
+    """Returns the facet values of an event, using the same rules as the filters in script.js."""
+    loc = event.get('location') or {}
+    language_details = event.get('language_details') or {}
+    return {
+        'country': [str(loc['country']).lower() if loc.get('country') else 'unknown'],
+        'city': [loc['city']] if loc.get('city') else [],
+        'type': [event['type']] if event.get('type') else [],
+        'organizer': [event['organizer']] if event.get('organizer') else [],
+        'language': [language_details.get('id') or str(event.get('language') or 'en').lower()],
+        'tags': list(event.get('tags') or []),
+    }
+
+
+def facet_label(facet, event):
+    """Returns the display data for the value an event has for a facet (names, icons) for the filter dropdowns."""
+    if facet == 'country':
+        details = (event.get('location') or {}).get('country_details') or {}
+        return {'label': details.get('name'), 'icon': details.get('icon')}
+    if facet == 'organizer':
+        details = event.get('organizer_details') or {}
+        return {'label': details.get('name'), 'icon': details.get('image_url')}
+    if facet == 'language':
+        details = event.get('language_details') or {}
+        return {'label': details.get('name')}
+    return {}
+
+
+def fold(text):
+    """Lowercases text and strips accents, so 'Zürich' and 'zurich' index the same."""
+    text = str(text)
+    # Plain ASCII has no accents to strip, and most of the text is plain ASCII
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', fold(text))
+
+
+# Relevance weight of a term occurrence per field
+SEARCH_FIELDS = {
+    'title': 5.0,
+    'tags': 3.0,
+    'organizer': 2.0,
+    'city': 2.0,
+    'country': 2.0,
+    'description': 1.0,
+}
+
+
+def search_fields(event):
+    """Returns the searchable text of an event per field."""
+    loc = event.get('location') or {}
+    country_details = loc.get('country_details') or {}
+    organizer_details = event.get('organizer_details') or {}
+    return {
+        'title': event.get('name') or event.get('title') or '',
+        'tags': " ".join(str(tag) for tag in event.get('tags') or []),
+        'organizer': organizer_details.get('name') or event.get('organizer') or '',
+        'city': loc.get('city') or '',
+        'country': " ".join(str(c) for c in [country_details.get('name'), loc.get('country')] if c),
+        'description': event.get('description') or '',
+    }
+
+
+class SearchIndex:
+    """
+    Inverted index over the title, tags, organizer, city, country and description of the events.
+
+    Each term maps to the events containing it with a field-weighted score. `update()` only
+    re-tokenizes events that are new or were relinked since the previous catalog build (the
+    catalog hands out the same event object while nothing about the event changed). The last
+    term of a query also matches as a prefix, for type-ahead.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._documents = {}
+        self._terms = []
+        self._terms_dirty = False
+        self._lock = threading.Lock()
+
+    def update(self, events, known_weights=None):
+        """
+        Brings the index in line with the given events. Returns the number of (re)indexed events.
+        `known_weights` (from `export()`, for exactly these events) spares tokenizing the events it covers.
+        """
+        current = {str(e.get('id')): e for e in events}
+        known_weights = known_weights or {}
+        changed = 0
+        with self._lock:
+            for event_id in list(self._documents):
+                if current.get(event_id) is not self._documents[event_id][0]:
+                    self._remove(event_id)
+            for event_id, event in current.items():
+                if event_id not in self._documents:
+                    self._add(event_id, event, known_weights.get(event_id))
+                    changed += 1
+        return changed
+
+    def export(self):
+        """Returns the term weights of every indexed event as {event id: {term: weight}}, e.g. for a catalog snapshot."""
+        with self._lock:
+            return {event_id: weights for event_id, (_, weights) in self._documents.items()}
+
+    def _add(self, event_id, event, weights=None):
+        if weights is None:
+            weights = self._weights(event)
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[event_id] = weight
+        self._documents[event_id] = (event, weights)
+
+    @staticmethod
+    def _weights(event):
+        weights = {}
+        for field, text in search_fields(event).items():
+            counts = {}
+            for term in tokenize(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                weights[term] = weights.get(term, 0.0) + SEARCH_FIELDS[field] * (1 + math.log(count))
+        return weights
+
+    def _remove(self, event_id):
+        _, weights = self._documents.pop(event_id)
+        for term in weights:
+            postings = self._postings[term]
+            del postings[event_id]
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+
+    def _expand(self, token, prefix):
+        """Returns the indexed terms a query token matches, with a factor for inexact prefix matches."""
+        if not prefix:
+            return [(token, 1.0)] if token in self._postings else []
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + '\U0010ffff')
+        return [(term, 1.0 if term == token else 0.5) for term in self._terms[start:end]]
+
+    def search(self, query, prefix=True):
+        """
+        Returns (event id, score) pairs of the events matching every term of the query, best match first.
+        With `prefix`, the last term also matches longer words starting with it.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            total = len(self._documents)
+            scores = None
+            for i, token in enumerate(tokens):
+                token_scores = {}
+                for term, factor in self._expand(token, prefix and i == len(tokens) - 1):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for event_id, weight in postings.items():
+                        score = weight * idf * factor
+                        if score > token_scores.get(event_id, 0.0):
+                            token_scores[event_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {event_id: score + token_scores[event_id] for event_id, score in scores.items() if event_id in token_scores}
+                if not scores:
+                    return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def match(self, query):
+        """Returns the ids of the events matching the query."""
+        return {event_id for event_id, _ in self.search(query)}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not (isinstance(key, list) and len(key) == 2 and all(isinstance(k, str) for k in key)):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(key)
+
+
+class EventIndex:
+    """
+    Prebuilt lookup structures for filtering a fixed list of events.
+
+    Events are kept sorted by (start date, id). Each facet maps its values to the set of positions
+    of the events having them, and time windows (upcoming, past, date ranges) are found by
+    bisecting the sorted dates, so a query only touches the events it returns. Pagination uses
+    keyset cursors on (start date, id), which stay valid when the catalog is rebuilt.
+    """
+
+    def __init__(self, events, search_index=None):
+        self.events = sorted(events, key=lambda e: (event_date(e), str(e.get('id'))))
+        self.keys = [(event_date(e), str(e.get('id'))) for e in self.events]
+        self.dates = [key[0] for key in self.keys]
+        self.positions = {key[1]: position for position, key in enumerate(self.keys)}
+        self.values = []
+        self.facets = {facet: {} for facet in FACETS}
+        self.labels = {facet: {} for facet in FACETS}
+        self.flags = {flag: set() for flag in FLAGS}
+        if search_index is None:
+            search_index = SearchIndex()
+            search_index.update(self.events)
+        self.search_index = search_index
+
+        for position, event in enumerate(self.events):
+            values = facet_values(event)
+            self.values.append(values)
+            for facet, facet_vals in values.items():
+                for value in facet_vals:
+                    self.facets[facet].setdefault(value, set()).add(position)
+                    if value not in self.labels[facet]:
+                        self.labels[facet][value] = facet_label(facet, event)
+            if is_free(event):
+                self.flags['free'].add(position)
+            if event.get('online') is True:
+                self.flags['online'].add(position)
+
+    def filter_options(self):
+        """
+        Returns the values of every facet with their display data, sorted by label like the filter
+        dropdowns list them. Cities also name the countries they are in, for the dependent city filter.
+        """
+        options = {}
+        for facet in FACETS:
+            entries = [dict(self.labels[facet].get(value, {}), value=value) for value in self.facets[facet]]
+            entries.sort(key=lambda entry: (str(entry.get('label') or entry['value']).casefold(), str(entry['value'])))
+            options[facet] = entries
+        for entry in options['city']:
+            entry['countries'] = sorted({self.values[position]['country'][0] for position in self.facets['city'][entry['value']]})
+        return options
+
+    def _window(self, time=None, date_from=None, date_to=None, today=None):
+        """Returns the [lo, hi) range of positions whose start date lies in the requested window."""
+        lo, hi = 0, len(self.events)
+        today = (today or date.today()).isoformat()
+        if time == 'future':
+            lo = max(lo, bisect.bisect_left(self.dates, today))
+        elif time == 'past':
+            hi = min(hi, bisect.bisect_left(self.dates, today))
+        if date_from:
+            lo = max(lo, bisect.bisect_left(self.dates, date_from))
+        if date_to:
+            hi = min(hi, bisect.bisect_right(self.dates, date_to))
+        return lo, hi
+
+    def _matching(self, filters, flags, window, search, exclude=None):
+        """Returns the sorted positions matching every filter except the facet named by `exclude`."""
+        result = None
+        for facet, values in filters.items():
+            if facet == exclude or not values:
+                continue
+            positions = set().union(*(self.facets[facet].get(value, ()) for value in values))
+            result = positions if result is None else result & positions
+        for flag in flags:
+            result = set(self.flags[flag]) if result is None else result & self.flags[flag]
+        if search:
+            # The search index may already know events of a newer catalog build; those are skipped
+            found = {self.positions[event_id] for event_id in self.search_index.match(search) if event_id in self.positions}
+            result = found if result is None else result & found
+
+        lo, hi = window
+        if result is None:
+            return list(range(lo, hi))
+        return sorted(p for p in result if lo <= p < hi)
+
+    def matcher(self, filters=None, flags=(), time=None, date_from=None, date_to=None, search=None, today=None, **_):
+        """
+        Returns a predicate telling whether the event with a given id passes the filters.
+        Each test is a set lookup, so callers checking a few events never pay for the whole catalog
+        (except for `search`, which is resolved once). Extra keyword arguments of `query()` are ignored.
+        """
+        lo, hi = self._window(time, date_from, date_to, today)
+        accepted = [
+            self.facets[facet].get(values[0], set()) if len(values) == 1
+            else set().union(*(self.facets[facet].get(value, ()) for value in values))
+            for facet, values in (filters or {}).items() if values
+        ]
+        accepted.extend(self.flags[flag] for flag in flags)
+        if search:
+            accepted.append({self.positions[event_id] for event_id in self.search_index.match(search) if event_id in self.positions})
+
+        def match(event_id):
+            position = self.positions.get(event_id)
+            return position is not None and lo <= position < hi and all(position in positions for positions in accepted)
+        return match
+
+    def facet_counts(self, facets, filters, flags, window, search):
+        """
+        Counts the events per value of each requested facet. Each facet ignores its own filter,
+        so the counts show what selecting another value of that facet would return.
+        """
+        counts = {}
+        for facet in facets:
+            totals = {}
+            for position in self._matching(filters, flags, window, search, exclude=facet):
+                for value in self.values[position][facet]:
+                    totals[value] = totals.get(value, 0) + 1
+            counts[facet] = [
+                dict(self.labels[facet].get(value, {}), value=value, count=count)
+                for value, count in sorted(totals.items(), key=lambda item: (-item[1], str(item[0])))
+            ]
+        return counts
+
+    def query(self, filters=None, flags=(), time=None, date_from=None, date_to=None, search=None,
+              sort='date', cursor=None, limit=None, facets=(), today=None):
+        """
+        Returns the events matching the given filters, sorted by start date ('date' or '-date').
+        `filters` maps facet names to accepted values and `flags` lists the boolean filters to apply.
+        At most `limit` events are returned; `next_cursor` continues after the last one.
+        """
+        filters = filters or {}
+        window = self._window(time, date_from, date_to, today)
+        positions = self._matching(filters, flags, window, search)
+        total = len(positions)
+
+        if sort == '-date':
+            if cursor:
+                positions = positions[:bisect.bisect_left(positions, bisect.bisect_left(self.keys, decode_cursor(cursor)))]
+            positions.reverse()
+        else:
+            if cursor:
+                positions = positions[bisect.bisect_left(positions, bisect.bisect_right(self.keys, decode_cursor(cursor))):]
+
+        page = positions if limit is None else positions[:limit]
+        next_cursor = None
+        if limit is not None and len(positions) > limit and page:
+            next_cursor = encode_cursor(self.keys[page[-1]])
+
+        result = {
+            'events': [self.events[p] for p in page],
+            'total': total,
+            'next_cursor': next_cursor,
+        }
+        if facets:
+            result['facets'] = self.facet_counts(facets, filters, flags, window, search)
+        return result
+
+
+# Finest level of the spatial grid; at level l the world is split into 2^l x 2^l cells
+GRID_LEVELS = 17
+
+# Map zoom from which individual points are returned instead of clusters
+POINTS_ZOOM = 14
+
+# Number of event ids sent along with a cluster
+CLUSTER_SAMPLE = 3
+
+
+def grid_cell(latitude, longitude, level):
+    """Returns the (x, y) cell of a coordinate in the grid of the given level."""
+    size = 1 << level
+    x = min(int((longitude + 180.0) / 360.0 * size), size - 1)
+    y = min(int((latitude + 90.0) / 180.0 * size), size - 1)
+    return max(x, 0), max(y, 0)
+
+
+def parse_bbox(value):
+    """Parses 'west,south,east,north' into floats. Raises ValueError for invalid input."""
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid bbox: {value}")
+    # float() accepts 'inf' and 'nan', which no grid cell can hold
+    if not all(math.isfinite(v) for v in (west, east)) or not (-90 <= south <= north <= 90):
+        raise ValueError(f"Invalid bbox: {value}")
+    return west, south, east, north
+
+
+def _spread_bits(value):
+    """Interleaves zeros into the low 16 bits of a number (0b1011 -> 0b1000101)."""
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    return (value | (value << 1)) & 0x55555555
+
+
+class SpatialIndex:
+    """
+    Grid of event coordinates at every zoom level, for map clustering.
+
+    Points are sorted along a Z-order curve of their finest grid cell, so the points of any cell
+    at any level form one contiguous slice. Each level maps its occupied cells to their count,
+    coordinate sums and slice; an unfiltered viewport is answered from the precomputed cells it
+    covers, and a query never looks at more cells than the viewport (or the level) contains.
+    """
+
+    def __init__(self, points):
+        """`points` is a list of (event id, latitude, longitude) tuples."""
+        finest_level = GRID_LEVELS - 1
+        cells = [grid_cell(latitude, longitude, finest_level) for _, latitude, longitude in points]
+        codes = [_spread_bits(x) | (_spread_bits(y) << 1) for x, y in cells]
+        order = sorted(range(len(points)), key=codes.__getitem__)
+        self.points = [points[p] for p in order]
+
+        # Cells in curve order: [x, y, count, latitude sum, longitude sum, start, end] with [start, end) slicing self.points
+        runs = []
+        for position, p in enumerate(order):
+            _, latitude, longitude = points[p]
+            if runs and (runs[-1][0], runs[-1][1]) == cells[p]:
+                run = runs[-1]
+                run[2] += 1
+                run[3] += latitude
+                run[4] += longitude
+                run[6] = position + 1
+            else:
+                runs.append([cells[p][0], cells[p][1], 1, latitude, longitude, position, position + 1])
+
+        # Each coarser level merges the 2x2 cells below it, which are neighbours on the curve
+        self.levels = [None] * GRID_LEVELS
+        for level in range(finest_level, -1, -1):
+            self.levels[level] = {(run[0], run[1]): run for run in runs}
+            merged = []
+            for x, y, count, lat_sum, lon_sum, start, end in runs:
+                x, y = x >> 1, y >> 1
+                if merged and merged[-1][0] == x and merged[-1][1] == y:
+                    run = merged[-1]
+                    run[2] += count
+                    run[3] += lat_sum
+                    run[4] += lon_sum
+                    run[6] = end
+                else:
+                    merged.append([x, y, count, lat_sum, lon_sum, start, end])
+            runs = merged
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cells(self, level, bbox):
+        """Yields the occupied cells of a level that overlap the bounding box."""
+        west, south, east, north = bbox
+        cells = self.levels[level]
+        if east - west >= 360:
+            ranges = [(-180.0, 180.0)]
+        else:
+            # Longitudes wrap around; a box crossing the antimeridian is split in two
+            west = (west + 180.0) % 360.0 - 180.0
+            east = (east + 180.0) % 360.0 - 180.0
+            ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+        _, y0 = grid_cell(south, 0, level)
+        _, y1 = grid_cell(north, 0, level)
+        for lon0, lon1 in ranges:
+            x0, _ = grid_cell(0, lon0, level)
+            x1, _ = grid_cell(0, lon1, level)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > len(cells):
+                for (x, y), cell in cells.items():
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        yield cell
+            else:
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        cell = cells.get((x, y))
+                        if cell is not None:
+                            yield cell
+
+    def query(self, bbox, zoom, match=None):
+        """
+        Returns the clusters and single points inside the bounding box for a map zoom level.
+        With `match`, a predicate on event ids, only the points of matching events are considered.
+        From POINTS_ZOOM on every point is returned on its own.
+        """
+        zoom = max(0, int(zoom))
+        points_only = zoom >= POINTS_ZOOM
+        # About four cells per 256 pixel map tile
+        level = min(zoom + 2, GRID_LEVELS - 1)
+        clusters = []
+        points = []
+        for _, _, count, lat_sum, lon_sum, start, end in self._cells(level, bbox):
+            positions = range(start, end)
+            if match is not None:
+                positions = [p for p in positions if match(self.points[p][0])]
+                if not positions:
+                    continue
+                count = len(positions)
+                lat_sum = sum(self.points[p][1] for p in positions)
+                lon_sum = sum(self.points[p][2] for p in positions)
+            if points_only or count == 1:
+                points.extend({'id': event_id, 'latitude': latitude, 'longitude': longitude}
+                              for event_id, latitude, longitude in (self.points[p] for p in positions))
+            else:
+                clusters.append({
+                    'latitude': lat_sum / count,
+                    'longitude': lon_sum / count,
+                    'count': count,
+                    'ids': [self.points[p][0] for p in positions[:CLUSTER_SAMPLE]],
+                })
+        return {'zoom': zoom, 'clusters': clusters, 'points': points}
@@ -0,0 +1,94 @@
+import contextlib
+import threading
+import time
+
+from coordination import after_fork_in_child
+
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Timings and cache counters of the current process, rendered in the Prometheus text format.
+
+    `phase()` times a step of building the catalog or a response (scan, parse, link, geocode,
+    serialize, ics, ...), `observe_request()` records a handled request and `count()` records
+    cache hits and misses. Every worker process reports its own numbers.
+    """
+
+    def __init__(self, namespace='opentrack'):
+        self.namespace = namespace
+        self._phases = {}
+        self._requests = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+        # A worker forked while another thread held the lock must not inherit it locked
+        after_fork_in_child(self, Metrics._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(totals, key, seconds):
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._add(self._phases, name, elapsed)
+
+    def observe_request(self, endpoint, seconds):
+        with self._lock:
+            self._add(self._requests, endpoint or 'unknown', seconds)
+
+    def count(self, cache, hits=0, misses=0):
+        """Adds cache lookups; bulk operations pass how many of their items were hits and misses."""
+        with self._lock:
+            for result, amount in (('hit', hits), ('miss', misses)):
+                if amount:
+                    self._caches[cache, result] = self._caches.get((cache, result), 0) + amount
+
+    def snapshot(self):
+        """Returns copies of the phase and request timings ({name: (count, seconds)}) and the cache counters."""
+        with self._lock:
+            return (
+                {name: tuple(entry) for name, entry in self._phases.items()},
+                {name: tuple(entry) for name, entry in self._requests.items()},
+                dict(self._caches),
+            )
+
+    def render(self):
+        phases, requests, caches = self.snapshot()
+        lines = []
+
+        def summary(name, label, totals, help_text):
+            metric = f'{self.namespace}_{name}'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} summary')
+            for value, (count, seconds) in sorted(totals.items()):
+                lines.append(f'{metric}_count{{{label}="{_escape(value)}"}} {count}')
+                lines.append(f'{metric}_sum{{{label}="{_escape(value)}"}} {seconds:.6f}')
+
+        summary('phase_seconds', 'phase', phases, "Time spent in each step of building the catalog and the responses.")
+        summary('request_seconds', 'endpoint', requests, "Time to handle a request until the response is handed to the server.")
+        metric = f'{self.namespace}_cache_lookups_total'
+        lines.append(f'# HELP {metric} Cache lookups by cache and result.')
+        lines.append(f'# TYPE {metric} counter')
+        for (cache, result), count in sorted(caches.items()):
+            lines.append(f'{metric}{{cache="{_escape(cache)}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,108 @@
+import re
+
+
+# Number of characters of the description shown in listings
+EXCERPT_LENGTH = 280
+
+# Top-level event fields sent in the summary view, i.e. everything the event list, map and calendar display
+SUMMARY_FIELDS = (
+    'id', 'title', 'name', 'date', 'end_date', 'type', 'online', 'organizer', 'organizer_details',
+    'language', 'language_details', 'tags', 'url', 'speakers', 'price', 'location',
+)
+
+# Supported values of the `view` parameter
+VIEWS = ('full', 'summary')
+
+
+def plain_text(markdown):
+    """Reduces Markdown (and inline HTML) to a single line of plain text."""
+    text = re.sub(r'```.*?```', ' ', markdown, flags=re.S)
+    text = re.sub(r'<[^>]+>', ' ', text)
+    # Images and links keep their alt/link text
+    text = re.sub(r'!?\[([^\]]*)\]\([^)]*\)', r'\1', text)
+    text = re.sub(r'^\s{0,3}(#{1,6}|>|[-*+]|\d+\.)\s+', '', text, flags=re.M)
+    text = re.sub(r'\*\*|__|~~|[*`]', '', text)
+    return ' '.join(text.split())
+
+
+def excerpt(markdown, length=EXCERPT_LENGTH):
+    """Returns the start of the plain text of a description, cut at a word boundary."""
+    text = plain_text(markdown or '')
+    if len(text) <= length:
+        return text
+    cut = text[:length + 1].rsplit(' ', 1)[0] if ' ' in text[:length + 1] else text[:length]
+    return cut.rstrip(' .,;:-') + '…'
+
+
+def _without_description(details):
+    if not isinstance(details, dict):
+        return details
+    return {key: value for key, value in details.items() if key != 'description'}
+
+
+def summarize(event, known_excerpt=None):
+    """
+    Returns the listing fields of an event plus a plain-text `excerpt` of its description
+    (`known_excerpt` if given, e.g. from a catalog snapshot).
+    Descriptions of linked records (organizer, country, currency) are left out as well.
+    """
+    summary = {field: event[field] for field in SUMMARY_FIELDS if field in event}
+    for field in ('organizer_details', 'language_details'):
+        if field in summary:
+            summary[field] = _without_description(summary[field])
+    if isinstance(summary.get('location'), dict):
+        location = summary['location'] = dict(summary['location'])
+        if 'country_details' in location:
+            location['country_details'] = _without_description(location['country_details'])
+    if isinstance(summary.get('price'), dict):
+        price = summary['price'] = dict(summary['price'])
+        if 'currency_details' in price:
+            price['currency_details'] = _without_description(price['currency_details'])
+    summary['excerpt'] = known_excerpt if known_excerpt is not None else excerpt(event.get('description'))
+    return summary
+
+
+def project(event, fields, summary=None):
+    """Returns only the requested top-level fields of an event (always including its id); `excerpt` is taken from the summary."""
+    result = {field: event[field] for field in ('id', *fields) if field in event}
+    if summary is not None and 'excerpt' in fields:
+        result['excerpt'] = summary['excerpt']
+    return result
+
+
+# Supported values of the `format` parameter
+FORMATS = ('flat', 'normalized')
+
+# Records linked into events: (reference name, table name, field holding the record, field containing that field or None)
+REFERENCES = (
+    ('organizer', 'organizers', 'organizer_details', None),
+    ('language', 'languages', 'language_details', None),
+    ('country', 'countries', 'country_details', 'location'),
+    ('currency', 'currencies', 'currency_details', 'price'),
+)
+
+
+def normalize(events):
+    """
+    Replaces the records linked into events by their ids.
+    Each event gets a `references` dictionary (e.g. {'organizer': 'acme', 'country': 'de'}) and
+    every referenced record is returned once in the tables of `records`.
+    Returns an (events, records) tuple.
+    """
+    records = {table: {} for _, table, _, _ in REFERENCES}
+    normalized = []
+    for event in events:
+        event = dict(event)
+        references = {}
+        for name, table, field, parent in REFERENCES:
+            container = event.get(parent) if parent else event
+            if not isinstance(container, dict) or not isinstance(container.get(field), dict):
+                continue
+            if parent:
+                container = event[parent] = dict(container)
+            record = container.pop(field)
+            references[name] = record.get('id')
+            records[table].setdefault(record.get('id'), record)
+        event['references'] = references
+        normalized.append(event)
+    return normalized, records
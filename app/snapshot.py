@@ -0,0 +1,135 @@
+"""
+Compiles the data directory into a catalog snapshot.
+
+The snapshot holds the parsed data files, the search terms and description excerpts of the events
+and their geocoding results, as plain data. When it matches the data directory, the app loads it at
+startup and only links the events and builds the filter indexes again, instead of parsing every
+YAML and Markdown file:
+
+    python snapshot.py [--output PATH] [--geocode]
+"""
+import argparse
+import datetime
+import gc
+import hashlib
+import marshal
+import os
+import sys
+
+
+MAGIC = b'OTSNAP'
+# Bump whenever the layout of the snapshot changes
+VERSION = 3
+
+# marshal only stores builtin types; dates from the YAML files are stored as tagged tuples.
+# The tag cannot appear in parsed YAML, which has no tuples.
+DATE_TAG = '\0date'
+DATETIME_TAG = '\0datetime'
+
+
+def source_digest():
+    """
+    Identifies the Python version and the code that parses and indexes the data files and reads snapshots,
+    so a snapshot written by any other version of the app is ignored instead of misread.
+    """
+    digest = hashlib.sha256(f"{sys.version_info[:2]} {marshal.version}".encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in ('app.py', 'indexes.py', 'payloads.py', 'snapshot.py'):
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()[:16]
+
+
+HEADER = MAGIC + VERSION.to_bytes(2, 'big') + source_digest()
+
+
+def _encode(value):
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_encode(item) for item in value)
+    # datetime is a subclass of date
+    if isinstance(value, datetime.datetime):
+        return (DATETIME_TAG, value.isoformat())
+    if isinstance(value, datetime.date):
+        return (DATE_TAG, value.isoformat())
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, tuple):
+        if len(value) == 2 and value[0] == DATETIME_TAG:
+            return datetime.datetime.fromisoformat(value[1])
+        if len(value) == 2 and value[0] == DATE_TAG:
+            return datetime.date.fromisoformat(value[1])
+        return tuple(_decode(item) for item in value)
+    return value
+
+
+def write_snapshot(path, state):
+    """Writes the state atomically, so a running app never reads a half-written snapshot."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER)
+        # Only the parsed YAML files can hold dates; the rest is left as it is, which keeps loading fast
+        marshal.dump(dict(state, item_records=_encode(state['item_records'])), f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Returns the state stored in a snapshot, or None if there is no usable snapshot at `path`.
+    The snapshot only holds plain data, so a tampered file cannot run code in the app.
+    """
+    # Loading creates millions of objects, none of them garbage; collecting in between only slows it down
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(HEADER))
+            if header != HEADER:
+                print(f"Ignoring snapshot {path}: written by another version of the app")
+                return None
+            state = marshal.load(f)
+        if not isinstance(state, dict) or not isinstance(state.get('item_records'), dict):
+            print(f"Ignoring snapshot {path}: unexpected content")
+            return None
+        state['item_records'] = _decode(state['item_records'])
+        return state
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as exc:
+        print(f"Ignoring snapshot {path}: {exc}")
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def main(argv=None):
+    import app as app_module
+
+    parser = argparse.ArgumentParser(description="Compile the data directory into a catalog snapshot.")
+    parser.add_argument('--output', default=app_module.SNAPSHOT_FILE, help=f"snapshot file (default: {app_module.SNAPSHOT_FILE})")
+    parser.add_argument('--geocode', action='store_true', help="resolve missing coordinates online before writing the snapshot")
+    args = parser.parse_args(argv)
+
+    catalog = app_module.Catalog(poll_interval=0)
+    # Addresses are only looked up online with --geocode, below
+    with app_module.link_geocoding_disabled():
+        catalog.refresh(force=True)
+    if args.geocode:
+        app_module.collect_coordinates(catalog.events, catalog.countries, wait=True)
+    write_snapshot(args.output, catalog.snapshot_state())
+    print(f"Wrote {len(catalog.events)} events to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,22 @@ document.addEventListener('DOMContentLoaded', function() {
     let calendar;
     let map;
     let markers = [];
+    let markerRequest = 0; // sequence number of the latest /api/map request
+    let markerTimer;
+    let eventsById = new Map();
     let tomSelects = {};
+    let searchIds = null; // ids of the events matching the search box, as returned by /api/search
+    let searchTimer;
 
     initTabs();
     initDropdowns();
 
+    // The page is cached for every visitor, so subscription links get the host they were loaded from here
+    document.querySelectorAll('a[data-webcal]').forEach(link => {
+        const url = new URL(link.getAttribute('href'), window.location.href);
+        link.href = `webcal://${url.host}${url.pathname}`;
+    });
+
     function initTomSelect(id) {
         if (tomSelects[id]) return tomSelects[id];
         const el = document.getElementById(id);
@@ -127,170 +138,220 @@ document.addEventListener('DOMContentLoaded', function() {
         // Fix Leaflet default icon paths
         delete L.Icon.Default.prototype._getIconUrl;
         L.Icon.Default.mergeOptions({
-            iconRetinaUrl: '/static/vendor/leaflet/images/marker-icon-2x.png',
-            iconUrl: '/static/vendor/leaflet/images/marker-icon.png',
-            shadowUrl: '/static/vendor/leaflet/images/marker-shadow.png',
+            // Relative to this script, so an exported site works below any path
+            iconRetinaUrl: new URL('../vendor/leaflet/images/marker-icon-2x.png', import.meta.url).href,
+            iconUrl: new URL('../vendor/leaflet/images/marker-icon.png', import.meta.url).href,
+            shadowUrl: new URL('../vendor/leaflet/images/marker-shadow.png', import.meta.url).href,
         });
 
         map = L.map('map').setView([20, 0], 2);
         L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
             attribution: '© OpenStreetMap contributors'
         }).addTo(map);
+        map.on('moveend', updateMarkers);
     }
 
-    fetch('/api/events')
-        .then(response => response.json())
-        .then(events => {
-            allEvents = events;
-            const today = new Date();
-            today.setHours(0, 0, 0, 0);
-            document.getElementById('event-count').innerText = events.filter(e => new Date(e.date) >= today).length;
-            
-            const tags = new Set();
-            const organizers = new Map();
-            const languages = new Map();
-            const countries = new Map();
-            
-            events.forEach(e => {
-                e.tags.forEach(t => tags.add(t));
-                if (e.organizer) {
-                    const orgName = (e.organizer_details && e.organizer_details.name) ? e.organizer_details.name : e.organizer;
-                    const orgIcon = (e.organizer_details && e.organizer_details.image_url) ? e.organizer_details.image_url : null;
-                    organizers.set(e.organizer, {name: orgName, icon: orgIcon});
-                }
-                const langName = (e.language_details && e.language_details.name) ? e.language_details.name : (e.language || 'en');
-                const langId = (e.language_details && e.language_details.id) ? e.language_details.id : (e.language || 'en').toLowerCase();
-                languages.set(langId, langName);
-                
-                const countryId = (e.location && e.location.country) ? e.location.country.toLowerCase() : 'unknown';
-                const countryName = (e.location && e.location.country_details && e.location.country_details.name) ? e.location.country_details.name : countryId;
-                countries.set(countryId, countryName);
-            });
-
-            const countryFilter = document.getElementById('filter-country');
-            Array.from(countries.entries()).sort((a, b) => a[1].localeCompare(b[1])).forEach(([id, name]) => {
-                const option = document.createElement('option');
-                option.value = id;
-                const countryEvent = events.find(e => e.location && e.location.country && e.location.country.toLowerCase() === id);
-                const icon = (countryEvent && countryEvent.location.country_details) ? countryEvent.location.country_details.icon : '';
-                option.textContent = icon ? `${icon} ${name}` : name;
-                countryFilter.appendChild(option);
-            });
-
-            const cityFilter = document.getElementById('filter-city');
-            // Cities will be populated based on selected country or all if none selected
-            function updateCityFilter() {
-                const selectedCountries = tomSelects['filter-country'] ? tomSelects['filter-country'].getValue() : [];
-                const cities = new Set();
-                events.forEach(e => {
-                    const countryId = (e.location && e.location.country) ? e.location.country.toLowerCase() : 'unknown';
-                    if (selectedCountries.length === 0 || selectedCountries.includes(countryId)) {
-                        if (e.location && e.location.city) cities.add(e.location.city);
-                    }
-                });
-                
-                if (tomSelects['filter-city']) {
-                    const currentSelected = tomSelects['filter-city'].getValue();
-                    tomSelects['filter-city'].clearOptions();
-                    Array.from(cities).sort().forEach(city => {
-                        tomSelects['filter-city'].addOption({value: city, text: city});
-                    });
-                    tomSelects['filter-city'].setValue(currentSelected);
-                } else {
-                    Array.from(cities).sort().forEach(city => {
-                        const option = document.createElement('option');
-                        option.value = city;
-                        option.textContent = city;
-                        cityFilter.appendChild(option);
-                    });
-                }
+    // The page embeds the summary of every event (the full record is at /api/events/<id>) and the
+    // options of the filter dropdowns, so the list renders without waiting for another request
+    const bootstrap = JSON.parse(document.getElementById('bootstrap-data').textContent);
+    initEvents(bootstrap.events, bootstrap.filters);
+
+    function addOptions(select, options, iconIsImage = false) {
+        options.forEach(entry => {
+            const option = document.createElement('option');
+            const label = entry.label || entry.value;
+            option.value = entry.value;
+            if (entry.icon && iconIsImage) {
+                option.textContent = label;
+                option.setAttribute('data-icon', entry.icon);
+            } else {
+                option.textContent = entry.icon ? `${entry.icon} ${label}` : label;
             }
-            updateCityFilter();
-
-            const tagSelect = document.getElementById('filter-tags');
-            Array.from(tags).sort().forEach(tag => {
-                const option = document.createElement('option');
-                option.value = tag;
-                option.textContent = tag;
-                tagSelect.appendChild(option);
-            });
+            select.appendChild(option);
+        });
+    }
 
-            const organizerFilter = document.getElementById('filter-organizer');
-            Array.from(organizers.entries()).sort((a, b) => a[1].name.localeCompare(b[1].name)).forEach(([id, data]) => {
-                const option = document.createElement('option');
-                option.value = id;
-                option.textContent = data.name;
-                if (data.icon) {
-                    option.setAttribute('data-icon', data.icon);
-                }
-                organizerFilter.appendChild(option);
-            });
-            
-            const languageFilter = document.getElementById('filter-language');
-            Array.from(languages.entries()).sort((a, b) => a[1].localeCompare(b[1])).forEach(([id, name]) => {
-                const option = document.createElement('option');
-                option.value = id;
-                option.textContent = name;
-                languageFilter.appendChild(option);
-            });
+    function initEvents(events, filters) {
+        allEvents = events;
+        eventsById = new Map(events.map(e => [e.id, e]));
+        const today = new Date();
+        today.setHours(0, 0, 0, 0);
+        document.getElementById('event-count').innerText = events.filter(e => new Date(e.date) >= today).length;
 
-            initTomSelect('filter-country');
-            initTomSelect('filter-city');
-            initTomSelect('filter-type');
-            initTomSelect('filter-organizer');
-            initTomSelect('filter-language');
-            initTomSelect('filter-tags');
+        addOptions(document.getElementById('filter-country'), filters.country);
 
-            if (tomSelects['filter-country']) {
-                tomSelects['filter-country'].on('change', () => {
-                    updateCityFilter();
-                    filterAll();
-                    updateUrl();
+        const cityFilter = document.getElementById('filter-city');
+        // Cities will be populated based on selected country or all if none selected
+        function updateCityFilter() {
+            const selectedCountries = tomSelects['filter-country'] ? tomSelects['filter-country'].getValue() : [];
+            const cities = filters.city
+                .filter(entry => selectedCountries.length === 0 || entry.countries.some(c => selectedCountries.includes(c)))
+                .map(entry => entry.value);
+            
+            if (tomSelects['filter-city']) {
+                const currentSelected = tomSelects['filter-city'].getValue();
+                tomSelects['filter-city'].clearOptions();
+                cities.forEach(city => {
+                    tomSelects['filter-city'].addOption({value: city, text: city});
+                });
+                tomSelects['filter-city'].setValue(currentSelected);
+            } else {
+                cities.forEach(city => {
+                    const option = document.createElement('option');
+                    option.value = city;
+                    option.textContent = city;
+                    cityFilter.appendChild(option);
                 });
             }
+        }
+        updateCityFilter();
 
-            loadStateFromUrl();
-            renderList(getFilteredEvents());
+        addOptions(document.getElementById('filter-tags'), filters.tags);
+        addOptions(document.getElementById('filter-organizer'), filters.organizer, true);
+        addOptions(document.getElementById('filter-language'), filters.language);
 
-            document.getElementById('filter-time').addEventListener('change', () => { filterAll(); updateUrl(); });
-            document.getElementById('filter-free').addEventListener('change', () => { filterAll(); updateUrl(); });
-            document.getElementById('filter-online').addEventListener('change', () => { filterAll(); updateUrl(); });
-            document.getElementById('event-search').addEventListener('input', () => { filterAll(); updateUrl(); });
+        initTomSelect('filter-country');
+        initTomSelect('filter-city');
+        initTomSelect('filter-type');
+        initTomSelect('filter-organizer');
+        initTomSelect('filter-language');
+        initTomSelect('filter-tags');
 
-            const urlParams = new URLSearchParams(window.location.search);
-            if (urlParams.has('event')) {
-                const eventId = urlParams.get('event');
-                setTimeout(() => {
-                    const element = document.getElementById(`event-${eventId}`);
-                    if (element) {
-                        element.scrollIntoView({ behavior: 'smooth', block: 'center' });
-                        element.classList.add('highlight-event');
-                    }
-                }, 500);
-            }
+        if (tomSelects['filter-country']) {
+            tomSelects['filter-country'].on('change', () => {
+                updateCityFilter();
+                filterAll();
+                updateUrl();
+            });
+        }
+
+        loadStateFromUrl();
+        renderList(getFilteredEvents());
+        if (document.getElementById('event-search').value) runSearch();
 
-            // After events are loaded and rendered, fetch coordinates asynchronously
-            fetchCoordinates();
+        document.getElementById('filter-time').addEventListener('change', () => { filterAll(); updateUrl(); });
+        document.getElementById('filter-free').addEventListener('change', () => { filterAll(); updateUrl(); });
+        document.getElementById('filter-online').addEventListener('change', () => { filterAll(); updateUrl(); });
+        document.getElementById('event-search').addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(runSearch, 150);
         });
 
+        const urlParams = new URLSearchParams(window.location.search);
+        if (urlParams.has('event')) {
+            const eventId = urlParams.get('event');
+            setTimeout(() => {
+                const element = document.getElementById(`event-${eventId}`);
+                if (element) {
+                    element.scrollIntoView({ behavior: 'smooth', block: 'center' });
+                    element.classList.add('highlight-event');
+                }
+            }, 500);
+        }
+
+        // After events are loaded and rendered, fetch coordinates asynchronously
+        fetchCoordinates();
+    }
+
     function fetchCoordinates() {
-        fetch('/api/coordinates')
-            .then(response => response.json())
-            .then(coordsMap => {
-                allEvents.forEach(event => {
-                    if (coordsMap[event.id]) {
-                        event.location.latitude = coordsMap[event.id].latitude;
-                        event.location.longitude = coordsMap[event.id].longitude;
-                    }
-                });
-                // Update map if it's already initialized
-                if (map) {
-                    updateMarkers(getFilteredEvents());
+        const eventsById = new Map(allEvents.map(e => [e.id, e]));
+        let buffer = '';
+
+        // Applies every complete NDJSON line received so far and returns whether a marker changed
+        function applyLines(text, flush) {
+            buffer += text;
+            const lines = buffer.split('\n');
+            buffer = flush ? '' : lines.pop();
+            let changed = false;
+            lines.filter(line => line.trim()).forEach(line => {
+                if (applyCoordinates(JSON.parse(line))) changed = true;
+            });
+            return changed;
+        }
+
+        function applyCoordinates(item) {
+            const event = item.id && eventsById.get(item.id);
+            if (!event || !event.location) return false;
+            event.location.latitude = item.latitude;
+            event.location.longitude = item.longitude;
+            return true;
+        }
+
+        // An exported site has a file with every coordinate known at export time
+        if (bootstrap.static) {
+            fetch('api/coordinates.json')
+                .then(response => response.json())
+                .then(coordinates => {
+                    const changed = Object.entries(coordinates).filter(([id, coords]) => applyCoordinates({...coords, id}));
+                    if (changed.length && map) updateMarkers();
+                })
+                .catch(error => console.error('Error fetching coordinates:', error));
+            return;
+        }
+
+        // Known coordinates arrive at once; newly geocoded locations follow as they are resolved
+        fetch('/api/coordinates/stream')
+            .then(response => {
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                function read() {
+                    return reader.read().then(({ done, value }) => {
+                        const text = value ? decoder.decode(value, { stream: !done }) : '';
+                        // Update map if it's already initialized
+                        if (applyLines(text, done) && map) {
+                            clearTimeout(markerTimer);
+                            markerTimer = setTimeout(updateMarkers, 500);
+                        }
+                        if (!done) return read();
+                    });
                 }
+                return read();
             })
             .catch(error => console.error('Error fetching coordinates:', error));
     }
 
+    function runSearch() {
+        const query = document.getElementById('event-search').value.trim();
+        if (!query) {
+            searchIds = null;
+            filterAll();
+            updateUrl();
+            return;
+        }
+        if (bootstrap.static) {
+            searchIds = searchLocally(query);
+            filterAll();
+            updateUrl();
+            return;
+        }
+        fetch(`/api/search?q=${encodeURIComponent(query)}&limit=all`)
+            .then(response => response.json())
+            .then(data => {
+                // Ignore responses for a search term the user has already changed
+                if (document.getElementById('event-search').value.trim() !== query) return;
+                searchIds = new Set(data.results.map(r => r.id));
+                filterAll();
+                updateUrl();
+            })
+            .catch(error => console.error('Error searching events:', error));
+    }
+
+    // Search of an exported site: the events whose listing fields contain every word of the query
+    function searchLocally(query) {
+        const fold = text => String(text || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+        const words = fold(query).split(/\s+/).filter(w => w);
+        const ids = new Set();
+        allEvents.forEach(e => {
+            const location = e.location || {};
+            const text = fold([
+                e.name, e.title, (e.tags || []).join(' '), e.organizer_details && e.organizer_details.name,
+                location.city, location.country_details && location.country_details.name, e.excerpt
+            ].join(' '));
+            if (words.every(w => text.includes(w))) ids.add(e.id);
+        });
+        return ids;
+    }
+
     function getFilteredEvents() {
         const selectedCountries = tomSelects['filter-country'] ? tomSelects['filter-country'].getValue() : [];
         const selectedCities = tomSelects['filter-city'] ? tomSelects['filter-city'].getValue() : [];
@@ -298,7 +359,6 @@ document.addEventListener('DOMContentLoaded', function() {
         const timeFilter = document.getElementById('filter-time').value;
         const selectedOrganizers = tomSelects['filter-organizer'] ? tomSelects['filter-organizer'].getValue() : [];
         const selectedLanguages = tomSelects['filter-language'] ? tomSelects['filter-language'].getValue() : [];
-        const search = document.getElementById('event-search').value.toLowerCase();
         const isFree = document.getElementById('filter-free').checked;
         const isOnline = document.getElementById('filter-online').checked;
         const selectedTags = tomSelects['filter-tags'] ? tomSelects['filter-tags'].getValue() : [];
@@ -320,11 +380,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const eventLangId = (e.language_details && e.language_details.id) ? e.language_details.id : (e.language || 'en').toLowerCase();
             const languageMatch = selectedLanguages.length === 0 || selectedLanguages.includes(eventLangId);
             
-            const searchMatch = !search || 
-                (e.name || e.title).toLowerCase().includes(search) || 
-                e.location.city.toLowerCase().includes(search) ||
-                e.location.country.toLowerCase().includes(search) ||
-                e.tags.some(t => t.toLowerCase().includes(search));
+            const searchMatch = !searchIds || searchIds.has(e.id);
             const tagsMatch = selectedTags.length === 0 || selectedTags.some(t => e.tags.includes(t));
             let timeMatch = true;
             if (timeFilter === 'future') {
@@ -338,7 +394,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    function updateUrl() {
+    // Query parameters for the active filters, as understood by /api/events and /api/map
+    function filterParams() {
         const params = new URLSearchParams();
         const search = document.getElementById('event-search').value;
         const countries = tomSelects['filter-country'] ? tomSelects['filter-country'].getValue() : [];
@@ -355,12 +412,18 @@ document.addEventListener('DOMContentLoaded', function() {
         if (countries.length > 0) params.set('country', countries.join(','));
         if (cities.length > 0) params.set('city', cities.join(','));
         if (types.length > 0) params.set('type', types.join(','));
-        if (time && time !== 'future') params.set('time', time);
+        if (time) params.set('time', time);
         if (organizers.length > 0) params.set('organizer', organizers.join(','));
         if (languages.length > 0) params.set('language', languages.join(','));
         if (free) params.set('free', 'true');
         if (online) params.set('online', 'true');
         if (tags.length > 0) params.set('tags', tags.join(','));
+        return params;
+    }
+
+    function updateUrl() {
+        const params = filterParams();
+        if (params.get('time') === 'future') params.delete('time');
 
         const newUrl = window.location.pathname + (params.toString() ? '?' + params.toString() : '');
         window.history.replaceState({}, '', newUrl);
@@ -416,7 +479,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const activeCount = filtered.filter(e => new Date(e.date) >= today).length;
         document.getElementById('event-count').innerText = activeCount;
         renderList(filtered);
-        if (map) updateMarkers(filtered);
+        if (map) updateMarkers();
         if (calendar) calendar.refetchEvents();
     }
 
@@ -456,7 +519,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const day = dateObj.getDate();
             const year = dateObj.getFullYear();
             const showYear = year !== currentYear;
-            const description = event.description || '';
+            const description = event.excerpt || '';
             
             let speakersText = 'TBA';
             if (event.speakers) {
@@ -505,7 +568,7 @@ document.addEventListener('DOMContentLoaded', function() {
                                 <i class="bi bi-three-dots-vertical"></i>
                             </button>
                             <ul class="dropdown-menu shadow-sm border-0">
-                                <li><a class="dropdown-item py-2" href="/event/${event.id}.ics">
+                                <li><a class="dropdown-item py-2" href="${bootstrap.static ? '' : '/'}event/${event.id}.ics">
                                     <i class="bi bi-calendar-event me-2"></i>Download ICS
                                 </a></li>
                                 <li><button class="dropdown-item py-2 share-event" data-id="${event.id}">
@@ -582,24 +645,55 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    function updateMarkers(events) {
+    // Markers come from /api/map, which clusters the events of the current viewport on the server
+    function updateMarkers() {
         if (!map) return;
-        markers.forEach(m => map.removeLayer(m));
-        markers = [];
-        events.forEach(event => {
-            if (event.location && event.location.latitude && event.location.longitude) {
-                const pos = [event.location.latitude, event.location.longitude];
-                const m = L.marker(pos).addTo(map)
-                    .bindPopup(`
-                        <div class="p-2 text-center">
-                            <h6 class="fw-bold mb-1">${event.title}</h6>
-                            <p class="small text-muted mb-2">${event.location.city}</p>
-                            <button onclick="window.scrollToEvent('${event.id}')" class="btn btn-sm btn-primary w-100">View in List</button>
-                        </div>
-                    `);
-                markers.push(m);
-            }
-        });
+        const bounds = map.getBounds();
+        const params = filterParams();
+        params.set('bbox', [bounds.getWest(), Math.max(bounds.getSouth(), -90), bounds.getEast(), Math.min(bounds.getNorth(), 90)].join(','));
+        params.set('zoom', map.getZoom());
+        const request = ++markerRequest;
+        // An exported site has no /api/map: it shows a marker for every matching event
+        const markerData = bootstrap.static
+            ? Promise.resolve({clusters: [], points: getFilteredEvents()
+                .filter(e => e.location && e.location.latitude != null && e.location.longitude != null)
+                .map(e => ({id: e.id, latitude: e.location.latitude, longitude: e.location.longitude}))})
+            : fetch(`/api/map?${params}`).then(response => response.json());
+
+        markerData
+            .then(data => {
+                // Ignore responses for viewports the user already moved away from
+                if (request !== markerRequest) return;
+                markers.forEach(m => map.removeLayer(m));
+                markers = [];
+
+                data.clusters.forEach(cluster => {
+                    const m = L.marker([cluster.latitude, cluster.longitude], {
+                        icon: L.divIcon({
+                            html: `<div class="map-cluster">${cluster.count}</div>`,
+                            className: '',
+                            iconSize: [40, 40]
+                        })
+                    }).addTo(map);
+                    m.on('click', () => map.setView([cluster.latitude, cluster.longitude], Math.min(map.getZoom() + 2, map.getMaxZoom())));
+                    markers.push(m);
+                });
+
+                data.points.forEach(point => {
+                    const event = eventsById.get(point.id);
+                    if (!event) return;
+                    const m = L.marker([point.latitude, point.longitude]).addTo(map)
+                        .bindPopup(`
+                            <div class="p-2 text-center">
+                                <h6 class="fw-bold mb-1">${event.title}</h6>
+                                <p class="small text-muted mb-2">${event.location.city}</p>
+                                <button onclick="window.scrollToEvent('${event.id}')" class="btn btn-sm btn-primary w-100">View in List</button>
+                            </div>
+                        `);
+                    markers.push(m);
+                });
+            })
+            .catch(error => console.error('Error fetching map markers:', error));
     }
 
     window.scrollToEvent = function(eventId) {
@@ -626,7 +720,7 @@ document.addEventListener('DOMContentLoaded', function() {
         } else if (targetId === '#map-view') {
             if (!map) {
                 initMap();
-                updateMarkers(getFilteredEvents());
+                updateMarkers();
             } else {
                 map.invalidateSize();
             }
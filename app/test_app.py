@@ -1,7 +1,123 @@
 import unittest
+import gc
+import importlib.util
 import os
+import shutil
+import tempfile
+import time
+import json
+import gzip
+import pickle
 import yaml
-from app import load_events
+from unittest import mock
+
+import app as app_module
+from app import load_events, Catalog
+from indexes import SearchIndex, SpatialIndex
+import calendar_feed
+import snapshot
+import indexes
+import payloads
+import export
+import http_cache
+import metrics
+from icalendar import Calendar
+import threading
+import weakref
+from datetime import date
+from geocoding import GeocodeCache, GeocodeWorker, Gazetteer, GeocoderChain, TokenBucket, FileRateLimiter
+from coordination import SharedVersion
+
+
+class FakeGeocoder:
+    """Stands in for Nominatim; knows a fixed set of places and records every query."""
+
+    def __init__(self, places=None, gate=None):
+        self.places = places or {}
+        self.gate = gate
+        self.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if query in self.places:
+            latitude, longitude = self.places[query]
+            return mock.Mock(latitude=latitude, longitude=longitude)
+        return None
+
+
+class DataDirTestCase(unittest.TestCase):
+    """Points the loaders at a throwaway data directory for the duration of a test."""
+
+    KIND_DIRS = {
+        'event': 'events',
+        'organizer': 'organizers',
+        'language': 'languages',
+        'currency': 'currencies',
+        'country': 'countries',
+    }
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        dirs = {
+            'DATA_ROOT': self.data_root,
+            'EVENTS_DIR': os.path.join(self.data_root, 'events'),
+            'ORGANIZERS_DIR': os.path.join(self.data_root, 'organizers'),
+            'LANGUAGES_DIR': os.path.join(self.data_root, 'languages'),
+            'CURRENCIES_DIR': os.path.join(self.data_root, 'currencies'),
+            'COUNTRIES_DIR': os.path.join(self.data_root, 'countries'),
+            'CACHE_DIR': os.path.join(self.data_root, '.cache'),
+            'SNAPSHOT_FILE': os.path.join(self.data_root, '.cache', 'catalog.snapshot'),
+        }
+        os.makedirs(dirs['CACHE_DIR'])
+        self.addCleanup(shutil.rmtree, self.data_root)
+
+        # Never talk to Nominatim from tests; routes get a fresh catalog and geocoding cache
+        self.geocoder = FakeGeocoder()
+        self.gazetteer = Gazetteer()
+        chain = GeocoderChain([self.gazetteer, self.geocoder])
+        self.geocode_cache = GeocodeCache(os.path.join(dirs['CACHE_DIR'], 'geocoding.sqlite3'))
+        self.geocode_worker = GeocodeWorker(chain, self.geocode_cache)
+        patched = dict(
+            dirs,
+            catalog=Catalog(poll_interval=0),
+            gazetteer=self.gazetteer,
+            geocoder=chain,
+            geocode_cache=self.geocode_cache,
+            geocode_worker=self.geocode_worker,
+        )
+        for name, value in patched.items():
+            patcher = mock.patch.object(app_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def write_item(self, kind, item_id, data, description=None):
+        """Writes <kind dir>/<item_id>/<kind>.yaml (and description.md) into the data directory."""
+        item_path = os.path.join(self.data_root, self.KIND_DIRS[kind], item_id)
+        os.makedirs(item_path, exist_ok=True)
+        with open(os.path.join(item_path, f'{kind}.yaml'), 'w') as f:
+            yaml.safe_dump(data, f)
+        if description is not None:
+            with open(os.path.join(item_path, 'description.md'), 'w') as f:
+                f.write(description)
+        return item_path
+
+    def write_event(self, event_id, description='About the event.', **overrides):
+        data = {
+            'title': event_id.replace('-', ' ').title(),
+            'date': '2030-01-01',
+            'type': 'Conference',
+            'organizer': 'acme',
+            'language': 'en',
+            'tags': ['python'],
+            'url': f'https://example.com/{event_id}',
+            'location': {'city': 'Berlin', 'country': 'de', 'latitude': 52.5, 'longitude': 13.4},
+        }
+        data.update(overrides)
+        return self.write_item('event', event_id, data, description=description)
+
 
 class TestDataLoading(unittest.TestCase):
     def test_load_events(self):
@@ -12,5 +128,1145 @@ class TestDataLoading(unittest.TestCase):
             self.assertIn('title', events[0])
             self.assertIn('location', events[0])
 
+
+class TestCatalog(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'}, description='We run events.')
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon', date='2030-05-01')
+        self.write_event('djangocon', date='2030-02-01')
+
+    def test_matches_load_events(self):
+        catalog = Catalog(poll_interval=0)
+        self.assertEqual(catalog.refresh().events, load_events())
+        self.assertEqual([e['id'] for e in catalog.events], ['djangocon', 'pycon'])
+
+    def test_rebuilds_only_on_change(self):
+        catalog = Catalog(poll_interval=0)
+        catalog.refresh()
+        self.assertEqual(catalog.generation, 1)
+        catalog.refresh()
+        self.assertEqual(catalog.generation, 1)
+
+        self.write_event('pycon', date='2030-05-01', title='PyCon Renamed')
+        catalog.refresh()
+        self.assertEqual(catalog.generation, 2)
+        self.assertIn('PyCon Renamed', [e['title'] for e in catalog.events])
+
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'djangocon'))
+        catalog.refresh()
+        self.assertEqual(catalog.generation, 3)
+        self.assertEqual([e['id'] for e in catalog.events], ['pycon'])
+
+    def test_poll_interval_defers_checks(self):
+        catalog = Catalog(poll_interval=3600)
+        catalog.refresh()
+        self.write_event('vuejs-amsterdam')
+        self.assertEqual(len(catalog.refresh().events), 2)
+        self.assertEqual(len(catalog.refresh(force=True).events), 3)
+
+
+class TestGunicornMaster(DataDirTestCase):
+    def test_preloading_does_not_start_geocoding(self):
+        self.write_event('meetup', location={'city': 'Lyon', 'country': 'fr'})
+        spec = importlib.util.spec_from_file_location('gunicorn_conf', os.path.join(os.path.dirname(__file__), 'gunicorn.conf.py'))
+        conf = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(conf)
+
+        with mock.patch.object(app_module, 'catalog', Catalog(poll_interval=0)), mock.patch.object(gc, 'freeze'):
+            conf.when_ready(mock.Mock())
+            self.assertEqual([e['id'] for e in app_module.catalog.events], ['meetup'])
+        self.assertEqual(self.geocode_worker.stats()['queued'], 0)
+        self.assertEqual(self.geocode_worker._workers, [])
+        self.assertTrue(app_module.GEOCODE_ON_LINK)
+
+
+class TestSharedCatalog(DataDirTestCase):
+    """Two catalogs on one data directory stand in for two preforked workers."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon', date='2030-05-01')
+        version_path = os.path.join(self.data_root, '.cache', 'catalog.version')
+        self.workers = [Catalog(poll_interval=60, shared_version=SharedVersion(version_path)) for _ in range(2)]
+        for worker in self.workers:
+            worker.refresh()
+            worker._checked_at = 0.0
+
+    def test_only_one_worker_scans_while_the_version_is_fresh(self):
+        first, second = self.workers
+        with mock.patch.object(app_module, 'scan_data_files', wraps=app_module.scan_data_files) as scan:
+            first.refresh()
+            second.refresh()
+        self.assertEqual(scan.call_count, 0)
+
+    def test_change_seen_by_one_worker_reaches_the_others(self):
+        first, second = self.workers
+        self.write_event('djangocon', date='2030-02-01')
+        first.refresh(force=True)
+        self.assertEqual(first.generation, 2)
+
+        second.refresh()
+        self.assertEqual(second.generation, 2)
+        self.assertEqual([e['id'] for e in second.events], ['djangocon', 'pycon'])
+
+    def test_stale_version_is_rescanned_by_one_worker(self):
+        first, second = self.workers
+        os.utime(first.shared_version.path, (0, 0))
+        self.write_event('djangocon', date='2030-02-01')
+        first.refresh()
+        self.assertEqual(first.generation, 2)
+        second.refresh()
+        self.assertEqual(second.generation, 2)
+
+
+    def test_workers_share_revision_numbers(self):
+        first, second = self.workers
+        self.assertEqual(first.revision, 1)
+        self.assertEqual(second.revision, 1)
+        self.write_event('djangocon', date='2030-02-01')
+        first.refresh(force=True)
+        second.refresh()
+        self.assertEqual((first.revision, second.revision), (2, 2))
+        self.assertEqual([e['id'] for e in second.changes(1)[1]], ['djangocon'])
+
+        # A restarted worker continues the count and answers from the shared change log
+        restarted = Catalog(poll_interval=60, shared_version=SharedVersion(first.shared_version.path))
+        self.assertEqual(restarted.refresh().revision, 2)
+        self.assertEqual([e['id'] for e in restarted.changes(1)[1]], ['djangocon'])
+
+    def test_client_ahead_of_a_worker_is_not_sent_to_resync(self):
+        first, second = self.workers
+        # The second worker is inside its poll interval while the first one publishes a change
+        second._checked_at = time.monotonic()
+        self.write_event('djangocon', date='2030-02-01')
+        first.refresh(force=True)
+        self.assertEqual((first.revision, second.refresh().revision), (2, 1))
+
+        self.assertEqual(second.changes(2), (1, [], [], []))
+        self.assertIsNone(second.changes(3))
+        self.assertEqual(second.catch_up(2).changes(2), (2, [], [], []))
+        self.assertEqual([e['id'] for e in second.changes(1)[1]], ['djangocon'])
+
+    def test_worker_skipping_revisions_answers_from_the_shared_log(self):
+        first, second = self.workers
+        self.write_event('djangocon', date='2030-02-01')
+        first.refresh(force=True)
+        self.write_event('pycon', date='2030-05-02')
+        first.refresh(force=True)
+        self.assertEqual(first.revision, 3)
+
+        second.refresh()
+        self.assertEqual(second.revision, 3)
+        revision, added, updated, removed = second.changes(2)
+        self.assertEqual((revision, added, [e['id'] for e in updated], removed), (3, [], ['pycon'], []))
+        self.assertEqual([e['id'] for e in second.changes(1)[1]], ['djangocon'])
+
+
+class TestParallelParsing(DataDirTestCase):
+    def test_pool_matches_inline_parsing(self):
+        self.write_item('organizer', 'acme', {'name': 'ACME'})
+        for i in range(6):
+            self.write_event(f'event-{i}', date=f'2030-01-0{i + 1}')
+        broken = os.path.join(self.data_root, 'events', 'broken')
+        os.makedirs(broken)
+        with open(os.path.join(broken, 'event.yaml'), 'w') as f:
+            f.write('title: [unclosed\n')
+
+        with mock.patch('builtins.print') as printed:
+            inline = load_events()
+        app_module._item_records.clear()
+        app_module._linked_events = {}
+        with mock.patch.object(app_module, 'PARSE_POOL_MIN', 1), mock.patch.object(app_module, 'PARSE_WORKERS', 2), \
+                mock.patch('builtins.print') as printed_pool:
+            pooled = load_events()
+
+        self.assertEqual(pooled, inline)
+        self.assertEqual([e['id'] for e in pooled], [f'event-{i}' for i in range(6)])
+        self.assertEqual(printed_pool.call_args_list, printed.call_args_list)
+        self.assertTrue(printed.call_args[0][0].startswith(f"Error parsing {os.path.join(broken, 'event.yaml')}"))
+
+
+class TestSnapshot(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'}, description='We run events.')
+        self.write_item('country', 'fr', {'name': 'France'})
+        self.write_event('pycon', date='2030-05-01')
+        self.write_event('meetup', date='2030-02-01', location={'city': 'Lyon', 'country': 'fr'})
+        self.geocode_cache.put(', Lyon, France', {'latitude': 45.76, 'longitude': 4.84})
+        self.snapshot_file = app_module.SNAPSHOT_FILE
+
+    def compile(self):
+        with mock.patch('builtins.print'):
+            snapshot.main(['--output', self.snapshot_file])
+
+    def test_startup_loads_matching_snapshot(self):
+        self.compile()
+        expected = load_events()
+        fresh_cache = GeocodeCache(os.path.join(self.data_root, 'other.sqlite3'))
+
+        with mock.patch.object(app_module, '_item_records', {}), mock.patch.object(app_module, '_linked_events', {}), \
+                mock.patch.object(app_module, 'geocode_cache', fresh_cache), \
+                mock.patch.object(app_module, 'parse_yaml', wraps=app_module.parse_yaml) as parse_yaml:
+            with mock.patch('indexes.tokenize', wraps=indexes.tokenize) as tokenize, \
+                    mock.patch('payloads.excerpt', wraps=payloads.excerpt) as excerpt:
+                catalog = Catalog(poll_interval=0).refresh()
+            self.assertEqual(parse_yaml.call_count, 0)
+            # Search terms and excerpts come from the snapshot as well
+            self.assertEqual((tokenize.call_count, excerpt.call_count), (0, 0))
+            self.assertEqual(catalog.summary(catalog.by_id['pycon'])['excerpt'], 'About the event.')
+            self.assertEqual(catalog.events, expected)
+            self.assertEqual(catalog.index.query(search='pycon')['total'], 1)
+            self.assertEqual(fresh_cache.get(', Lyon, France'), {'latitude': 45.76, 'longitude': 4.84})
+
+            # Later refreshes stay incremental on top of the snapshot
+            self.write_event('pycon', date='2030-05-02')
+            self.assertIn('2030-05-02', [e['date'] for e in catalog.refresh().events])
+            self.assertEqual(parse_yaml.call_count, 1)
+
+    def test_stale_or_foreign_snapshot_is_ignored(self):
+        self.compile()
+        self.write_event('pycon', date='2030-05-02')
+        with mock.patch.object(app_module, '_item_records', {}), mock.patch.object(app_module, '_linked_events', {}), \
+                mock.patch.object(app_module, 'parse_yaml', wraps=app_module.parse_yaml) as parse_yaml:
+            catalog = Catalog(poll_interval=0).refresh()
+            self.assertEqual(parse_yaml.call_count, 4)
+            self.assertIn('2030-05-02', [e['date'] for e in catalog.events])
+
+        with open(self.snapshot_file, 'wb') as f:
+            f.write(b'OTSNAP\x00\x00garbage')
+        with mock.patch('builtins.print') as printed:
+            self.assertIsNone(snapshot.read_snapshot(self.snapshot_file))
+            printed.assert_called_once()
+
+        # Only plain data is loaded: a pickle behind a valid header is rejected, not unpickled
+        with open(self.snapshot_file, 'wb') as f:
+            f.write(snapshot.HEADER + pickle.dumps({'signatures': {}}))
+        with mock.patch('builtins.print') as printed, mock.patch('pickle.loads') as loads:
+            self.assertIsNone(snapshot.read_snapshot(self.snapshot_file))
+            printed.assert_called_once()
+            loads.assert_not_called()
+
+    def test_compiling_does_not_geocode_online(self):
+        self.write_event('workshop', location={'city': 'Atlantis', 'country': 'fr'})
+        with mock.patch.object(self.geocode_worker, 'submit') as submit:
+            self.compile()
+        submit.assert_not_called()
+        self.assertTrue(app_module.GEOCODE_ON_LINK)
+
+    def test_snapshot_from_other_code_is_ignored(self):
+        self.compile()
+        with mock.patch.object(snapshot, 'HEADER', snapshot.MAGIC + snapshot.VERSION.to_bytes(2, 'big') + bytes(16)), \
+                mock.patch('builtins.print') as printed:
+            self.assertIsNone(snapshot.read_snapshot(self.snapshot_file))
+        self.assertIn("another version", printed.call_args[0][0])
+
+    def test_dates_survive_the_snapshot(self):
+        state = {'item_records': {'events': {'pycon': ((('event.yaml', 1, 2),), {'date': date(2030, 5, 1), 'tags': ['python']})}}}
+        snapshot.write_snapshot(self.snapshot_file, state)
+        self.assertEqual(snapshot.read_snapshot(self.snapshot_file), state)
+
+
+class TestStaticExport(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('country', 'de', {'name': 'Germany'})
+        org_path = self.write_item('organizer', 'acme', {'name': 'ACME'})
+        with open(os.path.join(org_path, 'image.png'), 'wb') as f:
+            f.write(b'png')
+        self.write_event('pycon', date='2030-05-01')
+        self.write_event('djangocon', date='2030-02-01', location={'city': 'Berlin', 'country': 'de'})
+        self.output = os.path.join(self.data_root, 'site')
+
+    def read(self, path):
+        with open(os.path.join(self.output, path), 'rb') as f:
+            return f.read()
+
+    def test_exports_every_feed(self):
+        with mock.patch.object(self.geocode_worker, 'submit') as submit:
+            export.export(self.output)
+        # Without --geocode nothing is looked up online
+        submit.assert_not_called()
+        page = self.read('index.html')
+        self.assertIn(b'"static": true', page)
+        # Links point at the exported files, relative to the page
+        self.assertIn(b'href="events.ics" data-webcal', page)
+        self.assertIn(b'href="api/events.json"', page)
+        self.assertNotIn(b'href="/api/events"', page)
+        # So are the assets, so the site also works below a sub-path
+        self.assertIn(b'href="static/css/base.css"', page)
+        self.assertIn(b'src="static/js/script.js"', page)
+        self.assertNotRegex(page, rb'(href|src)="/')
+        self.assertIn(b'"image_url": "organizer/acme/image.png"', page)
+        self.assertNotIn(b'"/organizer/', page)
+        # The pages served by the app keep their absolute links
+        self.assertIn(b'"/organizer/acme/image.png"', self.client.get('/').data)
+        self.assertEqual([e['id'] for e in json.loads(self.read('api/events.json'))], ['djangocon', 'pycon'])
+        self.assertIn('excerpt', json.loads(self.read('api/events.summary.json'))[0])
+        # Without --geocode only coordinates known offline are exported
+        self.assertEqual(set(json.loads(self.read('api/coordinates.json'))), {'pycon'})
+        self.assertEqual(len(Calendar.from_ical(self.read('events.ics')).walk('VEVENT')), 2)
+        self.assertEqual(len(Calendar.from_ical(self.read('event/pycon.ics')).walk('VEVENT')), 1)
+        self.assertEqual(self.read('organizer/acme/image.png'), b'png')
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'static', 'js', 'script.js')))
+
+    def test_reexport_only_rewrites_changed_files(self):
+        exporter = export.export(self.output)
+        self.assertEqual(exporter.written, len(exporter.files))
+        self.assertEqual(export.export(self.output).written, 0)
+
+        self.write_event('pycon', date='2030-05-01', title='PyCon Renamed')
+        with mock.patch.object(app_module.catalog.ics, 'event_calendar', wraps=app_module.catalog.ics.event_calendar) as event_calendar:
+            exporter = export.export(self.output)
+        self.assertEqual([c.args[0]['id'] for c in event_calendar.call_args_list], ['pycon'])
+        self.assertEqual(set(exporter.files) - set(exporter.previous), set())
+        self.assertIn(b'PyCon Renamed', self.read('event/pycon.ics'))
+        self.assertLess(exporter.written, 8)
+
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'djangocon'))
+        exporter = export.export(self.output)
+        self.assertEqual(exporter.removed, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'event', 'djangocon.ics')))
+
+
+class TestIncrementalLoading(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'})
+        self.write_item('organizer', 'pyladies', {'name': 'PyLadies'})
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon')
+        self.write_event('djangocon')
+        self.write_event('pyladies-meetup', organizer='pyladies')
+
+    def test_only_changed_directories_are_reparsed(self):
+        load_events()
+        with mock.patch.object(app_module, 'parse_yaml', wraps=app_module.parse_yaml) as parse_yaml:
+            load_events()
+            self.assertEqual(parse_yaml.call_count, 0)
+
+            self.write_event('pycon', title='PyCon 2030')
+            events = {e['id']: e for e in load_events()}
+            self.assertEqual(parse_yaml.call_count, 1)
+            self.assertEqual(events['pycon']['title'], 'PyCon 2030')
+
+    def test_only_referencing_events_are_relinked(self):
+        before = {e['id']: e for e in load_events()}
+        self.write_item('organizer', 'pyladies', {'name': 'PyLadies Berlin'})
+        after = {e['id']: e for e in load_events()}
+
+        self.assertIs(after['pycon'], before['pycon'])
+        self.assertIs(after['djangocon'], before['djangocon'])
+        self.assertIsNot(after['pyladies-meetup'], before['pyladies-meetup'])
+        self.assertEqual(after['pyladies-meetup']['organizer_details']['name'], 'PyLadies Berlin')
+
+    def test_deleted_directories_are_dropped(self):
+        load_events()
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'djangocon'))
+        shutil.rmtree(os.path.join(self.data_root, 'countries', 'de'))
+        events = load_events()
+        self.assertEqual(sorted(e['id'] for e in events), ['pycon', 'pyladies-meetup'])
+        self.assertNotIn('country_details', events[0]['location'])
+
+
+class TestGeocodeCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.db_path = os.path.join(self.cache_dir, 'geocoding.sqlite3')
+
+    def test_results_survive_restart(self):
+        cache = GeocodeCache(self.db_path)
+        cache.put('Berlin, Germany', {'latitude': 52.5, 'longitude': 13.4})
+        cache.put('Atlantis, Nowhere', None)
+        cache.flush()
+
+        reopened = GeocodeCache(self.db_path)
+        self.assertEqual(reopened.lookup('Berlin, Germany'), (True, {'latitude': 52.5, 'longitude': 13.4}))
+        self.assertEqual(reopened.lookup('Atlantis, Nowhere'), (True, None))
+        self.assertEqual(reopened.lookup('Paris, France'), (False, None))
+
+    def test_writes_are_batched(self):
+        cache = GeocodeCache(self.db_path, batch_size=3, flush_interval=3600)
+        cache.put('a', {'latitude': 1, 'longitude': 1})
+        cache.put('b', {'latitude': 2, 'longitude': 2})
+        self.assertEqual(len(GeocodeCache(self.db_path)), 0)
+        cache.put('c', {'latitude': 3, 'longitude': 3})
+        self.assertEqual(len(GeocodeCache(self.db_path)), 3)
+
+    def test_sync_writes_results_that_waited_too_long(self):
+        cache = GeocodeCache(self.db_path, batch_size=100, flush_interval=0.05)
+        cache.put('a', {'latitude': 1, 'longitude': 1})
+        cache.put('b', {'latitude': 2, 'longitude': 2})
+        cache.sync()
+        self.assertEqual(len(GeocodeCache(self.db_path)), 0)
+        time.sleep(0.06)
+        cache.sync()
+        self.assertEqual(len(GeocodeCache(self.db_path)), 2)
+
+    def test_negative_results_expire(self):
+        cache = GeocodeCache(self.db_path, negative_ttl=60)
+        cache.put('Atlantis, Nowhere', None)
+        self.assertEqual(cache.lookup('Atlantis, Nowhere'), (True, None))
+        with mock.patch('geocoding.time.time', return_value=time.time() + 120):
+            self.assertEqual(cache.lookup('Atlantis, Nowhere'), (False, None))
+
+    def test_migrates_legacy_json_once(self):
+        legacy_path = os.path.join(self.cache_dir, 'geocoding_cache.json')
+        with open(legacy_path, 'w') as f:
+            json.dump({'Berlin, Germany': {'latitude': 52.5, 'longitude': 13.4}}, f)
+
+        cache = GeocodeCache(self.db_path, legacy_json_path=legacy_path)
+        self.assertEqual(cache.get('Berlin, Germany'), {'latitude': 52.5, 'longitude': 13.4})
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertEqual(len(GeocodeCache(self.db_path, legacy_json_path=legacy_path)), 1)
+
+
+    def test_sync_picks_up_rows_of_other_processes(self):
+        reader = GeocodeCache(self.db_path)
+        self.assertEqual(reader.lookup('Berlin, Germany'), (False, None))
+        revision = reader.revision
+
+        pid = os.fork()
+        if pid == 0:
+            writer = GeocodeCache(self.db_path)
+            writer.put('Berlin, Germany', {'latitude': 52.5, 'longitude': 13.4})
+            writer.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(reader.sync(), 1)
+        self.assertEqual(reader.lookup('Berlin, Germany'), (True, {'latitude': 52.5, 'longitude': 13.4}))
+        self.assertGreater(reader.revision, revision)
+        self.assertEqual(reader.sync(), 0)
+
+    def test_forked_child_keeps_its_own_connection(self):
+        cache = GeocodeCache(self.db_path)
+        cache.put('Berlin, Germany', {'latitude': 52.5, 'longitude': 13.4})
+        cache.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            cache.put('Paris, France', {'latitude': 48.9, 'longitude': 2.4})
+            cache.flush()
+            os._exit(0 if cache._conn is not None and cache._inherited[0] is not cache._conn else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+        # The parent's connection still works after the child exited
+        cache.put('Rome, Italy', {'latitude': 41.9, 'longitude': 12.5})
+        cache.flush()
+        cache.sync()
+        self.assertEqual(len(GeocodeCache(self.db_path)), 3)
+        self.assertEqual(cache.lookup('Paris, France'), (True, {'latitude': 48.9, 'longitude': 2.4}))
+
+
+class TestGeocodeWorker(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.cache = GeocodeCache(os.path.join(cache_dir, 'geocoding.sqlite3'))
+        self.limiter = TokenBucket(rate=1000, capacity=1000)
+
+    def test_duplicate_queries_are_resolved_once(self):
+        gate = threading.Event()
+        geocoder = FakeGeocoder({'Berlin, Germany': (52.5, 13.4)}, gate=gate)
+        worker = GeocodeWorker(geocoder, self.cache, self.limiter)
+
+        first = worker.submit('Main St, Berlin, Germany', ['Main St, Berlin, Germany', 'Berlin, Germany'])
+        second = worker.submit('Main St, Berlin, Germany', ['Main St, Berlin, Germany', 'Berlin, Germany'])
+        self.assertIs(first, second)
+        gate.set()
+
+        self.assertEqual(first.result(5), {'latitude': 52.5, 'longitude': 13.4})
+        self.assertEqual(geocoder.queries, ['Main St, Berlin, Germany', 'Berlin, Germany'])
+        self.assertEqual(self.cache.get('Main St, Berlin, Germany'), {'latitude': 52.5, 'longitude': 13.4})
+
+    def test_results_are_written_when_the_queue_runs_empty(self):
+        cache = GeocodeCache(self.cache.path, batch_size=100, flush_interval=3600)
+        worker = GeocodeWorker(FakeGeocoder({'Berlin, Germany': (52.5, 13.4)}), cache, self.limiter)
+        with mock.patch('builtins.print'):
+            futures = [worker.submit(query, [query]) for query in ('Berlin, Germany', 'Nowhere')]
+            for future in futures:
+                future.result(5)
+            deadline = time.monotonic() + 5
+            while len(GeocodeCache(self.cache.path)) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(GeocodeCache(self.cache.path).lookup('Berlin, Germany'), (True, {'latitude': 52.5, 'longitude': 13.4}))
+        self.assertEqual(GeocodeCache(self.cache.path).lookup('Nowhere'), (True, None))
+
+    def test_stats_report_queue_and_in_flight(self):
+        gate = threading.Event()
+        worker = GeocodeWorker(FakeGeocoder(gate=gate), self.cache, self.limiter)
+        first = worker.submit('a', ['a'])
+        worker.submit('b', ['b'])
+        for _ in range(100):
+            if worker.stats()['in_flight']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(worker.stats()['queued'], 1)
+        self.assertEqual(worker.stats()['in_flight'], ['a'])
+
+        gate.set()
+        self.assertIsNone(first.result(5))
+        self.assertEqual(self.cache.lookup('a'), (True, None))
+
+    def test_errors_are_retried_after_a_short_backoff(self):
+        geocoder = FakeGeocoder()
+        geocoder.geocode = mock.Mock(side_effect=OSError("unreachable"))
+        worker = GeocodeWorker(geocoder, self.cache, self.limiter, threads=0, error_ttl=60)
+        with mock.patch('builtins.print'):
+            self.assertIsNone(worker.resolve('Lyon, France', ['Lyon, France']))
+        # Not looked up again while the backoff lasts, but long before a definite miss would be
+        self.assertEqual(self.cache.lookup('Lyon, France'), (True, None))
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            self.assertEqual(self.cache.lookup('Lyon, France'), (False, None))
+
+    def test_resolve_runs_queued_query_immediately(self):
+        worker = GeocodeWorker(FakeGeocoder({'Paris, France': (48.9, 2.3)}), self.cache, self.limiter, threads=0)
+        worker.submit('Paris, France', ['Paris, France'])
+        self.assertEqual(worker.resolve('Paris, France', ['Paris, France']), {'latitude': 48.9, 'longitude': 2.3})
+        self.assertEqual(worker.stats()['queued'], 0)
+
+    def test_token_bucket_spaces_out_calls(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=1, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(now[0], 2.0)
+        self.assertEqual(sleeps, [1.0, 1.0])
+
+
+    def test_file_rate_limiter_is_shared_through_the_file(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        path = os.path.join(cache_dir, 'ratelimit')
+        limiters = [FileRateLimiter(path, rate=2, clock=lambda: now[0], sleep=sleep) for _ in range(2)]
+        for limiter in limiters + limiters:
+            limiter.acquire()
+        self.assertEqual(now[0], 1.5)
+        self.assertEqual(sleeps, [0.5, 0.5, 0.5])
+
+
+class TestCoordinatesApi(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon')
+        self.write_event('berlin-meetup', location={'city': 'Berlin', 'country': 'de', 'address': 'Main St'})
+        self.write_event('atlantis-meetup', location={'city': 'Atlantis', 'country': 'xx'})
+        self.geocoder.places = {'Berlin, Germany': (52.52, 13.40)}
+
+    def test_waits_for_geocoding_by_default(self):
+        response = self.client.get('/api/coordinates')
+        self.assertEqual(response.get_json(), {
+            'pycon': {'latitude': 52.5, 'longitude': 13.4},
+            'berlin-meetup': {'latitude': 52.52, 'longitude': 13.40},
+        })
+
+    def test_returns_cached_coordinates_without_waiting(self):
+        self.geocode_worker.threads = 0
+        data = self.client.get('/api/coordinates?wait=false').get_json()
+        self.assertEqual(data['coordinates'], {'pycon': {'latitude': 52.5, 'longitude': 13.4}})
+        self.assertEqual(data['pending'], ['atlantis-meetup', 'berlin-meetup'])
+        self.assertEqual(self.geocoder.queries, [])
+
+    def test_streams_geocoded_locations(self):
+        response = self.client.get('/api/coordinates/stream')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines[0], {'id': 'pycon', 'latitude': 52.5, 'longitude': 13.4})
+        self.assertEqual(lines[1], {'id': 'berlin-meetup', 'latitude': 52.52, 'longitude': 13.40})
+        self.assertEqual(lines[-1], {'done': True, 'unresolved': ['atlantis-meetup']})
+
+
+class TestGazetteer(DataDirTestCase):
+    def test_bundled_table(self):
+        gazetteer = Gazetteer()
+        gazetteer.load_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv'))
+        self.assertEqual(gazetteer.geocode('Alexanderplatz 1, Berlin, Germany').precision, 'city')
+        self.assertEqual(gazetteer.geocode('Sao Paulo, br').precision, 'city')
+        self.assertEqual(gazetteer.geocode('Smalltown, Germany').precision, 'country')
+        self.assertIsNone(gazetteer.geocode('Smalltown, Atlantis'))
+
+    def test_city_matches_are_resolved_offline(self):
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.gazetteer.add_city('Berlin', 'de', 52.52, 13.405)
+        self.write_event('berlin-meetup', location={'city': 'Berlin', 'country': 'de'})
+
+        response = self.client.get('/api/coordinates?wait=false')
+        self.assertEqual(response.get_json(), {
+            'coordinates': {'berlin-meetup': {'latitude': 52.52, 'longitude': 13.405}},
+            'pending': [],
+        })
+        self.assertEqual(self.geocoder.queries, [])
+
+    def test_country_centroids_are_refined_online(self):
+        self.write_item('country', 'de', {'name': 'Germany', 'latitude': 51.0, 'longitude': 10.0})
+        self.write_event('potsdam-meetup', location={'city': 'Potsdam', 'country': 'de'})
+        self.geocode_worker.threads = 0
+
+        data = self.client.get('/api/coordinates?wait=false').get_json()
+        self.assertEqual(data['coordinates'], {'potsdam-meetup': {'latitude': 51.0, 'longitude': 10.0}})
+        self.assertEqual(data['pending'], ['potsdam-meetup'])
+
+        self.geocoder.places = {'Potsdam, Germany': (52.4, 13.06)}
+        self.assertEqual(self.client.get('/api/coordinates').get_json(),
+                         {'potsdam-meetup': {'latitude': 52.4, 'longitude': 13.06}})
+
+
+class TestEventQueryApi(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('country', 'de', {'name': 'Germany', 'icon': 'DE'})
+        self.write_event('pycon-2020', date='2020-04-01', tags=['python'])
+        self.write_event('pycon-2030', date='2030-04-01', tags=['python'], price='free')
+        self.write_event('jsconf-2030', date='2030-05-01', tags=['javascript'], online=True,
+                         location={'city': 'Paris', 'country': 'fr', 'latitude': 48.9, 'longitude': 2.3})
+        self.write_event('djangocon-2031', date='2031-01-01', tags=['python', 'django'], type='Meetup')
+
+    def query(self, params):
+        response = self.client.get('/api/events?' + params)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def ids(self, params):
+        return [e['id'] for e in self.query(params)['events']]
+
+    def test_without_parameters_returns_plain_list(self):
+        self.assertEqual(len(self.client.get('/api/events').get_json()), 4)
+        # Parameters the API does not know, like cache-busters, do not change the shape
+        self.assertEqual(len(self.client.get('/api/events?_=1&utm_source=feed').get_json()), 4)
+        self.assertIsInstance(self.client.get('/api/events?_=1&view=summary').get_json(), list)
+
+    def test_filters(self):
+        self.assertEqual(self.ids('country=de&tags=python'), ['pycon-2020', 'pycon-2030', 'djangocon-2031'])
+        self.assertEqual(self.ids('tags=django,javascript'), ['jsconf-2030', 'djangocon-2031'])
+        self.assertEqual(self.ids('type=Meetup'), ['djangocon-2031'])
+        self.assertEqual(self.ids('free=true'), ['pycon-2030'])
+        self.assertEqual(self.ids('online=true'), ['jsconf-2030'])
+        self.assertEqual(self.ids('time=past'), ['pycon-2020'])
+        self.assertEqual(self.ids('from=2030-01-01&to=2030-04-30'), ['pycon-2030'])
+        self.assertEqual(self.ids('search=paris'), ['jsconf-2030'])
+
+    def test_cursor_pagination(self):
+        first = self.query('time=future&sort=-date&limit=2')
+        self.assertEqual([e['id'] for e in first['events']], ['djangocon-2031', 'jsconf-2030'])
+        self.assertEqual(first['total'], 3)
+
+        second = self.query(f"time=future&sort=-date&limit=2&cursor={first['next_cursor']}")
+        self.assertEqual([e['id'] for e in second['events']], ['pycon-2030'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_facet_counts_ignore_their_own_filter(self):
+        facets = self.query('country=de&facets=country,tags&limit=0')['facets']
+        self.assertEqual(facets['country'], [
+            {'value': 'de', 'count': 3, 'label': 'Germany', 'icon': 'DE'},
+            {'value': 'fr', 'count': 1, 'label': None, 'icon': None},
+        ])
+        self.assertEqual(facets['tags'], [
+            {'value': 'python', 'count': 3},
+            {'value': 'django', 'count': 1},
+        ])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/events?sort=price').status_code, 400)
+        self.assertEqual(self.client.get('/api/events?cursor=nonsense').status_code, 400)
+        self.assertEqual(self.client.get('/api/events?from=tomorrow').status_code, 400)
+
+
+class TestSearch(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME Events'})
+        self.write_item('country', 'ch', {'name': 'Switzerland'})
+        self.write_event('pycon', title='PyCon', tags=['python'], description='Talks about Django and Flask.')
+        self.write_event('djangocon', title='DjangoCon', tags=['django'])
+        self.write_event('swiss-meetup', title='Swiss Meetup', tags=['community'], location={'city': 'Zürich', 'country': 'ch'},
+                         description='An evening of Python talks.')
+
+    def search(self, query):
+        return [r['id'] for r in self.client.get(f'/api/search?q={query}').get_json()['results']]
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self.search('django'), ['djangocon', 'pycon'])
+        self.assertEqual(self.search('python'), ['pycon', 'swiss-meetup'])
+
+    def test_matches_prefixes_accents_and_reference_names(self):
+        self.assertEqual(self.search('djan'), ['djangocon', 'pycon'])
+        self.assertEqual(self.search('zurich'), ['swiss-meetup'])
+        self.assertEqual(self.search('switzerland python'), ['swiss-meetup'])
+        self.assertEqual(self.search('acme'), ['djangocon', 'pycon', 'swiss-meetup'])
+        self.assertEqual(self.search('rust'), [])
+
+    def test_rejects_invalid_limits(self):
+        self.assertEqual(self.client.get('/api/search?q=python&limit=1').get_json()['results'][0]['id'], 'pycon')
+        self.assertEqual(self.client.get('/api/search?q=python&limit=-1').status_code, 400)
+        self.assertEqual(self.client.get('/api/search?q=python&limit=many').status_code, 400)
+
+    def test_reindexes_only_changed_events(self):
+        index = SearchIndex()
+        events = load_events()
+        self.assertEqual(index.update(events), 3)
+        self.assertEqual(index.update(load_events()), 0)
+
+        self.write_event('djangocon', title='DjangoCon Europe', tags=['django'])
+        self.assertEqual(index.update(load_events()), 1)
+        self.assertEqual([event_id for event_id, _ in index.search('europe')], ['djangocon'])
+
+
+class TestEventProjection(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'}, description='A long organizer bio.')
+        self.write_event('pycon', date='2030-05-01', description='## About\n\nThe **largest** [Python](https://python.org) event. ' + 'More text. ' * 50)
+        self.write_event('jsconf', date='2030-06-01', description='Short.', tags=['javascript'])
+
+    def test_summary_view(self):
+        events = self.client.get('/api/events?view=summary').get_json()
+        self.assertEqual([e['id'] for e in events], ['pycon', 'jsconf'])
+        pycon = events[0]
+        self.assertNotIn('description', pycon)
+        self.assertNotIn('description', pycon['organizer_details'])
+        self.assertEqual(pycon['organizer_details']['name'], 'ACME')
+        self.assertTrue(pycon['excerpt'].startswith('About The largest Python event. More text.'))
+        self.assertTrue(pycon['excerpt'].endswith('…'))
+        self.assertLessEqual(len(pycon['excerpt']), 281)
+        self.assertEqual(events[1]['excerpt'], 'Short.')
+
+        filtered = self.client.get('/api/events?view=summary&tags=javascript').get_json()
+        self.assertEqual([e['excerpt'] for e in filtered['events']], ['Short.'])
+
+    def test_fields(self):
+        events = self.client.get('/api/events?fields=title,date,excerpt').get_json()
+        self.assertEqual(events[1], {'id': 'jsconf', 'title': 'Jsconf', 'date': '2030-06-01', 'excerpt': 'Short.'})
+        self.assertEqual(self.client.get('/api/events?view=compact').status_code, 400)
+
+    def test_excerpts_are_computed_once_per_event_version(self):
+        with mock.patch.object(app_module, 'summarize', wraps=app_module.summarize) as summarize:
+            self.client.get('/api/events?view=summary')
+            self.client.get('/api/events?view=summary&limit=1')
+            self.assertEqual(summarize.call_count, 2)
+
+            self.write_event('jsconf', date='2030-06-01', description='Changed.')
+            events = self.client.get('/api/events?view=summary').get_json()
+            self.assertEqual(summarize.call_count, 3)
+            self.assertEqual(events[1]['excerpt'], 'Changed.')
+
+
+class TestEventChanges(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'})
+        self.write_item('organizer', 'pyorg', {'name': 'Python Org'})
+        self.write_event('pycon', date='2030-05-01', organizer='pyorg')
+        self.write_event('djangocon', date='2030-02-01')
+        self.write_event('vuejs-amsterdam', date='2030-03-01')
+
+    def test_reports_changes_since_a_revision(self):
+        response = self.client.get('/api/events')
+        since = int(response.headers['X-Catalog-Revision'])
+
+        self.write_event('vuejs-amsterdam', date='2030-03-02')
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'djangocon'))
+        self.write_event('jsconf', date='2030-06-01')
+        # Events linked to a changed organizer change as well
+        self.write_item('organizer', 'pyorg', {'name': 'Python Software Foundation'})
+
+        data = self.client.get(f'/api/events/changes?since={since}').get_json()
+        self.assertEqual(data['revision'], since + 1)
+        self.assertEqual([e['id'] for e in data['added']], ['jsconf'])
+        self.assertEqual(sorted(e['id'] for e in data['updated']), ['pycon', 'vuejs-amsterdam'])
+        self.assertEqual(data['removed'], ['djangocon'])
+        self.assertIn('description', data['added'][0])
+
+        summary = self.client.get(f'/api/events/changes?since={since}&view=summary').get_json()
+        self.assertNotIn('description', summary['added'][0])
+        latest = self.client.get(f"/api/events/changes?since={data['revision']}").get_json()
+        self.assertEqual((latest['added'], latest['updated'], latest['removed']), ([], [], []))
+
+    def test_changes_are_merged_over_several_revisions(self):
+        catalog = app_module.catalog.refresh()
+        since = catalog.revision
+        self.write_event('jsconf', date='2030-06-01')
+        self.write_event('pycon', date='2030-05-02', organizer='pyorg')
+        catalog.refresh()
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'jsconf'))
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'pycon'))
+        catalog.refresh()
+
+        revision, added, updated, removed = catalog.changes(since)
+        self.assertEqual(revision, since + 2)
+        # jsconf came and went in between; pycon was updated and then removed
+        self.assertEqual((added, updated, removed), ([], [], ['pycon']))
+
+    def test_clients_too_far_behind_must_resync(self):
+        with mock.patch.object(app_module, 'CHANGES_HISTORY', 2):
+            catalog = Catalog(poll_interval=0)
+        catalog.refresh()
+        for day in range(2, 5):
+            self.write_event('pycon', date=f'2030-05-0{day}', organizer='pyorg')
+            catalog.refresh()
+        self.assertEqual(catalog.revision, 4)
+        self.assertIsNone(catalog.changes(1))
+        self.assertEqual([e['id'] for e in catalog.changes(2)[2]], ['pycon'])
+
+        response = self.client.get('/api/events/changes?since=0')
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.get_json()['error'], "full resync required")
+        self.assertEqual(self.client.get('/api/events/changes?since=latest').status_code, 400)
+
+
+class TestIndexPage(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'})
+        self.write_item('country', 'de', {'name': 'Germany', 'icon': '🇩🇪'})
+        self.write_item('country', 'fr', {'name': 'France'})
+        self.write_event('pycon', date='2030-05-01', title='PyCon </script>')
+        self.write_event('paris-web', date='2030-06-01', location={'city': 'Paris', 'country': 'fr'})
+
+    def bootstrap(self, response):
+        html = response.get_data(as_text=True)
+        start = html.index('<script type="application/json" id="bootstrap-data">') + len('<script type="application/json" id="bootstrap-data">')
+        return json.loads(html[start:html.index('</script>', start)])
+
+    def test_embeds_summaries_and_filter_options(self):
+        data = self.bootstrap(self.client.get('/'))
+        self.assertEqual([e['id'] for e in data['events']], ['pycon', 'paris-web'])
+        self.assertEqual(data['events'][0]['title'], 'PyCon </script>')
+        self.assertNotIn('description', data['events'][0])
+        self.assertEqual(data['filters']['country'], [
+            {'value': 'fr', 'label': 'France', 'icon': None},
+            {'value': 'de', 'label': 'Germany', 'icon': '🇩🇪'},
+        ])
+        self.assertEqual(data['filters']['city'], [
+            {'value': 'Berlin', 'countries': ['de']},
+            {'value': 'Paris', 'countries': ['fr']},
+        ])
+        self.assertEqual(data['filters']['organizer'], [{'value': 'acme', 'label': 'ACME', 'icon': None}])
+
+    def test_cached_page_does_not_depend_on_the_host(self):
+        self.client.get('/', headers={'Host': 'evil.example'})
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('evil.example', html)
+        self.assertIn('href="/events.ics" data-webcal', html)
+
+    def test_page_is_rendered_once_per_generation(self):
+        with mock.patch.object(app_module, 'render_template', wraps=app_module.render_template) as render:
+            first = self.client.get('/')
+            second = self.client.get('/', headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(render.call_count, 1)
+
+            self.write_event('jsconf', date='2030-07-01')
+            self.assertEqual(len(self.bootstrap(self.client.get('/'))['events']), 3)
+            self.assertEqual(render.call_count, 2)
+
+
+class TestNormalizedFormat(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('organizer', 'acme', {'name': 'ACME'}, description='A long organizer bio.')
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_item('currency', 'eur', {'name': 'Euro', 'symbol': '€'})
+        self.write_event('pycon', date='2030-05-01', price={'amount': 100, 'currency': 'EUR'})
+        self.write_event('djangocon', date='2030-06-01')
+
+    def test_records_are_sent_once(self):
+        flat = self.client.get('/api/events').get_json()
+        data = self.client.get('/api/events?format=normalized').get_json()
+
+        self.assertEqual(list(data['records']['organizers']), ['acme'])
+        self.assertEqual(data['records']['organizers']['acme']['description'], 'A long organizer bio.')
+        self.assertEqual(data['records']['currencies']['eur']['symbol'], '€')
+        pycon = data['events'][0]
+        self.assertEqual(pycon['references'], {'organizer': 'acme', 'country': 'de', 'currency': 'eur'})
+        self.assertNotIn('organizer_details', pycon)
+        self.assertNotIn('country_details', pycon['location'])
+        self.assertEqual(pycon['price'], {'amount': 100, 'currency': 'EUR'})
+
+        # The flat format is unchanged
+        self.assertEqual(flat[0]['organizer_details']['name'], 'ACME')
+        self.assertEqual(flat[0]['location']['country_details']['name'], 'Germany')
+
+    def test_combines_with_filters_and_views(self):
+        data = self.client.get('/api/events?format=normalized&view=summary&limit=1').get_json()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([e['id'] for e in data['events']], ['pycon'])
+        self.assertNotIn('description', data['records']['organizers']['acme'])
+        self.assertEqual(self.client.get('/api/events?format=xml').status_code, 400)
+
+
+class TestEventDetailApi(DataDirTestCase):
+    def test_event_by_id(self):
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon', date='2030-05-01')
+        data = self.client.get('/api/events/pycon').get_json()
+        self.assertEqual(data['id'], 'pycon')
+        self.assertEqual(data['location']['country_details']['name'], 'Germany')
+        self.assertEqual(self.client.get('/api/events/missing').status_code, 404)
+
+        shutil.rmtree(os.path.join(self.data_root, 'events', 'pycon'))
+        self.assertEqual(self.client.get('/api/events/pycon').status_code, 404)
+
+
+class TestConditionalResponses(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            self.write_event(f'event-{i}', date=f'2030-01-{i + 10}')
+
+    def test_not_modified_until_catalog_changes(self):
+        for url in ['/api/events', '/api/events?tags=python&limit=5', '/api/coordinates', '/events.ics']:
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.headers['ETag'].startswith('"'))
+
+            again = self.client.get(url, headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(again.status_code, 304, url)
+            self.assertEqual(again.data, b'')
+            # Coordinates also change with geocoding, which no date reflects
+            if url != '/api/coordinates':
+                since = self.client.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']})
+                self.assertEqual(since.status_code, 304, url)
+
+        etag = self.client.get('/api/events').headers['ETag']
+        self.write_event('event-0', date='2030-02-01')
+        changed = self.client.get('/api/events', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_precompressed_bodies(self):
+        plain = self.client.get('/api/events')
+        self.assertIsNone(plain.content_encoding)
+        compressed = self.client.get('/api/events', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(compressed.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertNotEqual(compressed.headers['ETag'], plain.headers['ETag'])
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+
+        with mock.patch.object(http_cache.gzip, 'compress', wraps=gzip.compress) as compress:
+            self.client.get('/api/events', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(compress.call_count, 0)
+
+    def test_compresses_only_requested_codings(self):
+        with mock.patch.object(http_cache.gzip, 'compress', wraps=gzip.compress) as compress:
+            self.client.get('/api/events')
+            self.client.get('/api/events', headers={'If-None-Match': '"other"'})
+            self.assertEqual(compress.call_count, 0)
+            before = app_module.metrics.snapshot()[0].get('compress', (0, 0.0))[0]
+            self.assertEqual(self.client.get('/api/events', headers={'Accept-Encoding': 'gzip'}).content_encoding, 'gzip')
+            self.client.get('/api/events', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(compress.call_count, 1)
+        self.assertEqual(app_module.metrics.snapshot()[0]['compress'][0], before + 1)
+
+    def test_response_cache_keeps_recent_entries(self):
+        self.client.get('/events.ics')
+        with mock.patch.object(http_cache.ResponseCache, 'max_entries', 4):
+            for page in range(10):
+                self.client.get(f'/api/events?limit=1&search=event-{page}')
+                # Recently used responses stay cached while the one-off queries are evicted
+                self.client.get('/events.ics')
+            self.assertEqual(len(app_module.catalog.responses), 4)
+        with mock.patch.object(http_cache.Representation, '__init__', side_effect=AssertionError("rebuilt")):
+            self.assertEqual(self.client.get('/events.ics').status_code, 200)
+
+    def test_response_cache_is_freed(self):
+        responses = weakref.ref(http_cache.ResponseCache())
+        gc.collect()
+        self.assertIsNone(responses())
+
+    def test_unknown_parameters_share_the_cache_entry(self):
+        self.client.get('/api/events?tags=python')
+        cached = len(app_module.catalog.responses)
+        self.client.get('/api/events?tags=python&_=1')
+        self.client.get('/api/events?utm_source=feed&tags=python')
+        self.assertEqual(len(app_module.catalog.responses), cached)
+
+    def test_coordinates_change_with_geocoding_cache(self):
+        self.write_event('meetup', location={'city': 'Lyon', 'country': 'fr'})
+        self.geocoder.places['Lyon, fr'] = (45.76, 4.84)
+        self.geocoder.gate = threading.Event()
+        first = self.client.get('/api/coordinates?wait=false')
+        self.assertEqual(first.get_json()['pending'], ['meetup'])
+
+        self.geocoder.gate.set()
+        deadline = time.monotonic() + 5
+        while self.geocode_cache.get(', Lyon, fr') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response = self.client.get('/api/coordinates?wait=false', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['coordinates']['meetup'], {'latitude': 45.76, 'longitude': 4.84})
+
+        # The data files did not change, so a date cannot tell the client its copy is outdated
+        self.assertNotIn('Last-Modified', first.headers)
+        response = self.client.get('/api/coordinates?wait=false', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestMapApi(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            self.write_event(f'berlin-{i}', date=f'2030-01-1{i}', location={'city': 'Berlin', 'country': 'de', 'latitude': 52.52 + i / 1000, 'longitude': 13.40})
+        self.write_event('paris', date='2030-02-01', tags=['javascript'], location={'city': 'Paris', 'country': 'fr', 'latitude': 48.86, 'longitude': 2.35})
+        self.write_event('tokyo', date='2030-03-01', location={'city': 'Tokyo', 'country': 'jp', 'latitude': 35.68, 'longitude': 139.69})
+
+    def test_clusters_and_points(self):
+        data = self.client.get('/api/map?bbox=-10,40,20,60&zoom=4').get_json()
+        self.assertEqual(len(data['clusters']), 1)
+        cluster = data['clusters'][0]
+        self.assertEqual(cluster['count'], 3)
+        self.assertEqual(cluster['ids'], ['berlin-0', 'berlin-1', 'berlin-2'])
+        self.assertAlmostEqual(cluster['latitude'], 52.521)
+        self.assertEqual([p['id'] for p in data['points']], ['paris'])
+
+        zoomed = self.client.get('/api/map?bbox=13,52,14,53&zoom=16').get_json()
+        self.assertEqual(zoomed['clusters'], [])
+        self.assertEqual(sorted(p['id'] for p in zoomed['points']), ['berlin-0', 'berlin-1', 'berlin-2'])
+
+    def test_filters(self):
+        data = self.client.get('/api/map?bbox=-180,-90,180,90&zoom=3&tags=javascript').get_json()
+        self.assertEqual((data['clusters'], [p['id'] for p in data['points']]), ([], ['paris']))
+        self.assertEqual(self.client.get('/api/map?bbox=1,2,3').status_code, 400)
+        for bbox in ('inf,0,10,10', '0,0,nan,10', '-inf,-90,inf,90'):
+            self.assertEqual(self.client.get(f'/api/map?bbox={bbox}&zoom=3').status_code, 400, bbox)
+
+    def test_antimeridian(self):
+        index = SpatialIndex([('fiji', -17.7, 178.0), ('samoa', -13.8, -171.8), ('berlin', 52.5, 13.4)])
+        data = index.query((170, -30, 190, 0), 3)
+        self.assertEqual(sorted(p['id'] for p in data['points']), ['fiji', 'samoa'])
+
+
+class TestMetrics(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_item('country', 'de', {'name': 'Germany'})
+        self.write_event('pycon', date='2030-05-01')
+
+    def growth(self, before):
+        """Returns how much each count of the app's metrics grew since `before`, a Metrics.snapshot()."""
+        after = app_module.metrics.snapshot()
+        phases, requests = ({key: a[key][0] - b.get(key, (0, 0.0))[0] for key in a} for b, a in zip(before[:2], after[:2]))
+        caches = {key: count - before[2].get(key, 0) for key, count in after[2].items()}
+        return phases, requests, caches
+
+    def test_records_phases_requests_and_cache_lookups(self):
+        before = app_module.metrics.snapshot()
+        self.client.get('/api/events')
+        self.client.get('/api/events')
+        self.client.get('/events.ics')
+        phases, requests, caches = self.growth(before)
+
+        for phase in ('scan', 'parse', 'link', 'index', 'serialize', 'ics'):
+            self.assertGreaterEqual(phases.get(phase, 0), 1, phase)
+        self.assertEqual(requests['api_events'], 2)
+        self.assertEqual(requests['all_events_ics'], 1)
+        self.assertEqual((caches[('responses', 'miss')], caches[('responses', 'hit')]), (2, 1))
+        self.assertGreaterEqual(caches[('items', 'miss')], 2)
+
+    def test_prometheus_text_format(self):
+        registry = metrics.Metrics()
+        registry.count('responses', hits=2, misses=1)
+        with registry.phase('parse'):
+            pass
+        registry.observe_request('api_events', 0.25)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE opentrack_phase_seconds summary', lines)
+        self.assertIn('opentrack_phase_seconds_count{phase="parse"} 1', lines)
+        self.assertIn('opentrack_request_seconds_sum{endpoint="api_events"} 0.250000', lines)
+        self.assertIn('opentrack_cache_lookups_total{cache="responses",result="hit"} 2', lines)
+        self.assertIn('opentrack_cache_lookups_total{cache="responses",result="miss"} 1', lines)
+
+        self.client.get('/api/events')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.content_type, metrics.CONTENT_TYPE)
+        self.assertIn('opentrack_request_seconds_count{endpoint="api_events"}', response.get_data(as_text=True))
+
+    def test_registry_is_freed(self):
+        registry = weakref.ref(metrics.Metrics())
+        gc.collect()
+        self.assertIsNone(registry())
+
+
+class TestIcsFeeds(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_event('pycon', date='2030-05-01', end_date='2030-05-03', price={'min_amount': 1000, 'max_amount': 2500, 'currency': 'EUR'})
+        self.write_event('jsconf', date='2030-06-01', tags=['javascript'], location={'city': 'Paris', 'country': 'fr'})
+
+    def test_feed_matches_calendar_built_from_scratch(self):
+        cal = Calendar()
+        cal.add('prodid', '-//OpenTrack//opentrack.dev//')
+        cal.add('version', '2.0')
+        cal.add('x-wr-calname', 'OpenTrack.dev Events')
+        for event_data in load_events():
+            cal.add_component(calendar_feed.build_vevent(event_data))
+
+        self.assertEqual(self.client.get('/events.ics').data, cal.to_ical())
+        single = Calendar.from_ical(self.client.get('/event/pycon.ics').data)
+        self.assertIn('Price: 1 000 - 2 500 EUR', str(single.walk('VEVENT')[0]['description']))
+
+    def test_fragments_are_rendered_once_per_event_version(self):
+        with mock.patch.object(calendar_feed, 'build_vevent', wraps=calendar_feed.build_vevent) as build_vevent:
+            self.client.get('/events.ics')
+            self.client.get('/events.ics?tags=javascript')
+            self.client.get('/event/jsconf.ics')
+            self.assertEqual(build_vevent.call_count, 2)
+
+            self.write_event('jsconf', date='2030-06-02', tags=['javascript'])
+            feed = self.client.get('/events.ics').data
+            self.assertEqual(build_vevent.call_count, 3)
+            self.assertIn(b'DTSTART;VALUE=DATE:20300602', feed)
+
+    def test_single_event_calendar_is_cached_until_event_changes(self):
+        with mock.patch.object(calendar_feed.IcsFeed, 'calendar', autospec=True, side_effect=calendar_feed.IcsFeed.calendar) as calendar:
+            first = self.client.get('/event/pycon.ics').data
+            self.assertEqual(self.client.get('/event/pycon.ics').data, first)
+            self.assertEqual(calendar.call_count, 1)
+
+            self.write_event('jsconf', date='2030-06-02')
+            self.assertEqual(self.client.get('/event/pycon.ics').data, first)
+            self.assertEqual(calendar.call_count, 1)
+
+            self.write_event('pycon', date='2030-05-02')
+            self.assertIn(b'DTSTART;VALUE=DATE:20300502', self.client.get('/event/pycon.ics').data)
+            self.assertEqual(calendar.call_count, 2)
+        self.assertEqual(self.client.get('/event/missing.ics').status_code, 404)
+
+    def test_feed_is_assembled_once_per_catalog_change(self):
+        with mock.patch.object(calendar_feed.IcsFeed, 'calendar', autospec=True, side_effect=calendar_feed.IcsFeed.calendar) as calendar:
+            first = self.client.get('/events.ics?tags=javascript').data
+            self.assertEqual(self.client.get('/events.ics?tags=javascript', headers={'Accept-Encoding': 'gzip'}).status_code, 200)
+            self.assertEqual(calendar.call_count, 1)
+
+            self.write_event('jsconf', date='2030-06-02', tags=['javascript'])
+            self.assertNotEqual(self.client.get('/events.ics?tags=javascript').data, first)
+            self.assertEqual(calendar.call_count, 2)
+
+    def test_filtered_feed(self):
+        feed = self.client.get('/events.ics?tags=javascript').data
+        self.assertIn(b'UID:jsconf@opentrack.dev', feed)
+        self.assertNotIn(b'UID:pycon@opentrack.dev', feed)
+        self.assertTrue(feed.startswith(b'BEGIN:VCALENDAR') and feed.endswith(b'END:VCALENDAR\r\n'))
+
+
 if __name__ == '__main__':
     unittest.main()
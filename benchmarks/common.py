@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmarks: pointing the app at a generated data directory without network access."""
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+import app as app_module  # noqa: E402
+from geocoding import GeocodeCache, GeocodeWorker, GeocoderChain  # noqa: E402
+
+
+Location = namedtuple('Location', 'latitude longitude')
+
+
+class FakeGeocoder:
+    """Stands in for Nominatim: answers every query at once with made-up, but stable, coordinates."""
+
+    offline = False
+
+    def geocode(self, query):
+        rng = random.Random(query)
+        return Location(rng.uniform(-60, 70), rng.uniform(-180, 180))
+
+
+def use_data_root(root, poll_interval=3600):
+    """
+    Points the app module at `root`, with a fresh catalog and the fake geocoder behind the gazetteer
+    instead of Nominatim. Returns the module.
+    """
+    cache_dir = os.path.join(root, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app_module.DATA_ROOT = root
+    app_module.EVENTS_DIR = os.path.join(root, 'events')
+    app_module.ORGANIZERS_DIR = os.path.join(root, 'organizers')
+    app_module.LANGUAGES_DIR = os.path.join(root, 'languages')
+    app_module.CURRENCIES_DIR = os.path.join(root, 'currencies')
+    app_module.COUNTRIES_DIR = os.path.join(root, 'countries')
+    app_module.CACHE_DIR = cache_dir
+    app_module.SNAPSHOT_FILE = os.path.join(cache_dir, 'catalog.snapshot')
+    app_module.geocoder = GeocoderChain([app_module.gazetteer, FakeGeocoder()])
+    app_module.geocode_cache = GeocodeCache(os.path.join(cache_dir, 'geocoding.sqlite3'))
+    app_module.geocode_worker = GeocodeWorker(app_module.geocoder, app_module.geocode_cache)
+    app_module.catalog = app_module.Catalog(poll_interval=poll_interval)
+    reset_caches()
+    return app_module
+
+
+def reset_caches():
+    """Forgets everything parsed so far, so the next load_events() parses every file again."""
+    app_module._item_records.clear()
+    app_module._linked_events = {}
+
+
+def best_of(runs, func):
+    """Returns the fastest wall-clock time of `runs` calls of `func`, in seconds."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,125 @@
+"""
+Generates a synthetic data directory (events, organizers, languages, currencies, countries) and
+fills its geocoding cache with the cities of the events that have no coordinates.
+
+    python benchmarks/generate_data.py OUTPUT_DIR --events 10000 [--seed 1] [--geocoded 0.8] [--no-geocode-cache]
+
+The same seed always produces the same files, so runs on different machines are comparable.
+"""
+import argparse
+import os
+import random
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app'))
+
+from geocoding import GeocodeCache  # noqa: E402
+
+
+COUNTRIES = [
+    ('de', 'Germany', '🇩🇪', ['Berlin', 'Munich', 'Hamburg', 'Cologne']),
+    ('fr', 'France', '🇫🇷', ['Paris', 'Lyon', 'Marseille', 'Toulouse']),
+    ('nl', 'Netherlands', '🇳🇱', ['Amsterdam', 'Rotterdam', 'Utrecht']),
+    ('gb', 'United Kingdom', '🇬🇧', ['London', 'Manchester', 'Edinburgh']),
+    ('us', 'United States', '🇺🇸', ['New York', 'San Francisco', 'Austin', 'Seattle']),
+    ('jp', 'Japan', '🇯🇵', ['Tokyo', 'Osaka']),
+    ('br', 'Brazil', '🇧🇷', ['São Paulo', 'Rio de Janeiro']),
+    ('in', 'India', '🇮🇳', ['Bangalore', 'Mumbai', 'Delhi']),
+]
+LANGUAGES = [('en', 'English'), ('de', 'German'), ('fr', 'French'), ('ja', 'Japanese'), ('pt', 'Portuguese')]
+CURRENCIES = [('eur', 'Euro', '€'), ('usd', 'US Dollar', '$'), ('gbp', 'Pound Sterling', '£'), ('jpy', 'Yen', '¥')]
+TYPES = ['Conference', 'Meetup', 'Exhibition']
+TAGS = ['python', 'javascript', 'rust', 'go', 'java', 'devops', 'cloud', 'ai', 'data', 'security', 'web', 'mobile']
+WORDS = ('community talks workshops speakers developers open source keynote hands-on networking '
+         'sessions ecosystem production scaling testing tooling performance').split()
+
+
+def write_item(root, kind_dir, item_id, yaml_name, data, description=None):
+    item_path = os.path.join(root, kind_dir, item_id)
+    os.makedirs(item_path, exist_ok=True)
+    with open(os.path.join(item_path, yaml_name), 'w') as f:
+        yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+    if description is not None:
+        with open(os.path.join(item_path, 'description.md'), 'w') as f:
+            f.write(description)
+
+
+def paragraph(rng, words=60):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def fill_geocode_cache(root, places):
+    """Stores made-up coordinates for (city, country name) pairs in the geocoding cache of the data directory."""
+    cache_dir = os.path.join(root, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = GeocodeCache(os.path.join(cache_dir, 'geocoding.sqlite3'))
+    for city, country in sorted(places):
+        rng = random.Random(f'{city}/{country}')
+        # The key app.geocode_candidates() uses for a location without a street address
+        cache.put(f", {city}, {country}", {'latitude': round(rng.uniform(-60, 70), 5), 'longitude': round(rng.uniform(-180, 180), 5)})
+    cache.flush()
+
+
+def generate(root, events, seed=1, organizers=None, geocoded=0.8, geocode_cache=True):
+    """
+    Writes `events` events into `root`. A `geocoded` share of them has coordinates in event.yaml;
+    the others only name their city, like most community-submitted events. With `geocode_cache`
+    those cities are already in the geocoding cache, as on a server that has been running a while.
+    """
+    rng = random.Random(seed)
+    organizers = organizers or max(1, events // 20)
+    places = set()
+
+    for code, name, icon, _ in COUNTRIES:
+        write_item(root, 'countries', code, 'country.yaml', {'name': name, 'icon': icon})
+    for code, name in LANGUAGES:
+        write_item(root, 'languages', code, 'language.yaml', {'name': name})
+    for code, name, symbol in CURRENCIES:
+        write_item(root, 'currencies', code, 'currency.yaml', {'name': name, 'symbol': symbol})
+    for i in range(organizers):
+        write_item(root, 'organizers', f'org-{i}', 'organizer.yaml', {'name': f'Organizer {i}', 'url': f'https://org-{i}.example.com'},
+                   description='\n\n'.join(paragraph(rng, 80) for _ in range(3)))
+
+    for i in range(events):
+        code, country, _, cities = rng.choice(COUNTRIES)
+        location = {'city': rng.choice(cities), 'country': code}
+        if rng.random() < geocoded:
+            location.update(latitude=round(rng.uniform(-60, 70), 5), longitude=round(rng.uniform(-180, 180), 5))
+        else:
+            places.add((location['city'], country))
+        data = {
+            'title': f'{rng.choice(TAGS).title()} {rng.choice(TYPES)} {i}',
+            'date': f'{rng.randint(2020, 2030)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'type': rng.choice(TYPES),
+            'organizer': f'org-{rng.randrange(organizers)}',
+            'language': rng.choice(LANGUAGES)[0],
+            'tags': rng.sample(TAGS, 3),
+            'url': f'https://events.example.com/{i}',
+            'online': rng.random() < 0.2,
+            'location': location,
+            'price': 'free' if rng.random() < 0.3 else {'amount': rng.randint(10, 900), 'currency': rng.choice(CURRENCIES)[0].upper()},
+        }
+        write_item(root, 'events', f'event-{i:06d}', 'event.yaml', data,
+                   description='## About\n\n' + '\n\n'.join(paragraph(rng) for _ in range(4)))
+
+    if geocode_cache:
+        fill_geocode_cache(root, places)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic OpenTrack data directory.")
+    parser.add_argument('output', help="data directory to create")
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--geocoded', type=float, default=0.8, help="share of events with coordinates in event.yaml")
+    parser.add_argument('--geocode-cache', action=argparse.BooleanOptionalAction, default=True,
+                        help="store the cities of the other events in the geocoding cache")
+    args = parser.parse_args(argv)
+    generate(args.output, args.events, seed=args.seed, geocoded=args.geocoded, geocode_cache=args.geocode_cache)
+    print(f"Generated {args.events} events in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
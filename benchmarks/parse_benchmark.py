@@ -0,0 +1,57 @@
+"""
+Measures a full (cold) load_events() with the pure-Python YAML parser, with libyaml, and with
+libyaml in a process pool:
+
+    python benchmarks/parse_benchmark.py [--sizes 1000,10000,50000] [--workers N] [--runs 3]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import yaml
+
+from common import app_module, best_of, reset_caches, use_data_root
+from generate_data import generate
+
+
+def cold_load():
+    reset_caches()
+    return app_module.load_events()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parsing of the data directory.")
+    parser.add_argument('--sizes', default='1000,10000,50000', help="comma-separated event counts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="process pool size")
+    parser.add_argument('--runs', type=int, default=3, help="runs per configuration (the fastest is reported)")
+    args = parser.parse_args(argv)
+
+    configurations = [
+        ('python', yaml.SafeLoader, 1),
+        ('libyaml', getattr(yaml, 'CSafeLoader', yaml.SafeLoader), 1),
+        (f'libyaml x{args.workers}', getattr(yaml, 'CSafeLoader', yaml.SafeLoader), args.workers),
+    ]
+    print(f"{'events':>8}  " + "  ".join(f"{name:>14}" for name, _, _ in configurations))
+    for size in (int(s) for s in args.sizes.split(',')):
+        root = tempfile.mkdtemp(prefix='opentrack-bench-')
+        try:
+            generate(root, size)
+            use_data_root(root)
+            expected = None
+            timings = []
+            for _, loader, workers in configurations:
+                app_module.YamlLoader = loader
+                app_module.PARSE_WORKERS = workers
+                timings.append(best_of(args.runs, cold_load))
+                # Every configuration must produce exactly the same catalog
+                events = cold_load()
+                assert expected is None or events == expected, "parsers disagree"
+                expected = events
+            print(f"{size:>8}  " + "  ".join(f"{t:>13.2f}s" for t in timings))
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
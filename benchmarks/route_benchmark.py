@@ -0,0 +1,98 @@
+"""
+Times load_events(), the catalog build and every route with Flask's test client on generated data
+directories, using a fake geocoder instead of Nominatim:
+
+    python benchmarks/route_benchmark.py [--sizes 100,1000,10000,50000] [--runs 3] [--metrics]
+
+Routes are timed cold (the response has to be built from the loaded catalog) and warm (served
+from the response cache). With --metrics the /metrics output of the largest size is printed.
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from common import app_module, best_of, reset_caches, use_data_root
+from generate_data import generate
+
+
+ROUTES = [
+    '/',
+    '/api/events',
+    '/api/events?view=summary',
+    '/api/events?format=normalized',
+    '/api/events?country=de&time=future&limit=50&facets=all',
+    '/api/events/{event_id}',
+    '/api/search?q=python+meetup',
+    '/api/coordinates',
+    '/api/map?bbox=-180,-85,180,85&zoom=3',
+    '/events.ics',
+    '/event/{event_id}.ics',
+]
+
+
+def cold_load():
+    reset_caches()
+    return app_module.load_events()
+
+
+def forget_responses():
+    """Drops the memoized responses and the map index, so the next request builds them again."""
+    catalog = app_module.catalog
+    catalog.responses.clear()
+    catalog._spatial = None
+
+
+def time_request(client, url, cold):
+    if cold:
+        forget_responses()
+    start = time.perf_counter()
+    response = client.get(url)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, f"{url}: {response.status_code}"
+    return elapsed, len(response.get_data())
+
+
+def run(size, runs):
+    catalog = app_module.catalog
+    load = best_of(runs, cold_load)
+    reload = best_of(runs, app_module.load_events)
+    start = time.perf_counter()
+    reset_caches()
+    catalog.refresh(force=True)
+    build = time.perf_counter() - start
+    print(f"\n{size} events: load_events {load:.2f}s cold, {reload:.2f}s unchanged; catalog build {build:.2f}s")
+
+    client = app_module.app.test_client()
+    event_id = catalog.events[len(catalog.events) // 2]['id']
+    print(f"  {'route':<58} {'cold':>10} {'warm':>10} {'size':>10}")
+    for route in ROUTES:
+        url = route.format(event_id=event_id)
+        cold = min(time_request(client, url, cold=True) for _ in range(runs))
+        warm = min(time_request(client, url, cold=False) for _ in range(runs))
+        print(f"  {url:<58} {cold[0] * 1000:>8.1f}ms {warm[0] * 1000:>8.1f}ms {cold[1] / 1024:>8.0f}kB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading and serving the catalog.")
+    parser.add_argument('--sizes', default='100,1000,10000,50000', help="comma-separated event counts")
+    parser.add_argument('--runs', type=int, default=3, help="runs per measurement (the fastest is reported)")
+    parser.add_argument('--metrics', action='store_true', help="print the /metrics output at the end")
+    args = parser.parse_args(argv)
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        root = tempfile.mkdtemp(prefix='opentrack-bench-')
+        try:
+            generate(root, size)
+            use_data_root(root)
+            run(size, args.runs)
+        finally:
+            shutil.rmtree(root)
+
+    if args.metrics:
+        print()
+        print(app_module.app.test_client().get('/metrics').get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    main()